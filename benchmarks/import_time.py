@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure the import time of the Manuscripts modules and the startup
+time of the command line tools. Each measure runs in a new interpreter,
+so nothing is cached between them.
+
+    benchmarks/import_time.py [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "manuscripts.esquery",
+    "manuscripts.report",
+    "manuscripts2.elasticsearch",
+    "manuscripts2.report",
+    "matplotlib.pyplot",
+    "pandas",
+    "elasticsearch_dsl"
+]
+
+COMMANDS = [
+    ["bin/manuscripts", "--help"],
+    ["bin/manuscripts2", "--help"],
+    ["bin/manuscripts2", "--version"]
+]
+
+
+def time_run(args, repeat):
+    """
+    Run a python command several times and get the best wall time
+
+    :param args: arguments for the python interpreter
+    :param repeat: number of runs
+    :returns: the min time in seconds of the runs
+    """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and startup times")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of each measure (default: 5)")
+    args = parser.parse_args()
+
+    baseline = time_run(["-c", "pass"], args.repeat)
+    print("{:<40} {:>10}".format("python interpreter", "%.3fs" % baseline))
+
+    for module in MODULES:
+        elapsed = time_run(["-c", "import " + module], args.repeat)
+        print("{:<40} {:>10}".format("import " + module, "%.3fs" % (elapsed - baseline)))
+
+    for command in COMMANDS:
+        elapsed = time_run(command, args.repeat)
+        print("{:<40} {:>10}".format(" ".join(command), "%.3fs" % elapsed))
+
+
+if __name__ == '__main__':
+    main()
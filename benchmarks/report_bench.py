@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Time the generation of each section and of the full report with
+manuscripts and manuscripts2, using the indices loaded by synthetic.py.
+The results are stored in a JSON file which can be compared with the
+results of a previous run to detect regressions.
+
+    benchmarks/synthetic.py --docs 100000
+    benchmarks/report_bench.py --name 100k
+    benchmarks/report_bench.py --name 100k --compare benchmarks/results/100k-<date>.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from manuscripts.profiler import profiler
+
+from synthetic import DEFAULT_START, DEFAULT_END, MAPPINGS
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+# A timing this much slower than the one compared with is a regression
+REGRESSION_THRESHOLD = 1.2
+
+logger = logging.getLogger(__name__)
+
+
+def time_call(func):
+    """Run a function and return its wall time in seconds"""
+
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_manuscripts(args, data_dir):
+    """
+    Time the sections of a report created with manuscripts
+
+    :returns: a dict with the seconds spent in each section
+    """
+
+    from manuscripts.report import Report
+
+    report = Report(args.elastic_url, start=args.start, end=args.end, data_dir=data_dir,
+                    interval=args.interval, data_sources=args.data_sources,
+                    indices=[args.prefix + ds for ds in args.data_sources],
+                    report_name="Benchmark")
+
+    timings = {}
+    for section, create_section in report.sections().items():
+        with profiler.in_section(section):
+            timings[section] = time_call(create_section)
+    if args.pdf:
+        timings["pdf"] = time_call(report.create_pdf)
+    return timings
+
+
+def bench_manuscripts2(args, data_dir):
+    """
+    Time the sections of a report created with manuscripts2
+
+    :returns: a dict with the seconds spent in each section
+    """
+
+    from manuscripts2.report import Report
+
+    report = Report(es_url=args.elastic_url, start=args.start, end=args.end, data_dir=data_dir,
+                    interval=args.interval, data_sources=args.data_sources,
+                    indices=[args.prefix + ds for ds in args.data_sources],
+                    report_name="Benchmark")
+
+    sections = [
+        ("overview", report.get_sec_overview),
+        ("activity", report.get_sec_project_activity),
+        ("community", report.get_sec_project_community),
+        ("process", report.get_sec_project_process)
+    ]
+
+    timings = {}
+    for section, create_section in sections:
+        with profiler.in_section(section):
+            timings[section] = time_call(create_section)
+    if args.pdf:
+        timings["pdf"] = time_call(report.create_pdf)
+    return timings
+
+
+BENCHMARKS = {
+    "manuscripts": bench_manuscripts,
+    "manuscripts2": bench_manuscripts2
+}
+
+
+def run(args):
+    """Run the benchmarks of each package and collect the results"""
+
+    results = {
+        "name": args.name,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "elastic_url": args.elastic_url,
+        "data_sources": args.data_sources,
+        "interval": args.interval,
+        "repeat": args.repeat,
+        "packages": {}
+    }
+
+    profiler.enabled = True
+    for package in args.packages:
+        runs = []
+        for _ in range(args.repeat):
+            data_dir = tempfile.mkdtemp(prefix="bench_" + package + "_")
+            profiler.reset()
+            try:
+                timings = BENCHMARKS[package](args, data_dir)
+            finally:
+                shutil.rmtree(data_dir)
+            timings["total"] = sum(timings.values())
+            runs.append(timings)
+
+        # The best run of each section is the less noisy measure
+        best = {section: min(run[section] for run in runs) for section in runs[0]}
+        results["packages"][package] = {
+            "best": best,
+            "runs": runs,
+            "sections": profiler.to_dict()["sections"]
+        }
+        logger.info("%s report done in %.2fs", package, best["total"])
+
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare the best timings of two benchmark runs
+
+    :param results: results of the current run
+    :param baseline: results of the run to compare with
+    :param threshold: ratio from which a timing is considered a regression
+    :returns: a list of lines with the comparison and the number of regressions
+    """
+
+    lines = []
+    regressions = 0
+    for package, data in results["packages"].items():
+        if package not in baseline["packages"]:
+            continue
+        base = baseline["packages"][package]["best"]
+        for section, elapsed in data["best"].items():
+            if section not in base or not base[section]:
+                continue
+            ratio = elapsed / base[section]
+            mark = ""
+            if ratio > threshold:
+                mark = "REGRESSION"
+                regressions += 1
+            lines.append("{:<14} {:<32} {:>9.3f}s {:>9.3f}s {:>6.2f}x {}".format(
+                package, section, base[section], elapsed, ratio, mark))
+    return lines, regressions
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Time the report generation with synthetic indices")
+    parser.add_argument('-u', '--elastic-url', default="http://localhost:9200",
+                        help="Elasticsearch URL (default: http://localhost:9200)")
+    parser.add_argument('--data-sources', nargs='*', default=sorted(MAPPINGS),
+                        help="Data sources included in the report (default: all)")
+    parser.add_argument('--prefix', default="bench_", help="Prefix of the index names (default: bench_)")
+    parser.add_argument('--packages', nargs='*', default=sorted(BENCHMARKS),
+                        help="Packages to be benchmarked (default: all)")
+    parser.add_argument('-s', '--start-date', default=DEFAULT_START,
+                        help="Start date of the report (default: %s)" % DEFAULT_START)
+    parser.add_argument('-e', '--end-date', default=DEFAULT_END,
+                        help="End date of the report (default: %s)" % DEFAULT_END)
+    parser.add_argument('-i', '--interval', default="quarter", help="Analysis interval (default: quarter)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each benchmark (default: 3)")
+    parser.add_argument('--pdf', action='store_true', help="Include the PDF generation")
+    parser.add_argument('--name', default="bench", help="Name of the run, used in the results file")
+    parser.add_argument('-o', '--output', help="Results file (default: benchmarks/results/<name>-<date>.json)")
+    parser.add_argument('--compare', help="Results file of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio reported as a regression (default: %.1f)" % REGRESSION_THRESHOLD)
+    parser.add_argument('-g', '--debug', action='store_true')
+
+    args = parser.parse_args()
+    args.start = datetime.strptime(args.start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    args.end = datetime.strptime(args.end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return args
+
+
+def main():
+    args = get_params()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(message)s')
+
+    results = run(args)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "%s-%s.json" % (args.name, time.strftime("%Y%m%d-%H%M%S")))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print("Results written to", output)
+
+    for package, data in results["packages"].items():
+        for section, elapsed in data["best"].items():
+            print("{:<14} {:<32} {:>9.3f}s".format(package, section, elapsed))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\nCompared with", args.compare)
+        print("\n".join(lines))
+        if regressions:
+            print("%i regressions found" % regressions)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Generate synthetic git, github_issues and github_prs enriched documents,
+with the mappings used in the tests, and bulk load them in Elasticsearch.
+
+    benchmarks/synthetic.py -u http://localhost:9200 --docs 100000 --authors 1000
+
+Documents are generated in a deterministic way for a given seed. The
+activity of authors, organizations and projects follows a long tail
+distribution, as in real communities.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPPINGS_DIR = os.path.join(ROOT_DIR, "tests", "data", "mappings")
+
+# Mappings file used for each data source
+MAPPINGS = {
+    "git": "git_commit_mappings.json",
+    "github_issues": "github_issues_mappings.json",
+    "github_prs": "github_prs_mappings.json"
+}
+
+DEFAULT_START = "2015-01-01"
+DEFAULT_END = "2019-01-01"
+
+logger = logging.getLogger(__name__)
+
+
+def load_mappings(data_source):
+    """
+    Load the mappings of the enriched index of a data source
+
+    :param data_source: git, github_issues or github_prs
+    :returns: a dict with the mappings, ready to create an index
+    """
+
+    with open(os.path.join(MAPPINGS_DIR, MAPPINGS[data_source])) as f:
+        mappings = json.load(f)
+
+    # Project fields are added to all the indices when projects are configured
+    mappings['mappings']['items']['properties'].setdefault('project', {"type": "keyword"})
+    return mappings
+
+
+class Community():
+    """Set of authors, organizations and projects from which synthetic
+    documents are built. Each author belongs to an organization.
+
+    :param authors: number of different authors
+    :param orgs: number of different organizations
+    :param projects: number of different projects (repositories)
+    :param start: datetime of the first document
+    :param end: datetime after the last document
+    :param seed: seed for the random generator
+    """
+
+    def __init__(self, authors=100, orgs=10, projects=5, start=None, end=None, seed=0):
+        self.rng = random.Random(seed)
+        self.start = start or datetime.strptime(DEFAULT_START, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        self.end = end or datetime.strptime(DEFAULT_END, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        self.span = (self.end - self.start).total_seconds()
+        self._weights = {}
+
+        self.orgs = ["Org %i" % i for i in range(orgs)]
+        self.projects = ["project-%i" % i for i in range(projects)]
+        self.authors = []
+        for i in range(authors):
+            uuid = hashlib.sha1(("author-%i-%i" % (seed, i)).encode('utf-8')).hexdigest()
+            org = self.orgs[self.pick(orgs)]
+            self.authors.append({
+                "uuid": uuid,
+                "name": "Author %i" % i,
+                "login": "author%i" % i,
+                "org": org,
+                "domain": org.lower().replace(" ", "") + ".com"
+            })
+
+    def pick(self, size):
+        """Pick an index in range(size) following a long tail distribution"""
+
+        if size not in self._weights:
+            self._weights[size] = list(accumulate(1 / (i + 1) for i in range(size)))
+        return self.rng.choices(range(size), cum_weights=self._weights[size])[0]
+
+    def author(self):
+        return self.authors[self.pick(len(self.authors))]
+
+    def project(self):
+        return self.projects[self.pick(len(self.projects))]
+
+    def date(self):
+        return self.start + timedelta(seconds=self.rng.uniform(0, self.span))
+
+    def sha(self, *args):
+        return hashlib.sha1(("-".join(str(arg) for arg in args)).encode('utf-8')).hexdigest()
+
+
+def iso(date):
+    return date.isoformat()
+
+
+def author_fields(prefix, author):
+    """Identity fields added by the enrichment for a role (author, user...)"""
+
+    return {
+        prefix + "_id": author['uuid'],
+        prefix + "_uuid": author['uuid'],
+        prefix + "_name": author['name'],
+        prefix + "_user_name": author['login'],
+        prefix + "_domain": author['domain'],
+        prefix + "_org_name": author['org'],
+        prefix + "_bot": False,
+        prefix + "_gender": "Unknown",
+        prefix + "_gender_acc": 0
+    }
+
+
+def generate_git(community, num_docs):
+    """
+    Generate enriched git commits
+
+    :param community: Community object with the authors, orgs and projects
+    :param num_docs: number of documents to be generated
+    :returns: a generator of documents
+    """
+
+    rng = community.rng
+    for i in range(num_docs):
+        author = community.author()
+        project = community.project()
+        date = community.date()
+        commit_hash = community.sha("commit", i)
+        added = int(rng.expovariate(1 / 40))
+        removed = int(rng.expovariate(1 / 20))
+        repo = "https://github.com/synthetic/" + project + ".git"
+
+        doc = {
+            "uuid": commit_hash,
+            "git_uuid": commit_hash,
+            "hash": commit_hash,
+            "hash_short": commit_hash[:6],
+            "message": "Commit %i" % i,
+            "title": "Commit %i" % i,
+            "author_date": iso(date.replace(tzinfo=None)),
+            "commit_date": iso(date.replace(tzinfo=None)),
+            "utc_author": iso(date.replace(tzinfo=None)),
+            "utc_commit": iso(date.replace(tzinfo=None)),
+            "grimoire_creation_date": iso(date),
+            "metadata__updated_on": iso(date),
+            "metadata__timestamp": iso(date),
+            "tz": 0,
+            "time_to_commit_hours": 0,
+            "files": rng.randint(1, 10),
+            "lines_added": added,
+            "lines_removed": removed,
+            "lines_changed": added + removed,
+            "committer_name": author['name'],
+            "committer_domain": author['domain'],
+            "git_author_domain": author['domain'],
+            "origin": repo,
+            "tag": repo,
+            "repo_name": repo,
+            "github_repo": "synthetic/" + project,
+            "url_id": "synthetic/" + project + "/commit/" + commit_hash,
+            "project": project,
+            "project_1": project,
+            "is_git_commit": 1,
+            "is_git_commit_multi_author": 0,
+            "is_git_commit_signed_off": 0
+        }
+        doc.update(author_fields("author", author))
+        del doc["author_user_name"]
+        yield doc
+
+
+def generate_github_items(community, num_docs, pull_requests):
+    """
+    Generate enriched GitHub issues or pull requests
+
+    :param community: Community object with the authors, orgs and projects
+    :param num_docs: number of documents to be generated
+    :param pull_requests: generate pull requests instead of issues
+    :returns: a generator of documents
+    """
+
+    rng = community.rng
+    kind = "pull" if pull_requests else "issues"
+    for i in range(num_docs):
+        author = community.author()
+        project = community.project()
+        created_at = community.date()
+        repo = "https://github.com/synthetic/" + project
+        closed = rng.random() < 0.8
+        closed_at = None
+        time_to_close_days = None
+        if closed:
+            time_to_close_days = round(rng.expovariate(1 / 7), 2)
+            closed_at = created_at + timedelta(days=time_to_close_days)
+        updated_at = closed_at or created_at
+        time_open_days = time_to_close_days if closed else round((community.end - created_at).days, 2)
+
+        doc = {
+            "uuid": community.sha(kind, i),
+            "id": i,
+            "id_in_repo": str(i),
+            "title": "Item %i" % i,
+            "state": "closed" if closed else "open",
+            "created_at": iso(created_at),
+            "updated_at": iso(updated_at),
+            "closed_at": iso(closed_at) if closed_at else None,
+            "grimoire_creation_date": iso(created_at),
+            "metadata__updated_on": iso(updated_at),
+            "metadata__timestamp": iso(updated_at),
+            "time_to_close_days": time_to_close_days,
+            "time_open_days": time_open_days,
+            "labels": "",
+            "pull_request": pull_requests,
+            "item_type": "pull request" if pull_requests else "issue",
+            "origin": repo,
+            "tag": repo,
+            "repository": repo,
+            "github_repo": "synthetic/" + project,
+            "url": repo + "/" + kind + "/" + str(i),
+            "url_id": "synthetic/" + project + "/" + kind + "/" + str(i),
+            "project": project,
+            "user_login": author['login'],
+            "user_name": author['name'],
+            "user_domain": author['domain'],
+            "user_org": author['org']
+        }
+        doc.update(author_fields("author", author))
+        doc.update(author_fields("user_data", author))
+
+        if pull_requests:
+            merged = closed and rng.random() < 0.7
+            doc.update({
+                "is_github_pull_request": 1,
+                "merged": merged,
+                "merged_at": doc["closed_at"] if merged else None,
+                "code_merge_duration": time_to_close_days if merged else None,
+                "num_review_comments": rng.randint(0, 10),
+                "forks": 0,
+                "time_to_merge_request_response": None
+            })
+        else:
+            doc["is_github_issue"] = 1
+            doc["time_to_first_attention"] = None
+        yield doc
+
+
+def generate(data_source, community, num_docs):
+    """
+    Generate enriched documents for a data source
+
+    :param data_source: git, github_issues or github_prs
+    :param community: Community object with the authors, orgs and projects
+    :param num_docs: number of documents to be generated
+    :returns: a generator of documents
+    """
+
+    if data_source == "git":
+        return generate_git(community, num_docs)
+    elif data_source == "github_issues":
+        return generate_github_items(community, num_docs, pull_requests=False)
+    elif data_source == "github_prs":
+        return generate_github_items(community, num_docs, pull_requests=True)
+    raise RuntimeError("Data source not supported", data_source)
+
+
+def index_action(index, doc):
+    """Build the bulk action to index a document, as in the test indices dumps"""
+
+    return {"_index": index, "_type": "items", "_id": doc["uuid"], "_source": doc}
+
+
+def bulk_load(es, index, data_source, docs, chunk_size=5000):
+    """
+    Create an index with the mappings of a data source and bulk load documents in it.
+    The refresh of the index is disabled during the load.
+
+    :param es: Elasticsearch client
+    :param index: name of the index, it is deleted if it already exists
+    :param data_source: git, github_issues or github_prs
+    :param docs: iterable of documents
+    :param chunk_size: number of documents per bulk request
+    :returns: the number of documents loaded
+    """
+
+    from elasticsearch import helpers
+
+    if es.indices.exists(index=index):
+        es.indices.delete(index=index)
+    es.indices.create(index=index, body=load_mappings(data_source))
+    es.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1"}})
+
+    actions = (index_action(index, doc) for doc in docs)
+    loaded, _ = helpers.bulk(es, actions, chunk_size=chunk_size, raise_on_error=True)
+
+    es.indices.put_settings(index=index, body={"index": {"refresh_interval": "1s"}})
+    es.indices.refresh(index=index)
+    return loaded
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Load synthetic enriched indices in Elasticsearch")
+    parser.add_argument('-u', '--elastic-url', default="http://localhost:9200",
+                        help="Elasticsearch URL (default: http://localhost:9200)")
+    parser.add_argument('--data-sources', nargs='*', default=sorted(MAPPINGS),
+                        help="Data sources to be generated (default: all)")
+    parser.add_argument('--docs', type=int, default=10000,
+                        help="Number of documents per data source (default: 10000)")
+    parser.add_argument('--authors', type=int, default=100, help="Number of authors (default: 100)")
+    parser.add_argument('--orgs', type=int, default=10, help="Number of organizations (default: 10)")
+    parser.add_argument('--projects', type=int, default=5, help="Number of projects (default: 5)")
+    parser.add_argument('-s', '--start-date', default=DEFAULT_START,
+                        help="Date of the first document (default: %s)" % DEFAULT_START)
+    parser.add_argument('-e', '--end-date', default=DEFAULT_END,
+                        help="Date after the last document (default: %s)" % DEFAULT_END)
+    parser.add_argument('--prefix', default="bench_", help="Prefix of the index names (default: bench_)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the random generator")
+    parser.add_argument('--output', help="Write the documents to JSON lines files in this directory "
+                                         "instead of loading them in Elasticsearch")
+    return parser.parse_args()
+
+
+def main():
+    args = get_params()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    start = datetime.strptime(args.start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    end = datetime.strptime(args.end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+    es = None
+    if not args.output:
+        from elasticsearch import Elasticsearch
+        es = Elasticsearch([args.elastic_url], timeout=3600)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+
+    for data_source in args.data_sources:
+        if data_source not in MAPPINGS:
+            logger.error("Data source not supported: %s", data_source)
+            sys.exit(1)
+        community = Community(args.authors, args.orgs, args.projects, start, end, args.seed)
+        docs = generate(data_source, community, args.docs)
+        index = args.prefix + data_source
+
+        before = time.perf_counter()
+        if es:
+            loaded = bulk_load(es, index, data_source, docs)
+        else:
+            loaded = 0
+            with open(os.path.join(args.output, index + ".json"), "w") as f:
+                for doc in docs:
+                    f.write(json.dumps(index_action(index, doc)) + "\n")
+                    loaded += 1
+        logger.info("%i %s documents loaded in %s in %.2fs", loaded, data_source, index,
+                    time.perf_counter() - before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Backfill of reports: the reports of many periods, all of them with the
+same start date and ending at consecutive intervals, are generated in one
+run. The reports are generated from the longest period to the shortest,
+and the time series searches of each report are answered with the buckets
+of the same time series got for a longer period, when the end of the
+report is the start of one of its buckets, so the history is only queried
+once. The rest of the searches (the aggregations and top lists of the
+last interval of each period) are sent to Elasticsearch, once for all the
+reports sending the same search.
+"""
+
+import logging
+import threading
+
+from dateutil import relativedelta
+
+from .clients import add_client_wrapper, request_key, search_body
+from .incremental import get_histogram, without_end
+from .memory_engine import to_timestamp
+from .plan import get_date_ranges
+
+logger = logging.getLogger(__name__)
+
+# Time between the end dates of the reports of each interval
+INTERVAL_STEPS = {
+    "month": relativedelta.relativedelta(months=1),
+    "quarter": relativedelta.relativedelta(months=3),
+    "year": relativedelta.relativedelta(years=1)
+}
+
+
+def get_end_dates(first_end, last_end, interval):
+    """
+    Get the end dates of the reports of a backfill
+
+    :param first_end: end date of the first report
+    :param last_end: end date of the last report
+    :param interval: interval of the reports: month, quarter or year
+    :returns: a list with the end dates, from the first report to the last one
+    """
+
+    if interval not in INTERVAL_STEPS:
+        raise RuntimeError("Interval not supported ", interval)
+
+    ends = []
+    end = first_end
+    while end < last_end:
+        ends.append(end)
+        end = first_end + INTERVAL_STEPS[interval] * len(ends)
+    ends.append(last_end)
+    return ends
+
+
+def get_end(body, field):
+    """
+    Get the end of the date range of a field in a search
+
+    :param body: body of the search
+    :param field: date field
+    :returns: the first millisecond after the range, or None if the range has no end
+    """
+
+    bounds = get_date_ranges(body.get("query", {})).get(field, {})
+    try:
+        if "lt" in bounds:
+            return to_timestamp(bounds["lt"]).value // 10 ** 6
+        if "lte" in bounds:
+            return to_timestamp(bounds["lte"]).value // 10 ** 6 + 1
+    except ValueError:
+        # Date math, like now-1y
+        pass
+    return None
+
+
+class BackfillClient():
+    """Elasticsearch client which answers the time series searches with the
+    buckets of the same time series got for a longer period, and the rest
+    of the searches already sent with their responses.
+
+    :param client: Elasticsearch client used to run the searches
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.series = {}
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        key = request_key(index, body, params)
+        with self._lock:
+            if key in self.responses:
+                return self.responses[key]
+
+        name, histogram = get_histogram(body)
+        end = get_end(body, histogram["field"]) if name else None
+        if end is not None:
+            series_key = request_key(index, without_end(body), params)
+            with self._lock:
+                stored = self.series.get(series_key)
+            response = self.slice(stored, name, end) if stored else None
+            if response:
+                return response
+
+        response = self.client.search(index=index, body=body, **params)
+        with self._lock:
+            self.responses[key] = response
+            if end is not None and (series_key not in self.series or self.series[series_key][0] < end):
+                self.series[series_key] = (end, response)
+        return response
+
+    def slice(self, stored, name, end):
+        """
+        Get the response of a time series search from the one of a longer period
+
+        :param stored: tuple with the end and the response of the longer period
+        :param name: name of the date_histogram aggregation
+        :param end: first millisecond after the period of the search
+        :returns: the response of the search, or None if it can not be got
+                  because the period does not end at the start of a bucket
+        """
+
+        stored_end, response = stored
+        buckets = response["aggregations"][name]["buckets"]
+        if end > stored_end or (end < stored_end and end not in [bucket["key"] for bucket in buckets]):
+            return None
+
+        buckets = [bucket for bucket in buckets if bucket["key"] < end]
+        total = sum(bucket["doc_count"] for bucket in buckets)
+        hits = dict(response["hits"])
+        hits["total"] = dict(hits["total"], value=total) if isinstance(hits["total"], dict) else total
+
+        response = dict(response, hits=hits)
+        response["aggregations"] = dict(response["aggregations"])
+        response["aggregations"][name] = dict(response["aggregations"][name], buckets=buckets)
+        logger.debug("Time series of %i intervals taken from a longer period", len(buckets))
+        return response
+
+
+def backfill_searches():
+    """
+    Answer the searches from now on with the responses got for the
+    reports of longer periods, when possible
+    """
+
+    add_client_wrapper(BackfillClient)
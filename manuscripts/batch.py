@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Batch runner: generate many reports with a pool of worker processes,
+checkpointing each section of each report in a state file, so a batch
+stopped or failed halfway resumes where it stopped when run again.
+
+A batch is a JSON file with a list of reports, each one with the params
+of the command line (elastic_url, data_dir, data_sources, indices,
+start_date, end_date, interval, offset, filters, name, projects,
+project_reports, merge_projects, logo, latex_timeout) and an optional id
+(the data_dir by default). The searches failed with transient errors are
+retried with exponential backoff. A report whose params change in the
+batch file is generated again from the start, and an end_date of 'now'
+is fixed the first time the report is run, so resumed reports cover the
+same period.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta, timezone
+
+from dateutil import parser
+
+from .clients import BACKOFF, RETRIES, retry_searches
+
+logger = logging.getLogger(__name__)
+
+# Last step of a report, after all its sections
+PDF_STEP = "PDF"
+PROJECTS_SECTION = "Detailed Activity by Project"
+
+# Queue of the worker processes to send the checkpoints to the batch runner
+_progress = None
+
+
+def read_batch(filename):
+    """
+    Read the reports of a batch file
+
+    :param filename: JSON file with a list of reports
+    :returns: the list of reports, with their ids
+    """
+
+    with open(filename) as f:
+        specs = json.load(f)
+
+    if not isinstance(specs, list):
+        raise RuntimeError("The batch file must have a list of reports", filename)
+    ids = set()
+    for spec in specs:
+        if not (spec.get("data_dir") and spec.get("data_sources")):
+            raise RuntimeError("Missing needed params for Report: data_dir and data_sources", spec)
+        spec.setdefault("id", spec["data_dir"])
+        if spec["id"] in ids:
+            raise RuntimeError("Report id repeated in the batch file", spec["id"])
+        ids.add(spec["id"])
+    return specs
+
+
+class BatchState():
+    """Progress of the reports of a batch, saved in a JSON file after
+    each change
+
+    :param filename: JSON file with the state, created if it does not exist
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.reports = {}
+        self._lock = threading.Lock()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.reports = json.load(f)
+
+    def start(self, spec):
+        """
+        Get the state of a report, starting it again if its params changed
+
+        :param spec: dict with the params of the report
+        :returns: a dict with the state of the report
+        """
+
+        with self._lock:
+            report = self.reports.get(spec["id"])
+            if not report or report["spec"] != spec:
+                end_date = spec.get("end_date", "now")
+                if end_date == "now":
+                    end_date = date.today().strftime('%Y-%m-%d')
+                report = {"spec": spec, "end_date": end_date, "steps": [], "status": "pending"}
+                self.reports[spec["id"]] = report
+                self.save()
+            return report
+
+    def step_done(self, report_id, step):
+        with self._lock:
+            self.reports[report_id]["steps"].append(step)
+            self.save()
+
+    def finish(self, report_id, error=None):
+        with self._lock:
+            report = self.reports[report_id]
+            report["status"] = "failed" if error else "done"
+            report["error"] = error
+            self.save()
+
+    def listen(self, progress):
+        """Save the checkpoints sent by the workers until None is got"""
+
+        for checkpoint in iter(progress.get, None):
+            self.step_done(*checkpoint)
+
+    def save(self):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self.reports, f, indent=4, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
+
+
+def init_worker(progress, retries=RETRIES, backoff=BACKOFF):
+    """
+    Set up a worker process of the batch
+
+    :param progress: queue in which to send the checkpoints
+    :param retries: max number of retries of a search
+    :param backoff: seconds waited before the first retry, doubled in each one
+    """
+
+    global _progress
+
+    _progress = progress
+    retry_searches(retries, backoff)
+
+
+def checkpoint(report_id, step):
+    """Send to the batch runner that a step of a report is done"""
+
+    logger.info("%s: %s done", report_id, step)
+    _progress.put((report_id, step))
+
+
+def get_report_dates(spec, end_date):
+    """
+    Get the UTC dates of a report as the command line does
+
+    :param spec: dict with the params of the report
+    :param end_date: end date of the report (not included)
+    :returns: a tuple with the start and end datetimes
+    """
+
+    end = parser.parse(end_date).replace(tzinfo=timezone.utc)
+    end += timedelta(microseconds=-1)
+
+    start_date = spec.get("start_date")
+    if not start_date:
+        from .esquery import INDEX_DATES_FILE, get_start_date
+        from .report import Report
+
+        indices = spec.get("indices") or [Report.ds2index[Report.ds2class[ds]]
+                                          for ds in spec["data_sources"]]
+        start_date = get_start_date(spec.get("elastic_url"), indices,
+                                    os.path.join(spec["data_dir"], INDEX_DATES_FILE))
+    start = parser.parse(start_date).replace(tzinfo=timezone.utc)
+
+    if spec.get("offset"):
+        # offset format supported: '+31d'
+        offset_days = int(spec["offset"][1:-1])
+        start += timedelta(days=offset_days)
+        end += timedelta(days=offset_days)
+
+    return start, end
+
+
+def create_report(spec, end_date):
+    """
+    Create the Report object of a report of the batch
+
+    :param spec: dict with the params of the report
+    :param end_date: end date of the report (not included)
+    :returns: a manuscripts Report
+    """
+
+    from .report import Report
+
+    os.makedirs(spec["data_dir"], exist_ok=True)
+    start, end = get_report_dates(spec, end_date)
+    return Report(spec.get("elastic_url"), start=start, end=end,
+                  data_dir=spec["data_dir"],
+                  filters=Report.get_core_filters(spec.get("filters")),
+                  interval=spec.get("interval", "month"),
+                  offset=spec.get("offset"),
+                  data_sources=list(spec["data_sources"]),
+                  report_name=spec.get("name", "Unnamed"),
+                  projects=spec.get("projects", False),
+                  indices=spec.get("indices", []),
+                  logo=spec.get("logo"),
+                  latex_timeout=spec.get("latex_timeout"),
+                  project_reports=spec.get("project_reports", False),
+                  merge_projects=spec.get("merge_projects", False))
+
+
+def run_steps(report, report_id, done):
+    """
+    Generate the sections and the PDF of a report which are not done yet
+
+    :param report: Report object
+    :param report_id: id of the report in the batch
+    :param done: list of the steps already done
+    """
+
+    for section, build_section in report.sections().items():
+        if section in done:
+            logger.debug("%s: %s already done", report_id, section)
+            continue
+        build_section()
+        checkpoint(report_id, section)
+
+    if report.projects and not report.project_names:
+        # The projects section was done in a previous run
+        projects_file = os.path.join(report.data_dir, "projects.txt")
+        if os.path.exists(projects_file):
+            with open(projects_file) as f:
+                report.project_names = [p.replace("/", "_") for p in f.read().split("\n") if p]
+
+    if PDF_STEP not in done:
+        report.create_pdf()
+        checkpoint(report_id, PDF_STEP)
+
+
+def run_report(report_id, spec, end_date, done):
+    """
+    Generate a report of the batch in a worker process
+
+    :param report_id: id of the report in the batch
+    :param spec: dict with the params of the report
+    :param end_date: end date of the report (not included)
+    :param done: list of the steps already done
+    """
+
+    run_steps(create_report(spec, end_date), report_id, done)
+
+
+def run_batch(specs, state_file, workers=None, retries=RETRIES, backoff=BACKOFF, run=run_report):
+    """
+    Generate the reports of a batch which are not done yet
+
+    :param specs: list of dicts with the params of the reports, as read by read_batch
+    :param state_file: JSON file with the progress of the batch
+    :param workers: number of reports generated at the same time (default: number of CPUs)
+    :param retries: max number of retries of a search
+    :param backoff: seconds waited before the first retry, doubled in each one
+    :param run: function generating a report, with the params of run_report
+    :returns: a list with the ids of the reports failed
+    """
+
+    state = BatchState(state_file)
+    pending = [state.start(spec) for spec in specs]
+    pending = [report for report in pending if report["status"] != "done"]
+    logger.info("%i reports to be generated, %i already done", len(pending), len(specs) - len(pending))
+    if not pending:
+        return []
+
+    progress = multiprocessing.Queue()
+    listener = threading.Thread(target=state.listen, args=(progress,))
+    listener.start()
+
+    failed = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(progress, retries, backoff)) as executor:
+            futures = {}
+            for report in pending:
+                report_id = report["spec"]["id"]
+                future = executor.submit(run, report_id, report["spec"], report["end_date"],
+                                         list(report["steps"]))
+                futures[future] = report_id
+
+            for future in as_completed(futures):
+                report_id = futures[future]
+                error = future.exception()
+                if error:
+                    logger.error("%s: report failed: %r", report_id, error)
+                    failed.append(report_id)
+                state.finish(report_id, repr(error) if error else None)
+    finally:
+        progress.put(None)
+        listener.join()
+
+    return failed
@@ -0,0 +1,895 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from dateutil import parser
+
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+# Functions applied to each new Elasticsearch client, in order. Each one
+# gets a client and returns the object to be used in its place, which
+# must provide search(index=None, body=None, **params).
+_wrappers = []
+_clients = {}
+_lock = threading.Lock()
+
+
+def es_client(url=None):
+    """
+    Get the client used to query an Elasticsearch URL. Clients are shared by
+    all the queries to the same URL, so connections are reused.
+
+    :param url: Elasticsearch URL, localhost:9200 if None
+    :returns: an Elasticsearch client, or the object returned by the client wrappers
+    """
+
+    with _lock:
+        if url not in _clients:
+            from elasticsearch import Elasticsearch
+
+            client = Elasticsearch(url) if url else Elasticsearch()
+            for wrapper in _wrappers:
+                client = wrapper(client)
+            _clients[url] = client
+        return _clients[url]
+
+
+class ThreadedAsyncClient():
+    """Asyncio client which runs the searches of a client in threads, for
+    the clients without an async version
+
+    :param client: Elasticsearch client, or the object returned by the client wrappers
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def search(self, index=None, body=None, **params):
+        search = functools.partial(self.client.search, index=index, body=body, **params)
+        # The threads see the context of the task, like the section of the profiler
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, search)
+
+    async def close(self):
+        pass
+
+
+def async_es_client(url=None):
+    """
+    Get an asyncio client to query an Elasticsearch URL: the async client of
+    elasticsearch (elasticsearch[async]) if it is installed and no client
+    wrapper is set. Otherwise, the searches of the client returned by
+    es_client are run in threads, so the wrappers are used.
+
+    Async clients are bound to the event loop in which they are used, so
+    they are not shared: each call creates a new one.
+
+    :param url: Elasticsearch URL, localhost:9200 if None
+    :returns: an object with an async search method
+    """
+
+    if not _wrappers:
+        try:
+            from elasticsearch import AsyncElasticsearch
+        except ImportError:
+            logger.debug("Async client not available, searches are run in threads")
+        else:
+            return AsyncElasticsearch(url) if url else AsyncElasticsearch()
+    return ThreadedAsyncClient(es_client(url))
+
+
+def add_client_wrapper(wrapper):
+    """
+    Add a function to wrap the Elasticsearch clients created from now on
+
+    :param wrapper: function receiving a client and returning the object to be used instead
+    """
+
+    with _lock:
+        _wrappers.append(wrapper)
+        _clients.clear()
+
+
+def reset_clients():
+    """Remove the client wrappers and the clients already created"""
+
+    with _lock:
+        _wrappers.clear()
+        _clients.clear()
+
+
+# Seconds a cached response is used and max number of responses cached
+CACHE_TTL = 300
+CACHE_SIZE = 10000
+
+# Retries of the searches failed with transient errors, and seconds
+# waited before the first retry, doubled in each one
+RETRIES = 3
+BACKOFF = 1
+# HTTP status of the transient Elasticsearch errors
+TRANSIENT_STATUS = [429, 502, 503, 504]
+
+# Throttling of the searches in shared clusters: max searches sent per
+# second, max searches in flight, and seconds a search may take before the
+# cluster is considered overloaded
+THROTTLE_RATE = 10
+THROTTLE_CONCURRENCY = 4
+THROTTLE_LATENCY = 10
+# Consecutive transient errors which open the circuit breaker, seconds it
+# stays open (doubled while the cluster keeps failing, up to the max), and
+# max seconds the searches are paused before failing
+BREAKER_FAILURES = 5
+BREAKER_PAUSE = 30
+BREAKER_MAX_PAUSE = 600
+BREAKER_MAX_OUTAGE = 3600
+
+# Milliseconds of a day, the unit to which the date bounds are rounded
+# in the cache friendly mode
+DAY_MS = 24 * 3600 * 1000
+
+# Fields of the search body which elasticsearch_dsl sends as params
+BODY_PARAMS = ["query", "aggs", "aggregations", "size", "from_", "sort", "_source",
+               "post_filter", "profile", "track_total_hits"]
+
+
+def search_body(body, params):
+    """
+    Join in a single body the fields of a search sent in the body and the
+    ones sent as params, as elasticsearch_dsl does
+
+    :param body: body of the request
+    :param params: other params of the request
+    :returns: a tuple with the joined body and the remaining params
+    """
+
+    body = dict(body or {})
+    params = dict(params)
+    for field in BODY_PARAMS:
+        if field in params:
+            body[field.rstrip("_")] = params.pop(field)
+    return body, params
+
+
+def request_key(index, body, params):
+    """
+    Build a key identifying a search request
+
+    :param index: index (or list of indices) searched
+    :param body: body of the request
+    :param params: other params of the request
+    :returns: a string with the canonical JSON of the request
+    """
+
+    if isinstance(index, (list, tuple)):
+        index = ",".join(index)
+    body, params = search_body(body, params)
+    return json.dumps({"index": index, "body": body, "params": params},
+                      sort_keys=True, default=str)
+
+
+def save_records(records, filename):
+    """
+    Write a list of recorded searches to a file
+
+    :param records: list of searches recorded by RecordingClient
+    :param filename: file in which to save the searches
+    """
+
+    with open(filename, "w") as f:
+        json.dump(records, f, default=str)
+    logger.info("%i searches recorded in %s", len(records), filename)
+
+
+class RecordingClient():
+    """Elasticsearch client which records all the searches sent through it,
+    with their responses, so they can be replayed later by ReplayClient.
+
+    :param client: Elasticsearch client used to run the searches
+    :param records: list in which to add the searches, a new one if None
+    """
+
+    def __init__(self, client, records=None):
+        self.client = client
+        self.records = records if records is not None else []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        response = self.client.search(index=index, body=body, **params)
+        self.record(index, body, params, response)
+        return response
+
+    def msearch(self, body=None, **params):
+        """Run a multi search, recording each search as if it was sent alone,
+        as ReplayClient only answers searches"""
+
+        response = self.client.msearch(body=body, **params)
+        for header, search, search_response in zip(body[::2], body[1::2], response["responses"]):
+            self.record(header.get("index"), search, {}, search_response)
+        return response
+
+    def record(self, index, body, params, response):
+        record = {
+            "request": json.loads(request_key(index, body, params)),
+            "response": response
+        }
+        with self._lock:
+            self.records.append(record)
+
+
+class NotRecordedAPI():
+    """API of the Elasticsearch client whose requests are not recorded, so
+    they fail when replayed
+
+    :param name: name of the API, like indices
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, method):
+        def not_recorded(*args, **kwargs):
+            raise RuntimeError("%s.%s is not recorded, only the searches are replayed" % (self.name, method))
+        return not_recorded
+
+
+class ReplayClient():
+    """Client which answers the searches with the responses recorded by
+    RecordingClient, without connecting to Elasticsearch. A search sent
+    several times gets its responses in the order they were recorded, and
+    the last one once all of them were used. The index and node stats are
+    not recorded, so their requests raise RuntimeError.
+
+    :param filename: file with the recorded searches
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.responses = {}
+        self.replayed = {}
+        self.indices = NotRecordedAPI("indices")
+        self.nodes = NotRecordedAPI("nodes")
+        self._lock = threading.Lock()
+
+        with open(filename) as f:
+            records = json.load(f)
+        for record in records:
+            request = record["request"]
+            key = request_key(request["index"], request["body"], request["params"])
+            self.responses.setdefault(key, []).append(record["response"])
+
+    def search(self, index=None, body=None, **params):
+        key = request_key(index, body, params)
+        if key not in self.responses:
+            raise RuntimeError("Search not found in the recorded file " + self.filename, key)
+
+        responses = self.responses[key]
+        with self._lock:
+            pos = self.replayed.get(key, 0)
+            self.replayed[key] = pos + 1
+        return responses[min(pos, len(responses) - 1)]
+
+
+class CachingClient():
+    """Elasticsearch client which keeps the responses of the searches for
+    some time, so the same searches sent by different reports are only run
+    once. The least recently used responses are dropped when the cache is full.
+
+    :param client: Elasticsearch client used to run the searches
+    :param ttl: seconds a response is used since it was got
+    :param max_searches: max number of responses kept
+    """
+
+    def __init__(self, client, ttl=CACHE_TTL, max_searches=CACHE_SIZE):
+        self.client = client
+        self.ttl = ttl
+        self.max_searches = max_searches
+        self.responses = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        key = request_key(index, body, params)
+        with self._lock:
+            cached = self.responses.get(key)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                self.responses.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        response = self.client.search(index=index, body=body, **params)
+        with self._lock:
+            self.responses[key] = (time.monotonic(), response)
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.max_searches:
+                self.responses.popitem(last=False)
+        return response
+
+
+def cache_searches(ttl=CACHE_TTL, max_searches=CACHE_SIZE):
+    """
+    Keep the responses of the searches sent to Elasticsearch from now on
+    for some time, answering the same searches with them
+
+    :param ttl: seconds a response is used since it was got
+    :param max_searches: max number of responses kept
+    """
+
+    add_client_wrapper(lambda client: CachingClient(client, ttl, max_searches))
+
+
+def is_transient(error):
+    """
+    Check whether an error got from Elasticsearch may not happen again
+
+    :param error: exception raised by a search
+    :returns: True for connection errors, timeouts and overloaded cluster errors
+    """
+
+    from elasticsearch.exceptions import ConnectionError, TransportError
+
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error, TransportError) and error.status_code in TRANSIENT_STATUS
+
+
+class RetryingClient():
+    """Elasticsearch client which sends again the searches failed with
+    transient errors, waiting longer before each retry.
+
+    :param client: Elasticsearch client used to run the searches
+    :param retries: max number of retries of a search
+    :param backoff: seconds waited before the first retry, doubled in each one
+    """
+
+    def __init__(self, client, retries=RETRIES, backoff=BACKOFF):
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        return self.retry(self.client.search, index=index, body=body, **params)
+
+    def msearch(self, body=None, **params):
+        return self.retry(self.client.msearch, body=body, **params)
+
+    def retry(self, request, **params):
+        attempt = 0
+        while True:
+            try:
+                return request(**params)
+            except Exception as e:
+                if attempt >= self.retries or not is_transient(e):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                logger.warning("Search failed (%s), retry %i of %i in %.1f seconds",
+                               e, attempt, self.retries, delay)
+                time.sleep(delay)
+
+
+def retry_searches(retries=RETRIES, backoff=BACKOFF):
+    """
+    Retry the searches sent to Elasticsearch from now on when they fail
+    with transient errors
+
+    :param retries: max number of retries of a search
+    :param backoff: seconds waited before the first retry, doubled in each one
+    """
+
+    add_client_wrapper(lambda client: RetryingClient(client, retries, backoff))
+
+
+class TokenBucket():
+    """Rate limit of the searches: tokens are added at a constant rate up to
+    a max, and each search takes one, waiting for it if there is none
+
+    :param rate: tokens added per second
+    :param burst: max number of tokens, searches sent at once after a quiet period
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until there is one
+
+        :returns: the seconds waited
+        """
+
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimit():
+    """Max number of searches in flight, adapted to the load of the cluster
+    with AIMD: it grows by one after a whole window of searches answered in
+    time, and it is halved when a search is slow or fails because the
+    cluster is overloaded. It is halved once for all the searches in flight
+    at the same time.
+
+    :param max_limit: max number of searches in flight
+    :param latency: seconds a search may take before the limit is decreased
+    """
+
+    def __init__(self, max_limit, latency):
+        self.max_limit = max_limit
+        self.latency = latency
+        self.limit = 1
+        self.in_flight = 0
+        self.last_decrease = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait until a search can be sent
+
+        :returns: the time at which the search is sent
+        """
+
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, overloaded=False):
+        """
+        Adapt the limit to the result of a search
+
+        :param started: time at which the search was sent, as returned by acquire
+        :param overloaded: True if the search failed because of the load of the cluster
+        :returns: the new limit if it was decreased, None otherwise
+        """
+
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            now = time.monotonic()
+            if not overloaded and now - started <= self.latency:
+                self.limit = min(self.max_limit, self.limit + 1 / int(self.limit))
+                return None
+            if started < self.last_decrease or self.limit == 1:
+                # Sent before the last decrease, the limit already took it into account
+                return None
+            self.limit = max(1, self.limit / 2)
+            self.last_decrease = now
+            return int(self.limit)
+
+
+class CircuitBreaker():
+    """Pause the searches when the cluster keeps failing: after some
+    consecutive transient errors the breaker opens and the searches wait
+    until a pause is over. Then a single search is sent to probe the
+    cluster, closing the breaker if it is answered, or opening it again for
+    twice the time if not.
+
+    :param failures: consecutive transient errors which open the breaker
+    :param pause: seconds the breaker stays open the first time
+    :param max_pause: max seconds the breaker stays open
+    :param max_outage: max seconds the searches are paused before failing
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, pause=BREAKER_PAUSE,
+                 max_pause=BREAKER_MAX_PAUSE, max_outage=BREAKER_MAX_OUTAGE):
+        self.failures = failures
+        self.pause = pause
+        self.max_pause = max_pause
+        self.max_outage = max_outage
+        self.errors = 0
+        self.opened = None
+        self.until = None
+        self.next_pause = pause
+        self.probing = False
+        self._cond = threading.Condition()
+
+    def wait(self):
+        """Wait until the breaker is closed, or until the search is the probe"""
+
+        with self._cond:
+            while self.opened is not None:
+                now = time.monotonic()
+                if now < self.until:
+                    self._cond.wait(self.until - now)
+                elif not self.probing:
+                    self.probing = True
+                    return
+                else:
+                    self._cond.wait()
+
+    def success(self):
+        with self._cond:
+            self.errors = 0
+            if self.opened is None:
+                return
+            paused = time.monotonic() - self.opened
+            self.opened = None
+            self.probing = False
+            self.next_pause = self.pause
+            self._cond.notify_all()
+        logger.warning("Circuit breaker closed, searches resumed after %.1f seconds", paused)
+        profiler.record_throttle("breaker_closed", paused=paused)
+
+    def failure(self, error):
+        """
+        Count a search failed with a transient error
+
+        :param error: exception raised by the search
+        :returns: True if the search must wait for the breaker and be sent again
+        """
+
+        with self._cond:
+            self.errors += 1
+            now = time.monotonic()
+            if self.opened is None:
+                if self.errors < self.failures:
+                    return False
+                self.opened = now
+            elif not self.probing and now < self.until:
+                # Sent before the breaker was opened
+                return True
+            elif now - self.opened > self.max_outage:
+                logger.error("Searches paused for more than %i seconds, giving up", self.max_outage)
+                self.probing = False
+                self._cond.notify_all()
+                return False
+            else:
+                self.next_pause = min(2 * self.next_pause, self.max_pause)
+
+            pause = self.next_pause
+            self.until = now + pause
+            self.probing = False
+            self._cond.notify_all()
+        logger.warning("Circuit breaker open after %i errors (%s), searches paused for %.1f seconds",
+                       self.errors, error, pause)
+        profiler.record_throttle("breaker_open", pause=pause, error=str(error))
+        return True
+
+
+class Throttle():
+    """Scheduler of the searches sent to a shared cluster: it limits the
+    searches sent per second and in flight, adapting the latter to the load
+    of the cluster, retries the searches failed with transient errors after
+    a random wait, and pauses the searches while the cluster keeps failing.
+    The decisions are logged and recorded in the profile of the run.
+
+    :param rate: max searches sent per second, None for no limit
+    :param concurrency: max searches in flight
+    :param latency: seconds a search may take before the cluster is considered overloaded
+    :param retries: max number of retries of a search
+    :param backoff: max seconds waited before the first retry, doubled in each one
+    :param breaker: CircuitBreaker pausing the searches
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, concurrency=THROTTLE_CONCURRENCY, latency=THROTTLE_LATENCY,
+                 retries=RETRIES, backoff=BACKOFF, breaker=None):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limit = AdaptiveLimit(concurrency, latency)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+    def run(self, search):
+        """
+        Send a search when the throttle allows it
+
+        :param search: function sending the search
+        :returns: the response of the search
+        """
+
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            if self.bucket:
+                self.bucket.acquire()
+            started = self.limit.acquire()
+            try:
+                response = search()
+            except Exception as e:
+                transient = is_transient(e)
+                self.decreased(self.limit.release(started, overloaded=transient), e)
+                if not transient:
+                    raise
+                if self.breaker.failure(e):
+                    # Paused searches are sent again without using their retries
+                    continue
+                if attempt >= self.retries:
+                    raise
+                # Random wait, so the searches failed at the same time are not sent together
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                attempt += 1
+                logger.warning("Search failed (%s), retry %i of %i in %.1f seconds",
+                               e, attempt, self.retries, delay)
+                profiler.record_throttle("retry", attempt=attempt, delay=delay, error=str(e))
+                time.sleep(delay)
+            else:
+                self.decreased(self.limit.release(started))
+                self.breaker.success()
+                return response
+
+    def decreased(self, limit, error=None):
+        if limit is None:
+            return
+        reason = error or "slow search"
+        logger.info("Searches in flight limited to %i (%s)", limit, reason)
+        profiler.record_throttle("limit_decreased", limit=limit, reason=str(reason))
+
+
+class ThrottlingClient():
+    """Elasticsearch client which sends the searches through a Throttle
+
+    :param client: Elasticsearch client used to run the searches
+    :param throttle: Throttle shared by all the clients
+    """
+
+    def __init__(self, client, throttle):
+        self.client = client
+        self.throttle = throttle
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        return self.throttle.run(functools.partial(self.client.search, index=index, body=body, **params))
+
+
+def throttle_searches(rate=THROTTLE_RATE, concurrency=THROTTLE_CONCURRENCY, latency=THROTTLE_LATENCY,
+                      retries=RETRIES, backoff=BACKOFF):
+    """
+    Throttle the searches sent to Elasticsearch from now on, so reports do
+    not overload a cluster shared with other users
+
+    :param rate: max searches sent per second, None for no limit
+    :param concurrency: max searches in flight
+    :param latency: seconds a search may take before the cluster is considered overloaded
+    :param retries: max number of retries of a search
+    :param backoff: max seconds waited before the first retry, doubled in each one
+    :returns: the Throttle used by the clients
+    """
+
+    throttle = Throttle(rate, concurrency, latency, retries, backoff)
+    add_client_wrapper(lambda client: ThrottlingClient(client, throttle))
+    return throttle
+
+
+def parse_datetime(value):
+    """
+    Parse the date of a search if it is an ISO date with time
+
+    :param value: date of the search
+    :returns: a datetime, or None for other values, like numbers, dates
+              without time or date math expressions
+    """
+
+    if not isinstance(value, str) or "T" not in value:
+        return None
+    try:
+        return parser.isoparse(value)
+    except (ValueError, OverflowError):
+        return None
+
+
+def round_date(value, up=False):
+    """
+    Round a date of a search to the start of its day
+
+    :param value: ISO date string or epoch milliseconds. Other values, like
+                  date math expressions, are returned as they are
+    :param up: round to the start of the next day if the date is not a day boundary
+    :returns: the rounded date, in the same format as value
+    """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        rounded = value - value % DAY_MS
+        if up and rounded != value:
+            rounded += DAY_MS
+        return type(value)(rounded)
+
+    date = parse_datetime(value)
+    if date is None:
+        return value
+    rounded = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if up and rounded != date:
+        rounded += timedelta(days=1)
+    return rounded.isoformat()
+
+
+def round_range(bounds):
+    """
+    Extend the bounds of a range query to whole days: the lower bound to the
+    start of its day, and the upper bound to the start of the next day,
+    excluded. Bounds which are already at the start of a day are kept, and
+    the ones which are not ISO dates with time, like numbers or date math
+    expressions, are not changed.
+
+    :param bounds: dict with the bounds of the range
+    :returns: a dict with the rounded bounds
+    """
+
+    rounded = {}
+    for op, value in bounds.items():
+        date = parse_datetime(value) if op in ("gt", "gte", "lt", "lte") else None
+        if date is None:
+            rounded[op] = value
+            continue
+        day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day == date and op != "gt":
+            rounded[op] = value
+        elif op in ("gt", "gte"):
+            rounded["gte"] = day.isoformat()
+        else:
+            rounded["lt"] = (day + timedelta(days=1)).isoformat()
+    return rounded
+
+
+def round_bounds(data):
+    """
+    Round to whole days the date bounds of a search body: the range queries
+    are extended to the start of the day of their lower bound and to the
+    start of the day after their upper bound, and the extended bounds of the
+    date histograms are moved to the start of their day, which keeps them in
+    the same bucket.
+
+    :param data: search body, or any part of it
+    :returns: a copy of data with the bounds rounded
+    """
+
+    if isinstance(data, list):
+        return [round_bounds(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    rounded = {}
+    for key, value in data.items():
+        if key == "range" and isinstance(value, dict) and \
+                all(isinstance(bounds, dict) for bounds in value.values()):
+            # A range query, with the bounds of each field (not a range aggregation)
+            rounded[key] = {field: round_range(bounds) for field, bounds in value.items()}
+        elif key == "date_histogram" and isinstance(value, dict):
+            rounded[key] = dict(value)
+            for bounds in ("extended_bounds", "hard_bounds"):
+                if isinstance(value.get(bounds), dict):
+                    rounded[key][bounds] = {bound: round_date(date) for bound, date in value[bounds].items()}
+        else:
+            rounded[key] = round_bounds(value)
+    return rounded
+
+
+def request_cache_stats(client):
+    """
+    Get the shard request cache stats of the nodes of a cluster
+
+    :param client: Elasticsearch client
+    :returns: a dict with the hit_count and miss_count of all the nodes,
+              or None if the stats can not be got
+    """
+
+    try:
+        stats = client.nodes.stats(metric="indices", index_metric="request_cache")
+    except Exception as e:
+        logger.warning("Can not get the request cache stats: %s", e)
+        return None
+
+    totals = {"hit_count": 0, "miss_count": 0}
+    for node in stats.get("nodes", {}).values():
+        cache = node.get("indices", {}).get("request_cache", {})
+        for count in totals:
+            totals[count] += cache.get(count, 0)
+    return totals
+
+
+class CacheFriendlyClient():
+    """Elasticsearch client which sends the searches so they can be answered
+    from the shard request cache of Elasticsearch: the date bounds are
+    rounded to whole days, so they are the same in every run of a day, the
+    searches without hits get size=0 and request_cache=true, and all of
+    them the same preference, so they go to the same shard copies.
+
+    :param client: Elasticsearch client used to run the searches
+    :param preference: preference string sent with all the searches
+    """
+
+    def __init__(self, client, preference):
+        self.client = client
+        self.preference = preference
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        body = round_bounds(body)
+        if "scroll" not in params and not body.get("size") and \
+                ("aggs" in body or "aggregations" in body):
+            body["size"] = 0
+            params["request_cache"] = "true"
+        params.setdefault("preference", self.preference)
+        return self.client.search(index=index, body=body, **params)
+
+
+def cache_friendly_searches(preference):
+    """
+    Send the searches to Elasticsearch from now on so they can be answered
+    from its shard request cache
+
+    :param preference: preference string sent with all the searches, the
+                       same for all the runs of a report
+    """
+
+    add_client_wrapper(lambda client: CacheFriendlyClient(client, preference))
+
+
+def record_searches(filename):
+    """
+    Record all the searches sent to Elasticsearch from now on
+
+    :param filename: file in which to save the searches
+    :returns: a function to save the recorded searches once done
+    """
+
+    records = []
+    add_client_wrapper(lambda client: RecordingClient(client, records))
+    return lambda: save_records(records, filename)
+
+
+def replay_searches(filename):
+    """
+    Answer all the searches from now on with the ones recorded in a file,
+    without connecting to Elasticsearch
+
+    :param filename: file with the recorded searches
+    """
+
+    replay_client = ReplayClient(filename)
+    add_client_wrapper(lambda client: replay_client)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import os
+import re
+import time
+
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+# Chars with a special meaning in LaTeX and their escaped version
+LATEX_SPECIAL_CHARS = {
+    "\\": r"\textbackslash{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}"
+}
+
+LATEX_ESCAPE_TABLE = str.maketrans(LATEX_SPECIAL_CHARS)
+LATEX_UNESCAPE_TABLE = {escaped: char for char, escaped in LATEX_SPECIAL_CHARS.items()}
+LATEX_ESCAPED_CHARS = re.compile("|".join(re.escape(escaped) for escaped in LATEX_UNESCAPE_TABLE))
+
+
+def latex_escape(value):
+    """
+    Escape the LaTeX special chars in a string
+
+    :param value: string to be escaped
+    :return: the escaped string
+    """
+
+    return value.translate(LATEX_ESCAPE_TABLE)
+
+
+def latex_unescape(value):
+    """
+    Undo the escaping of the LaTeX special chars in a string
+
+    :param value: string escaped with latex_escape
+    :return: the original string
+    """
+
+    return LATEX_ESCAPED_CHARS.sub(lambda match: LATEX_UNESCAPE_TABLE[match.group(0)], value)
+
+
+def read_csv(text, sep=","):
+    """
+    Read the rows of a CSV file written by CSVWriter, with its fields enclosed
+    in braces when they include the separator, or by other writers, with
+    them enclosed in double quotes
+
+    :param text: content of the CSV file
+    :param sep: char used to separate the fields
+    :return: a list with the list of fields of each row, with the fields
+             stripped and without their braces or quotes
+    """
+
+    rows = []
+    row = []
+    field = ""
+    depth = 0
+    quoted = False
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if quoted:
+            if char == '"' and text[pos + 1:pos + 2] == '"':
+                field += char
+                pos += 1
+            elif char == '"':
+                quoted = False
+            else:
+                field += char
+        elif char == "\\":
+            # Escaped char, like \{, which does not open a group
+            field += text[pos:pos + 2]
+            pos += 1
+        elif char == '"' and not field.strip():
+            quoted = True
+        elif char in "{}":
+            depth += 1 if char == "{" else -1
+            field += char
+        elif char in (sep, "\n") and depth == 0:
+            row.append(field)
+            field = ""
+            if char == "\n":
+                rows.append(row)
+                row = []
+        else:
+            field += char
+        pos += 1
+    if field or row:
+        row.append(field)
+        rows.append(row)
+
+    rows = [[field.strip() for field in row] for row in rows if row != [""]]
+    return [[field[1:-1] if field.startswith("{") and field.endswith("}") else field for field in row]
+            for row in rows]
+
+
+def format_value(val):
+    """
+    Format a metric value to be written in a CSV file
+
+    :param val: value to be formatted
+    :return: a string with the formatted value: NA for None values,
+             two decimals for float values
+    """
+
+    if val is None:
+        return "NA"
+    elif type(val) == float:
+        return '%0.2f' % val
+    return str(val)
+
+
+def header_label(label):
+    """
+    Build a column name for a CSV header. Column names are used as LaTeX macro
+    names by csvsimple, so they can not include "_".
+
+    :param label: name of the column
+    :return: the column name without "_"
+    """
+
+    return label.replace("_", "")
+
+
+class CSVWriter():
+    """Write the rows of a CSV file as they are produced, without
+    building the whole content in memory.
+
+    Fields are converted to strings with `format_value` and, if `escape`
+    is set, LaTeX special chars are escaped so the file can be used by
+    csvsimple in the LaTeX templates. Fields including the separator are
+    enclosed in braces, as csvsimple expects.
+
+    :param filename: path of the CSV file, its directory is created if needed
+    :param header: list with the column names
+    :param sep: string used to separate the fields
+    :param escape: escape LaTeX special chars in the fields
+    :param max_rows: max number of rows to be written, the rest are ignored
+    """
+
+    def __init__(self, filename, header=None, sep=",", escape=True, max_rows=None):
+        self.filename = filename
+        self.sep = sep
+        self.escape = escape
+        self.max_rows = max_rows
+        self.nrows = 0
+        self.write_time = 0
+
+        dir_name = os.path.dirname(filename)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self.fd = open(filename, "w")
+
+        if header:
+            self.fd.write(sep.join(header_label(label) for label in header) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def format_field(self, field):
+        """Convert a field to the string written in the file"""
+
+        field = format_value(field)
+        if self.escape:
+            field = latex_escape(field)
+        if self.sep.strip() and self.sep.strip() in field:
+            field = "{" + field + "}"
+        return field
+
+    def writerow(self, row):
+        """
+        Write a row in the CSV file
+
+        :param row: list with the fields of the row
+        :return: False if the row was not written because max_rows was reached
+        """
+
+        if self.max_rows is not None and self.nrows >= self.max_rows:
+            return False
+        start = time.perf_counter()
+        self.fd.write(self.sep.join(self.format_field(field) for field in row) + "\n")
+        self.write_time += time.perf_counter() - start
+        self.nrows += 1
+        return True
+
+    def writerows(self, rows):
+        """
+        Write all the rows from an iterable in the CSV file. The iterable
+        is not consumed once max_rows are written.
+
+        :param rows: iterable with the rows to be written
+        """
+
+        for row in rows:
+            self.writerow(row)
+            if self.max_rows is not None and self.nrows >= self.max_rows:
+                break
+
+    def close(self):
+        self.fd.close()
+        profiler.record_stage("csv", self.filename, self.write_time)
+        logger.debug("CSV file: %s was generated", self.filename)
+
+
+def write_csv(filename, header, rows, sep=",", escape=True, max_rows=None):
+    """
+    Create a CSV file streaming its rows to disk
+
+    :param filename: path of the CSV file
+    :param header: list with the column names
+    :param rows: iterable with the rows of the file
+    :param sep: string used to separate the fields
+    :param escape: escape LaTeX special chars in the fields
+    :param max_rows: max number of rows to be written
+    """
+
+    with CSVWriter(filename, header, sep=sep, escape=escape, max_rows=max_rows) as writer:
+        writer.writerows(rows)
@@ -19,12 +19,24 @@
 #     Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import json
+import logging
+import os
+
 from datetime import timezone
 
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import A, Search, Q
+
+from .clients import es_client
 # elasticsearch_dsl is referred to as es_dsl in the comments, henceforth
 
+logger = logging.getLogger(__name__)
+
+# Field whose min and max values are the first and last dates of an index
+INDEX_DATE_FIELD = "grimoire_creation_date"
+# File in the data dir with the dates of the indices got in the last run
+INDEX_DATES_FILE = "index_dates.json"
+
 
 class ElasticQuery():
     """ Helper class for building Elastic queries """
@@ -63,6 +75,20 @@ class ElasticQuery():
 
         return query_filters
 
+    @classmethod
+    def get_filter_clauses(cls, filters):
+        """
+        Get the clauses added by some filters to the bool query of a search
+
+        :param filters: dict with the filters to be applied, the inverse ones starting with *
+        :return: a dict with the list of must and must_not clauses
+                 Ex: {'must': [{'match_phrase': {'author_org_name': 'Bitergia'}}],
+                      'must_not': [{'match_phrase': {'author_bot': 'true'}}]}
+        """
+
+        return {"must": [f.to_dict() for f in cls.__get_query_filters(filters)],
+                "must_not": [f.to_dict() for f in cls.__get_query_filters(filters, inverse=True)]}
+
     @classmethod
     def __get_query_range(cls, date_field, start=None, end=None):
         """
@@ -384,11 +410,114 @@ class ElasticQuery():
 
 def get_first_date_of_index(elastic_url, index):
     """Get the first/min date present in the index"""
-    es = Elasticsearch(elastic_url)
-    search = Search(using=es, index=index)
-    agg = A("min", field="grimoire_creation_date")
-    search.aggs.bucket("1", agg)
-    search = search.extra(size=0)
-    response = search.execute()
-    start_date = response.to_dict()['aggregations']['1']['value_as_string'][:10]
-    return start_date
+
+    return get_start_date(elastic_url, [index])
+
+
+def index_fingerprint(es, indices):
+    """
+    Get a fingerprint of the items of some indices from their stats, without
+    searching them. It changes when items are added, updated or deleted.
+
+    :param es: Elasticsearch client
+    :param indices: list of index names
+    :returns: a dict with the fingerprint of each index, or None if the
+              stats can not be got
+    """
+
+    try:
+        stats = es.indices.stats(index=",".join(indices), metric="docs,indexing")
+    except Exception as e:
+        logger.debug("Can not get the stats of the indices: %s", e)
+        return None
+
+    fingerprint = {}
+    for name, index in stats.get("indices", {}).items():
+        primaries = index["primaries"]
+        fingerprint[name] = {"uuid": index.get("uuid"),
+                             "docs": primaries["docs"]["count"],
+                             "deleted": primaries["docs"]["deleted"],
+                             "indexed": primaries["indexing"]["index_total"]}
+    return fingerprint
+
+
+def get_index_dates(es, indices):
+    """
+    Get the first date of the items of some indices in a single request
+    (_msearch). The searches of the clients which only answer searches,
+    like the memory engine or the replay of recorded searches, are sent
+    one by one.
+
+    :param es: Elasticsearch client
+    :param indices: list of index names
+    :returns: a dict with the min date of each index, None for empty indices
+    """
+
+    body = {
+        "size": 0,
+        "aggs": {"min": {"min": {"field": INDEX_DATE_FIELD}}}
+    }
+    if callable(getattr(es, "msearch", None)):
+        searches = []
+        for index in indices:
+            searches.extend([{"index": index}, body])
+        responses = es.msearch(body=searches)["responses"]
+    else:
+        responses = [es.search(index=index, body=body) for index in indices]
+
+    dates = {}
+    for index, response in zip(indices, responses):
+        if "error" in response:
+            raise RuntimeError("Can not get the dates of the index", index, response["error"])
+        aggs = response["aggregations"]
+        dates[index] = {"min": aggs["min"].get("value_as_string")}
+    return dates
+
+
+def get_dates_of_indices(elastic_url, indices, cache_file=None):
+    """
+    Get the first date of the items of some indices, reusing the ones
+    stored in a file by a previous run if the indices did not change
+
+    :param elastic_url: Elasticsearch URL
+    :param indices: list of index names
+    :param cache_file: JSON file with the dates of the last run, updated if they are got again
+    :returns: a dict with the min date of each index, None for empty indices
+    """
+
+    es = es_client(elastic_url)
+    indices = sorted(set(indices))
+    fingerprint = index_fingerprint(es, indices) if cache_file else None
+
+    if fingerprint and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached.get("indices") == indices and cached.get("fingerprint") == fingerprint:
+            logger.debug("Dates of the indices taken from %s", cache_file)
+            return cached["dates"]
+
+    dates = get_index_dates(es, indices)
+    if fingerprint:
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"indices": indices, "fingerprint": fingerprint, "dates": dates},
+                      f, indent=4, sort_keys=True)
+        os.replace(tmp_file, cache_file)
+    return dates
+
+
+def get_start_date(elastic_url, indices, cache_file=None):
+    """
+    Get the first date of the items of some indices
+
+    :param elastic_url: Elasticsearch URL
+    :param indices: list of index names
+    :param cache_file: JSON file with the dates of the indices of the last run
+    :returns: the first date, as YYYY-MM-DD
+    """
+
+    dates = get_dates_of_indices(elastic_url, indices, cache_file)
+    first_dates = [index_dates["min"][:10] for index_dates in dates.values() if index_dates["min"]]
+    if not first_dates:
+        raise RuntimeError("No items found in the indices", indices)
+    return min(first_dates)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reports of many filter sets in one pass: the same report is generated
+for several sets of filters, like one set per organization or repository,
+each one applied to all the metrics as the -f filters.
+
+The searches of the reports are the same but for the clauses of the
+filters of each set. When a search is got for the first time, the clauses
+of its set are removed from it, and its aggregations are wrapped in a
+filters aggregation with a bucket per set, so it is sent once for all of
+them. The same search of the other sets is answered with its bucket.
+Searches getting hits, and not only aggregations, are sent as they are.
+"""
+
+import copy
+import json
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .clients import add_client_wrapper, request_key, search_body
+from .esquery import ElasticQuery
+
+logger = logging.getLogger(__name__)
+
+# Name of the aggregation with a bucket per filter set
+FILTER_SETS_AGG = "filter_sets"
+
+
+def read_filter_sets(filename):
+    """
+    Read the filter sets of a JSON file, an object with the list of filters
+    of each set, with the syntax of the -f param:
+
+        {"bitergia": ["author_org_name:Bitergia"], "chaoss": ["project:CHAOSS", "*author_bot:true"]}
+
+    :param filename: JSON file with the filter sets
+    :returns: an OrderedDict with the dict of filters of each set
+    """
+
+    from .report import Report
+
+    with open(filename) as f:
+        sets = json.load(f, object_pairs_hook=OrderedDict)
+
+    if not isinstance(sets, dict) or not sets:
+        raise RuntimeError("The filter sets file must have an object with the filters of each set", filename)
+    filter_sets = OrderedDict()
+    for name, filters in sets.items():
+        if not filters:
+            raise RuntimeError("Filter set without filters", name)
+        filter_sets[name] = Report.get_core_filters(filters)
+    return filter_sets
+
+
+def remove_clauses(query, clauses):
+    """
+    Remove the clauses of a filter set from the query of a search
+
+    :param query: dict with the query of the search
+    :param clauses: dict with the must and must_not clauses of the filter set
+    :returns: the query without the clauses, or None if the query does not
+              have all of them
+    """
+
+    if list(query) != ["bool"]:
+        return None
+
+    bool_query = dict(query["bool"])
+    for occur in ("must", "must_not"):
+        items = bool_query.get(occur, [])
+        items = list(items) if isinstance(items, list) else [items]
+        for clause in clauses[occur]:
+            if clause not in items:
+                return None
+            items.remove(clause)
+        if items:
+            bool_query[occur] = items
+        else:
+            bool_query.pop(occur, None)
+    return {"bool": bool_query} if bool_query else {"match_all": {}}
+
+
+class FilterSets():
+    """Filter sets of the reports, the one of the report being generated,
+    and the responses to the searches of all the sets
+
+    :param sets: dict with the dict of filters of each set
+    """
+
+    def __init__(self, sets):
+        self.filters = sets
+        self.clauses = OrderedDict((name, ElasticQuery.get_filter_clauses(filters))
+                                   for name, filters in sets.items())
+        self.current = None
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def use(self, name):
+        """Answer the searches from now on with the responses of a set"""
+
+        self.current = name
+
+    def for_all_sets(self, body):
+        """
+        Build the search for all the sets from the one without their clauses
+
+        :param body: body of the search without the clauses of the filter sets
+        :returns: the body with the aggregations in a bucket per filter set
+        """
+
+        body = copy.deepcopy(body)
+        aggs = body.pop("aggs", body.pop("aggregations", None))
+        filters = OrderedDict()
+        for name, clauses in self.clauses.items():
+            filters[name] = {"bool": {occur: items for occur, items in clauses.items() if items}}
+        body["aggs"] = {FILTER_SETS_AGG: {"filters": {"filters": filters}}}
+        if aggs:
+            body["aggs"][FILTER_SETS_AGG]["aggs"] = aggs
+        return body
+
+    def split(self, response):
+        """
+        Split the response of a search for all the sets
+
+        :param response: dict with the response
+        :returns: a dict with the response of each set
+        """
+
+        buckets = response["aggregations"][FILTER_SETS_AGG]["buckets"]
+        responses = {}
+        for name in self.clauses:
+            aggs = dict(buckets[name])
+            total = aggs.pop("doc_count")
+            hits = dict(response["hits"])
+            hits["total"] = dict(hits["total"], value=total) if isinstance(hits["total"], dict) else total
+            responses[name] = dict(response, hits=hits, aggregations=aggs)
+            if not aggs:
+                del responses[name]["aggregations"]
+        return responses
+
+
+class FilterSetsClient():
+    """Elasticsearch client which sends the searches of the reports of
+    several filter sets once for all of them
+
+    :param client: Elasticsearch client used to run the searches
+    :param filter_sets: FilterSets of the reports
+    """
+
+    def __init__(self, client, filter_sets):
+        self.client = client
+        self.filter_sets = filter_sets
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        name = self.filter_sets.current
+        query = remove_clauses(body.get("query", {}), self.filter_sets.clauses[name]) if name else None
+        if query is None or body.get("size") != 0 or "scroll" in params:
+            return self.client.search(index=index, body=body, **params)
+
+        body = dict(body, query=query)
+        key = request_key(index, body, params)
+        with self.filter_sets._lock:
+            responses = self.filter_sets.responses.get(key)
+        if responses is None:
+            response = self.client.search(index=index, body=self.filter_sets.for_all_sets(body), **params)
+            responses = self.filter_sets.split(response)
+            with self.filter_sets._lock:
+                self.filter_sets.responses[key] = responses
+        else:
+            logger.debug("Search of filter set %s already sent", name)
+        return responses[name]
+
+
+def filter_set_searches(sets):
+    """
+    Send the searches of the reports of several filter sets from now on
+    once for all the sets
+
+    :param sets: dict with the dict of filters of each set, as returned by read_filter_sets
+    :returns: the FilterSets, to set the one of each report
+    """
+
+    filter_sets = FilterSets(sets)
+    add_client_wrapper(lambda client: FilterSetsClient(client, filter_sets))
+    return filter_sets
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Incremental reports: the buckets of the time series got in a run are
+stored, and the next runs only ask Elasticsearch for the last intervals.
+
+A time series search is one whose only aggregation is a date_histogram.
+Its buckets are stored by metric, identifying the metric by its search
+without the end of the ranges, which changes every run. In the next run,
+the last stored bucket (which may not have been complete) and the
+`lookback` ones before it are queried again, to get the items which
+arrived late, adding a filter on the histogram field to the search. The
+buckets before them are taken from the store.
+
+As the searches sent only match the last intervals, the hits.total of
+the responses is the sum of the doc_count of the merged buckets.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+
+from .clients import add_client_wrapper, request_key, search_body
+
+logger = logging.getLogger(__name__)
+
+# Number of stored intervals queried again besides the last one
+LOOKBACK = 1
+
+
+def without_end(body):
+    """
+    Remove from a search the end of the date ranges and histogram bounds,
+    so the searches of a metric in different runs are the same
+
+    :param body: body of the search
+    :returns: a copy of the body without the end dates
+    """
+
+    def strip(item):
+        if isinstance(item, dict):
+            result = {}
+            for key, value in item.items():
+                if key == "range":
+                    value = {field: {op: v for op, v in bounds.items() if op not in ("lt", "lte")}
+                             for field, bounds in value.items()}
+                elif key == "extended_bounds":
+                    value = {bound: v for bound, v in value.items() if bound != "max"}
+                else:
+                    value = strip(value)
+                result[key] = value
+            return result
+        elif isinstance(item, list):
+            return [strip(value) for value in item]
+        return item
+
+    return strip(body)
+
+
+def get_histogram(body):
+    """
+    Get the date_histogram of a time series search
+
+    :param body: body of the search
+    :returns: a tuple with the name and params of the histogram, or
+              (None, None) if the search is not a time series one
+    """
+
+    aggs = body.get("aggs", body.get("aggregations")) or {}
+    if len(aggs) != 1:
+        return None, None
+    (name, agg), = aggs.items()
+    if "date_histogram" not in agg:
+        return None, None
+    return str(name), agg["date_histogram"]
+
+
+class TimeseriesStore():
+    """Buckets of the time series of previous runs, stored in a JSON file
+
+    :param filename: JSON file with the buckets, created if it does not exist
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.series = {}
+        self._lock = threading.Lock()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.series = json.load(f)
+
+    def get(self, key):
+        return self.series.get(key)
+
+    def set(self, key, buckets):
+        with self._lock:
+            self.series[key] = buckets
+
+    def save(self):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self.series, f)
+        os.replace(tmp_filename, self.filename)
+        logger.info("%i time series stored in %s", len(self.series), self.filename)
+
+
+class IncrementalClient():
+    """Elasticsearch client which only asks for the last intervals of the
+    time series already stored, merging them with the stored ones.
+
+    :param client: Elasticsearch client used to run the searches
+    :param store: TimeseriesStore with the buckets of previous runs
+    :param lookback: number of stored intervals queried again besides the last one
+    """
+
+    def __init__(self, client, store, lookback=LOOKBACK):
+        self.client = client
+        self.store = store
+        self.lookback = lookback
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        name, histogram = get_histogram(body)
+        if not name:
+            return self.client.search(index=index, body=body, **params)
+
+        key = request_key(index, without_end(body), params)
+        stored = self.store.get(key) or []
+        cutoff = self.get_cutoff(stored, histogram)
+
+        if cutoff is None:
+            response = self.client.search(index=index, body=body, **params)
+            buckets = response["aggregations"][name]["buckets"]
+        else:
+            response = self.client.search(index=index, body=self.since(body, histogram, cutoff), **params)
+            buckets = [bucket for bucket in stored if bucket["key"] < cutoff]
+            logger.debug("%i intervals taken from the incremental store", len(buckets))
+            buckets += [bucket for bucket in response["aggregations"][name]["buckets"]
+                        if bucket["key"] >= cutoff]
+            response = dict(response)
+            response["aggregations"] = {name: dict(response["aggregations"][name], buckets=buckets)}
+            response["hits"] = dict(response["hits"], total=sum(b["doc_count"] for b in buckets))
+
+        self.store.set(key, buckets)
+        return response
+
+    def get_cutoff(self, stored, histogram):
+        """
+        Get the first interval to be queried again
+
+        :param stored: list of stored buckets
+        :param histogram: params of the date_histogram
+        :returns: the key of the first interval, or None if the whole
+                  time series must be queried
+        """
+
+        if len(stored) <= self.lookback:
+            return None
+
+        cutoff = stored[-(self.lookback + 1)]["key"]
+        end = histogram.get("extended_bounds", {}).get("max")
+        if isinstance(end, (int, float)) and end < cutoff:
+            # The series ends before the stored intervals
+            return None
+        return cutoff
+
+    @staticmethod
+    def since(body, histogram, cutoff):
+        """Add to a search a filter to get only the items from an interval on"""
+
+        body = copy.deepcopy(body)
+        cutoff_range = {"range": {histogram["field"]: {"gte": cutoff, "format": "epoch_millis"}}}
+        query = body.get("query")
+        filters = [query, cutoff_range] if query else [cutoff_range]
+        body["query"] = {"bool": {"filter": filters}}
+        return body
+
+
+def incremental_searches(filename, lookback=LOOKBACK):
+    """
+    Answer the time series searches from now on with the buckets stored in
+    a file by previous runs, only asking for the last intervals
+
+    :param filename: JSON file with the stored buckets
+    :param lookback: number of stored intervals queried again besides the last one
+    :returns: a function to save the buckets once done
+    """
+
+    store = TimeseriesStore(filename)
+    add_client_wrapper(lambda client: IncrementalClient(client, store, lookback))
+    return store.save
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import logging
+import os
+import subprocess
+import time
+
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+PDFLATEX_CMD = ["pdflatex", "-interaction=nonstopmode", "-file-line-error"]
+MAX_PASSES = 4  # upper limit of pdflatex runs to reach a fixpoint
+# Auxiliary files whose changes require another pdflatex pass
+AUX_EXTENSIONS = [".aux", ".toc"]
+# Messages written by LaTeX to the log when the references are not stable yet
+RERUN_MESSAGES = ["Rerun to get cross-references right",
+                  "Label(s) may have changed"]
+
+
+def aux_fingerprint(report_path, tex_file):
+    """
+    Compute a fingerprint of the auxiliary files generated by pdflatex.
+
+    :param report_path: directory in which the LaTeX document is compiled
+    :param tex_file: name of the main LaTeX file
+    :return: a hex digest with the contents of the .aux and .toc files
+    """
+
+    base_name = os.path.splitext(tex_file)[0]
+    digest = hashlib.sha1()
+    for ext in AUX_EXTENSIONS:
+        aux_file = os.path.join(report_path, base_name + ext)
+        if not os.path.exists(aux_file):
+            continue
+        with open(aux_file, "rb") as f:
+            digest.update(ext.encode('utf-8'))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def parse_log_errors(log):
+    """
+    Extract the errors reported by LaTeX in a log file.
+
+    LaTeX errors start with "!" or, when using -file-line-error,
+    with "file:line: message".
+
+    :param log: content of the LaTeX log file
+    :return: a list with the error messages found in the log
+    """
+
+    errors = []
+    lines = log.splitlines()
+    for pos, line in enumerate(lines):
+        if line.startswith("!"):
+            error = line[1:].strip()
+        elif ".tex:" in line and line.split(":")[1].isdigit():
+            error = line.strip()
+        else:
+            continue
+        # The line with the TeX source of the error follows with "l.<num>"
+        for context in lines[pos + 1:pos + 4]:
+            if context.startswith("l."):
+                error += " (" + context.strip() + ")"
+                break
+        errors.append(error)
+    return errors
+
+
+def needs_rerun(log):
+    """
+    Check if LaTeX asked for another pass to get the references right.
+
+    :param log: content of the LaTeX log file
+    :return: True if another pass is needed
+    """
+
+    return any(msg in log for msg in RERUN_MESSAGES)
+
+
+def read_log(report_path, tex_file):
+    """Read the log file generated by the last pdflatex pass"""
+
+    log_file = os.path.join(report_path, os.path.splitext(tex_file)[0] + ".log")
+    if not os.path.exists(log_file):
+        return ""
+    with open(log_file, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def build_pdf(report_path, tex_file="report.tex", timeout=None,
+              max_passes=MAX_PASSES, command=None):
+    """
+    Compile a LaTeX document running pdflatex until its auxiliary files
+    (table of contents, references) reach a fixpoint.
+
+    A second pass is only executed when the .aux/.toc files changed during
+    the previous one or LaTeX asked for it, so rebuilding a report whose
+    structure did not change costs a single pass.
+
+    :param report_path: directory with the LaTeX document
+    :param tex_file: name of the main LaTeX file
+    :param timeout: max number of seconds for each pdflatex pass (default: no limit)
+    :param max_passes: max number of pdflatex passes
+    :param command: command used to compile the document (default: PDFLATEX_CMD)
+    :return: a list with the time in seconds of each pass, or None if the build failed
+    """
+
+    command = command if command else PDFLATEX_CMD
+    timings = []
+    fingerprint = aux_fingerprint(report_path, tex_file)
+
+    while len(timings) < max_passes:
+        npass = len(timings) + 1
+        start = time.time()
+        try:
+            res = subprocess.run(command + [tex_file], cwd=report_path,
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("Error generating PDF: pass %i timed out after %s seconds",
+                         npass, timeout)
+            return None
+        timings.append(time.time() - start)
+        logger.info("LaTeX pass %i of %s done in %.2fs", npass, tex_file, timings[-1])
+
+        log = read_log(report_path, tex_file)
+        if res.returncode > 0:
+            errors = parse_log_errors(log)
+            if not errors:
+                errors = res.stdout.decode('utf-8', errors='replace').splitlines()[-5:]
+            logger.error("Error generating PDF:\n%s", "\n".join(errors))
+            return None
+
+        new_fingerprint = aux_fingerprint(report_path, tex_file)
+        if new_fingerprint == fingerprint and not needs_rerun(log):
+            break
+        fingerprint = new_fingerprint
+    else:
+        logger.warning("LaTeX references not stable after %i passes", max_passes)
+
+    logger.debug("LaTeX build of %s: %i passes in %.2fs", tex_file,
+                 len(timings), sum(timings))
+    profiler.record_stage("pdf", os.path.join(report_path, tex_file), sum(timings))
+    return timings
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Change detection between report runs.
+
+Before generating a report, the state of the index of each data source
+(number of items and last update and creation dates) is compared with the
+one stored in a manifest by the last run with the same params. Only the
+data sources whose index changed need to be queried and rendered again.
+The manifest is only updated once the report is done, so a failed run is
+fully repeated in the next one.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Manifest file written in the data dir of the report
+MANIFEST_FILE = "manifest.json"
+
+# Date fields whose last value identifies the last changes in an index
+DATE_FIELDS = ["metadata__updated_on", "grimoire_creation_date"]
+
+
+def index_state(es, index):
+    """
+    Get the state of an index with a single search: its number of items
+    and the last value of its date fields
+
+    :param es: Elasticsearch client
+    :param index: name of the index
+    :returns: a dict with the state of the index
+    """
+
+    body = {
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": {field: {"max": {"field": field}} for field in DATE_FIELDS}
+    }
+    response = es.search(index=index, body=body)
+
+    total = response["hits"]["total"]
+    if isinstance(total, dict):
+        # Elasticsearch 7 total
+        total = total["value"]
+    state = {"index": index, "count": total}
+    for field in DATE_FIELDS:
+        agg = response["aggregations"][field]
+        state[field] = agg.get("value_as_string", agg["value"])
+    return state
+
+
+class IndexChanges():
+    """Data sources whose index changed since the last run of a report
+
+    :param filename: manifest file of the report
+    :param es: Elasticsearch client
+    :param indices: dict with the index of each data source
+    :param params: dict with the params of the report, all the data sources
+                   are changed if they are not the ones of the last run
+    """
+
+    def __init__(self, filename, es, indices, params):
+        self.filename = filename
+        self.params = params
+        self.states = {ds: index_state(es, index) for ds, index in indices.items()}
+
+        stored = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                manifest = json.load(f)
+            if manifest.get("params") == params:
+                stored = manifest.get("data_sources", {})
+            else:
+                logger.info("Report params changed since the last run")
+
+        self.data_sources = [ds for ds in indices if stored.get(ds) != self.states[ds]]
+        logger.info("Data sources changed since the last run: %s", self.data_sources)
+
+    def save(self):
+        """Store the state of the indices once the report is done"""
+
+        manifest = {"params": self.params, "data_sources": self.states}
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
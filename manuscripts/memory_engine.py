@@ -0,0 +1,881 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+In-memory stand-in for Elasticsearch, so reports can be generated without
+a cluster (CI, laptops, small communities).
+
+The enriched items are loaded from JSON dumps, one item per line, in the
+format used by tests/data/indices and benchmarks/synthetic.py --output:
+
+    {"_index": "git", "_id": "...", "_source": {...}}
+
+or from the Parquet snapshots written by `manuscripts2 snapshot`, which
+are memory-mapped.
+
+Each index is kept as a pandas DataFrame and the searches are evaluated
+on its columns. Only the part of the DSL built by manuscripts and
+manuscripts2 is supported:
+
+- queries: bool (must, filter, should, must_not), match_all, match,
+  match_phrase, term, terms, range and exists. Strings are matched as
+  keywords, as in the enriched indices.
+- aggregations: date_histogram, terms, filter, filters, cardinality,
+  percentiles, avg, sum, min, max, value_count and extended_stats, with
+  sub-aggregations.
+- hits: size, from, _source and sort by field values.
+
+Responses have the same shape as the ones returned by Elasticsearch 6,
+which is the version the metrics code reads (hits.total is a number).
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import re
+import time
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Since pandas 2 the format of the dates is the one of the first date unless
+# the ISO8601 format is given, which is not known by previous versions
+ISO8601_FORMAT = {'format': 'ISO8601'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+
+# Calendar intervals of date_histogram and their pandas period
+CALENDAR_INTERVALS = {
+    "minute": "min", "1m": "min",
+    "hour": "h", "1h": "h",
+    "day": "D", "1d": "D",
+    "week": "W", "1w": "W",
+    "month": "M", "1M": "M",
+    "quarter": "Q", "1q": "Q",
+    "year": "Y", "1y": "Y"
+}
+
+# Units of the fixed intervals and offsets of date_histogram
+TIME_UNITS = {"ms": "ms", "s": "s", "m": "min", "h": "h", "d": "D"}
+TIME_VALUE_REGEX = re.compile(r"^([+-]?\d+)(ms|s|m|h|d)$")
+
+DEFAULT_PERCENTS = [1.0, 5.0, 25.0, 50.0, 75.0, 95.0, 99.0]
+DEFAULT_TERMS_SIZE = 10
+DEFAULT_HITS_SIZE = 10
+
+# Field types stored with single precision by Elasticsearch
+FLOAT_TYPES = ["float", "half_float"]
+
+# Request fields which do not change the results of a search
+IGNORED_FIELDS = ["profile", "track_total_hits", "timeout", "request_cache"]
+
+
+def parse_time_value(value):
+    """
+    Convert an ES time value (7d, -1h, 30m) to a pandas Timedelta
+
+    :param value: string with the time value
+    :return: a pandas Timedelta
+    """
+
+    match = TIME_VALUE_REGEX.match(str(value).strip())
+    if not match:
+        raise RuntimeError("Time value not supported by the memory engine: %s" % value)
+    return pd.Timedelta(int(match.group(1)), unit=TIME_UNITS[match.group(2)])
+
+
+def to_timestamp(value):
+    """
+    Convert a date from a query (datetime, ISO string or epoch millis) to a
+    UTC pandas Timestamp. Dates without time zone are in UTC, as in ES.
+
+    :param value: date to be converted
+    :return: a pandas Timestamp in UTC
+    """
+
+    if isinstance(value, (int, float, np.number)):
+        return pd.Timestamp(float(value), unit='ms', tz='UTC')
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        return ts.tz_localize('UTC')
+    return ts.tz_convert('UTC')
+
+
+def parse_dates(values):
+    """
+    Convert some ISO dates, with or without time and time zone, to UTC
+    timestamps. Values which are not dates are converted to NaT.
+
+    :param values: pandas Series with the dates
+    :return: a pandas Series of UTC timestamps
+    """
+
+    return pd.to_datetime(values, utc=True, errors='coerce', **ISO8601_FORMAT)
+
+
+def format_date(ts):
+    """
+    Format a date as the key_as_string of ES (strict_date_optional_time)
+
+    :param ts: pandas Timestamp with time zone
+    :return: a string like 2018-01-01T00:00:00.000Z
+    """
+
+    text = ts.strftime("%Y-%m-%dT%H:%M:%S.") + "%03i" % (ts.microsecond // 1000)
+    offset = ts.utcoffset()
+    if not offset:
+        return text + "Z"
+    return text + ts.strftime("%z")[:3] + ":" + ts.strftime("%z")[3:]
+
+
+def to_millis(ts):
+    """Convert a pandas Timestamp to epoch millis"""
+
+    return int(ts.value // 10**6)
+
+
+def native(value):
+    """Convert a numpy/pandas scalar to a JSON serializable python value"""
+
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def is_true(value):
+    """Convert the query values for boolean fields ("true", True, 1) to bool"""
+
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
+def read_dump(filename):
+    """
+    Read the items of an index dump. Lines can be ES hits (with _index,
+    _id and _source) or plain items, which are assigned to an index named
+    after the file.
+
+    :param filename: JSON lines file
+    :returns: a generator of (index, id, source) tuples
+    """
+
+    default_index = os.path.splitext(os.path.basename(filename))[0]
+    with open(filename) as f:
+        for nline, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            if "_source" in doc:
+                yield doc.get("_index", default_index), doc.get("_id", str(nline)), doc["_source"]
+            else:
+                yield default_index, str(nline), doc
+
+
+def read_snapshot(filename):
+    """
+    Read the items of an index snapshot, memory-mapping the Parquet file
+
+    :param filename: Parquet file written by manuscripts2 snapshot
+    :returns: a tuple with the list of ids and a DataFrame with the items
+    """
+
+    df = pd.read_parquet(filename, memory_map=True)
+    if "_id" in df.columns:
+        ids = df.pop("_id").tolist()
+    else:
+        ids = [str(pos) for pos in range(len(df))]
+    return ids, df
+
+
+class MemoryIndex():
+    """Items of an index stored as a pandas DataFrame, with one column per field.
+
+    :param name: name of the index
+    :param ids: list with the ids of the items
+    :param df: DataFrame with the items, one row per item
+    :param sources: list with the items (the _source of each one), if they
+                    were loaded from a dump. Otherwise the _source is built
+                    from the DataFrame.
+    """
+
+    def __init__(self, name, ids, df, sources=None):
+        self.name = name
+        self.ids = ids
+        self.sources = sources
+        self.df = df.reset_index(drop=True)
+        self._dates = {}
+        self._lists = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def source(self, row):
+        """Get the _source of an item"""
+
+        if self.sources is not None:
+            return self.sources[row]
+
+        item = {}
+        for field, value in self.df.iloc[row].items():
+            if isinstance(value, (list, np.ndarray)):
+                item[field] = list(value)
+            elif pd.isna(value):
+                continue
+            elif isinstance(value, pd.Timestamp):
+                item[field] = value.isoformat()
+            else:
+                item[field] = native(value)
+        return item
+
+    def set_mappings(self, properties):
+        """
+        Store the fields as Elasticsearch does according to their mapping.
+        Float fields are kept with single precision, so aggregations on them
+        give the same results as in Elasticsearch.
+
+        :param properties: dict with the mapping of each field
+        """
+
+        for field, mapping in properties.items():
+            if field in self.df.columns and mapping.get("type") in FLOAT_TYPES:
+                self.df[field] = pd.to_numeric(self.df[field], errors='coerce') \
+                    .astype(np.float32).astype(float)
+
+    def column(self, field):
+        """Values of a field, all of them missing if no item has it"""
+
+        if field in self.df.columns:
+            return self.df[field]
+        return pd.Series([None] * len(self), index=self.df.index, dtype=object)
+
+    def is_numeric(self, field):
+        col = self.column(field)
+        return pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col)
+
+    def has_lists(self, field):
+        """Check whether a field has multiple values in some items"""
+
+        if field not in self._lists:
+            col = self.column(field)
+            self._lists[field] = col.dtype == object and col.map(lambda v: isinstance(v, list)).any()
+        return self._lists[field]
+
+    def values(self, field, rows):
+        """Values of a field in some items, with one row per value, so items
+        with lists of values appear in several rows (with the same index)"""
+
+        col = self.column(field).iloc[rows]
+        if self.has_lists(field):
+            col = col.explode()
+        return col
+
+    def dates(self, field):
+        """Values of a date field as UTC timestamps, converted once and cached"""
+
+        if field not in self._dates:
+            col = self.column(field)
+            if pd.api.types.is_datetime64_any_dtype(col):
+                dates = col.dt.tz_localize('UTC') if col.dt.tz is None else col.dt.tz_convert('UTC')
+            elif self.is_numeric(field):
+                dates = pd.to_datetime(col, unit='ms', utc=True, errors='coerce')
+            else:
+                dates = parse_dates(col)
+            self._dates[field] = dates
+        return self._dates[field]
+
+    def is_date(self, field):
+        """Check whether the values of a field are dates"""
+
+        col = self.column(field)
+        return not self.is_numeric(field) and self.dates(field).notna().sum() == col.notna().sum()
+
+    def numbers(self, field, rows):
+        """Values of a field in some items as numbers. Dates are converted
+        to epoch millis."""
+
+        col = self.column(field)
+        if self.is_numeric(field):
+            return self.values(field, rows).astype(float)
+        if pd.api.types.is_bool_dtype(col):
+            return col.iloc[rows].astype(float)
+        dates = self.dates(field).iloc[rows]
+        # Converted by numpy, as the unit of the dates depends on the pandas version
+        millis = dates.dt.tz_convert(None).to_numpy().astype('datetime64[ms]').astype('int64')
+        millis = pd.Series(millis, index=dates.index)
+        return millis.astype(float).where(dates.notna())
+
+
+class MemoryClient():
+    """Client which answers the searches evaluating them on the items of
+    index dumps loaded in memory, instead of sending them to Elasticsearch.
+
+    :param paths: list of dump files or directories with dump files (*.json)
+    """
+
+    def __init__(self, paths=None):
+        self.indices = {}
+        self._merged = {}
+        for path in paths or []:
+            self.load(path)
+
+    def load(self, path, index=None):
+        """
+        Load the items of a dump file, or of all the dump files in a directory
+
+        :param path: dump (.json) or snapshot (.parquet) file, or directory with them
+        :param index: name of the index for the items, the one in the dump
+                      or the name of the snapshot file if None
+        """
+
+        if os.path.isdir(path):
+            filenames = sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if name.endswith((".json", ".parquet")))
+        else:
+            filenames = [path]
+
+        items = {}
+        for filename in filenames:
+            if filename.endswith(".parquet"):
+                name = index or os.path.splitext(os.path.basename(filename))[0]
+                self.add_index(MemoryIndex(name, *read_snapshot(filename)))
+                continue
+            for item_index, item_id, source in read_dump(filename):
+                ids, sources = items.setdefault(index or item_index, ([], []))
+                ids.append(item_id)
+                sources.append(source)
+
+        for name, (ids, sources) in items.items():
+            self.add_index(MemoryIndex(name, ids, pd.DataFrame.from_records(sources), sources))
+
+    def add_index(self, mem_index):
+        """Add the items of a memory index, joining them to the ones of the
+        index with the same name if it was already loaded"""
+
+        if mem_index.name in self.indices:
+            mem_index = self.merge(mem_index.name, [self.indices[mem_index.name], mem_index])
+        self.indices[mem_index.name] = mem_index
+        self._merged = {}
+        logger.debug("%i items loaded in memory index %s", len(mem_index), mem_index.name)
+
+    @staticmethod
+    def merge(name, mem_indices):
+        """Join the items of several memory indices in a new one"""
+
+        ids = [item_id for mem_index in mem_indices for item_id in mem_index.ids]
+        df = pd.concat([mem_index.df for mem_index in mem_indices], ignore_index=True)
+        sources = None
+        if all(mem_index.sources is not None for mem_index in mem_indices):
+            sources = [source for mem_index in mem_indices for source in mem_index.sources]
+        return MemoryIndex(name, ids, df, sources)
+
+    def load_mappings(self, index, filename):
+        """
+        Apply to an index loaded the mappings used to create it in Elasticsearch
+
+        :param index: name of the index
+        :param filename: JSON file with the mappings, as sent to create the index
+        """
+
+        with open(filename) as f:
+            mappings = json.load(f)
+        mappings = mappings.get("mappings", mappings)
+        if "properties" not in mappings:
+            # Mappings with a type name (Elasticsearch 6)
+            mappings = next(iter(mappings.values()))
+        self.indices[index].set_mappings(mappings.get("properties", {}))
+        self._merged = {}
+
+    def resolve(self, index):
+        """
+        Get the memory index to be searched, merging all the indices matching
+        the names or patterns requested
+
+        :param index: index name, pattern, comma separated list of them, or a list
+        :return: a MemoryIndex
+        """
+
+        if index is None or index == "_all":
+            patterns = ["*"]
+        elif isinstance(index, (list, tuple)):
+            patterns = [name for item in index for name in item.split(",")]
+        else:
+            patterns = index.split(",")
+
+        names = []
+        for pattern in patterns:
+            matches = sorted(name for name in self.indices if fnmatch.fnmatchcase(name, pattern))
+            if not matches:
+                raise RuntimeError("Index not found in the memory engine", pattern)
+            names.extend(name for name in matches if name not in names)
+
+        if len(names) == 1:
+            return self.indices[names[0]]
+
+        key = tuple(names)
+        if key not in self._merged:
+            self._merged[key] = self.merge(",".join(names), [self.indices[name] for name in names])
+        return self._merged[key]
+
+    def search(self, index=None, body=None, **params):
+        from .clients import search_body
+
+        start = time.perf_counter()
+        body, params = search_body(body, params)
+        for field in body:
+            if field not in ("query", "aggs", "aggregations", "size", "from", "_source", "sort") \
+                    and field not in IGNORED_FIELDS:
+                raise RuntimeError("Search field not supported by the memory engine", field)
+
+        mem_index = self.resolve(index)
+        mask = self.query_mask(mem_index, body.get("query", {"match_all": {}}))
+        rows = np.flatnonzero(mask)
+        if body.get("sort"):
+            rows = self.sort_rows(mem_index, rows, body["sort"])
+
+        size = int(body.get("size", DEFAULT_HITS_SIZE))
+        offset = int(body.get("from", 0))
+        source = body.get("_source", True)
+        hits = [self.hit(mem_index, row, source) for row in rows[offset:offset + size]]
+
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": len(rows), "max_score": 1.0 if hits else None, "hits": hits}
+        }
+        aggs = body.get("aggs", body.get("aggregations"))
+        if aggs:
+            response["aggregations"] = self.aggregations(mem_index, rows, aggs)
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        return response
+
+    @staticmethod
+    def sort_rows(mem_index, rows, sort):
+        """Sort the positions of some items by the value of their fields.
+        Items without value go to the end, as in Elasticsearch."""
+
+        if not isinstance(sort, list):
+            sort = [sort]
+        for item in reversed(sort):
+            if isinstance(item, str):
+                field, direction = item, "asc"
+            else:
+                (field, direction), = item.items()
+                if isinstance(direction, dict):
+                    direction = direction.get("order", "asc")
+            if field in ("_doc", "_score"):
+                continue
+            if not mem_index.has_lists(field) and (mem_index.is_numeric(field) or mem_index.is_date(field)):
+                values = mem_index.numbers(field, rows)
+            else:
+                values = mem_index.column(field).iloc[rows].map(str, na_action='ignore')
+            values = values.reset_index(drop=True)
+            missing = values.isna().to_numpy()
+            order = values.sort_values(ascending=(direction == "asc"), kind="stable").index.to_numpy()
+            order = np.concatenate([order[~missing[order]], order[missing[order]]])
+            rows = rows[order]
+        return rows
+
+    @staticmethod
+    def hit(mem_index, row, source):
+        """Build the hit of an item, including the fields of _source requested"""
+
+        item = mem_index.source(row)
+        if source is False:
+            item = None
+        elif source is not True:
+            includes = source.get("includes", ["*"]) if isinstance(source, dict) else source
+            if isinstance(includes, str):
+                includes = [includes]
+            item = {field: value for field, value in item.items()
+                    if any(fnmatch.fnmatchcase(field, pattern) for pattern in includes)}
+
+        hit = {"_index": mem_index.name, "_type": "items", "_id": mem_index.ids[row], "_score": 1.0}
+        if item is not None:
+            hit["_source"] = item
+        return hit
+
+    # Queries
+
+    def query_mask(self, mem_index, query):
+        """
+        Evaluate a query on all the items of an index
+
+        :param mem_index: MemoryIndex to be searched
+        :param query: dict with the query
+        :return: a numpy array of bools, True for the items matching the query
+        """
+
+        nitems = len(mem_index)
+        if not query:
+            return np.ones(nitems, dtype=bool)
+        if len(query) != 1:
+            raise RuntimeError("Query with several clauses not supported by the memory engine", query)
+
+        (kind, params), = query.items()
+        if kind == "match_all":
+            return np.ones(nitems, dtype=bool)
+        elif kind == "match_none":
+            return np.zeros(nitems, dtype=bool)
+        elif kind == "bool":
+            return self.bool_mask(mem_index, params)
+        elif kind in ("match", "match_phrase", "term"):
+            (field, value), = params.items()
+            if isinstance(value, dict):
+                value = value.get("query", value.get("value"))
+            return self.equals_mask(mem_index, field, [value])
+        elif kind == "terms":
+            (field, values), = params.items()
+            return self.equals_mask(mem_index, field, values)
+        elif kind == "range":
+            return self.range_mask(mem_index, params)
+        elif kind == "exists":
+            return mem_index.column(params["field"]).notna().to_numpy()
+        raise RuntimeError("Query not supported by the memory engine", kind)
+
+    def bool_mask(self, mem_index, params):
+        def clauses(occur):
+            value = params.get(occur, [])
+            return value if isinstance(value, list) else [value]
+
+        mask = np.ones(len(mem_index), dtype=bool)
+        for clause in clauses("must") + clauses("filter"):
+            mask &= self.query_mask(mem_index, clause)
+        for clause in clauses("must_not"):
+            mask &= ~self.query_mask(mem_index, clause)
+
+        should = clauses("should")
+        min_should = params.get("minimum_should_match",
+                                0 if (params.get("must") or params.get("filter")) else 1)
+        if should and int(min_should):
+            matches = sum(self.query_mask(mem_index, clause).astype(int) for clause in should)
+            mask &= matches >= int(min_should)
+        return mask
+
+    @staticmethod
+    def equals_mask(mem_index, field, values):
+        col = mem_index.column(field)
+        if pd.api.types.is_bool_dtype(col) or any(isinstance(v, bool) for v in col.dropna()[:1]):
+            values = [is_true(value) for value in values]
+        elif mem_index.is_numeric(field):
+            values = [float(value) for value in values]
+        else:
+            values = [str(value) if not isinstance(value, bool) else str(value).lower()
+                      for value in values]
+
+        if mem_index.has_lists(field):
+            return col.map(lambda v: any(item in values for item in v) if isinstance(v, list)
+                           else v in values).to_numpy(dtype=bool)
+        return col.isin(values).to_numpy()
+
+    @staticmethod
+    def range_mask(mem_index, params):
+        mask = np.ones(len(mem_index), dtype=bool)
+        for field, bounds in params.items():
+            if mem_index.is_numeric(field):
+                col = mem_index.column(field)
+                convert = float
+            else:
+                col = mem_index.dates(field)
+                convert = to_timestamp
+            for op, compare in (("gte", col.ge), ("gt", col.gt), ("lte", col.le), ("lt", col.lt)):
+                if bounds.get(op) is not None:
+                    mask &= compare(convert(bounds[op])).to_numpy(dtype=bool, na_value=False)
+        return mask
+
+    # Aggregations
+
+    def aggregations(self, mem_index, rows, aggs):
+        """
+        Compute the aggregations on some items of an index
+
+        :param mem_index: MemoryIndex with the items
+        :param rows: numpy array with the positions of the items to aggregate
+        :param aggs: dict with the aggregations, by name
+        :return: a dict with the result of each aggregation, by name
+        """
+
+        results = {}
+        for name, agg in aggs.items():
+            agg = dict(agg)
+            sub_aggs = agg.pop("aggs", agg.pop("aggregations", {}))
+            agg.pop("meta", None)
+            (kind, params), = agg.items()
+
+            method = getattr(self, "agg_" + kind, None)
+            if not method:
+                raise RuntimeError("Aggregation not supported by the memory engine", kind)
+            if kind in ("date_histogram", "terms", "filter", "filters"):
+                results[str(name)] = method(mem_index, rows, params, sub_aggs)
+            else:
+                results[str(name)] = method(mem_index, rows, params)
+        return results
+
+    def bucket(self, mem_index, rows, sub_aggs, **key):
+        bucket = dict(key)
+        bucket["doc_count"] = len(rows)
+        bucket.update(self.aggregations(mem_index, rows, sub_aggs))
+        return bucket
+
+    def agg_date_histogram(self, mem_index, rows, params, sub_aggs):
+        interval = params.get("calendar_interval", params.get("fixed_interval", params.get("interval")))
+        tz = params.get("time_zone", "UTC")
+        offset = parse_time_value(params["offset"]) if params.get("offset") else pd.Timedelta(0)
+        min_doc_count = params.get("min_doc_count", 1)
+
+        if interval in CALENDAR_INTERVALS:
+            freq = CALENDAR_INTERVALS[interval]
+
+            def floor(dates):
+                local = (dates.dt.tz_convert(tz) - offset).dt.tz_localize(None)
+                return local.dt.to_period(freq)
+
+            def key_dates(periods):
+                starts = pd.Series(periods).dt.start_time
+                starts = starts.dt.tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+                return starts + offset
+
+            def key_range(first, last):
+                return pd.period_range(first, last, freq=freq)
+        else:
+            step = parse_time_value(interval)
+
+            def floor(dates):
+                local = (dates.dt.tz_convert(tz) - offset).dt.tz_localize(None)
+                return local.dt.floor(step)
+
+            def key_dates(starts):
+                return pd.Series(starts).dt.tz_localize(tz, ambiguous=True,
+                                                        nonexistent='shift_forward') + offset
+
+            def key_range(first, last):
+                return pd.date_range(first, last, freq=step)
+
+        dates = mem_index.dates(params["field"]).iloc[rows]
+        dates = dates[dates.notna()]
+        keys = floor(dates)
+        # The index of the DataFrame is the position of each item
+        groups = {key: group.to_numpy() for key, group in dates.index.to_series().groupby(keys)}
+
+        if min_doc_count == 0:
+            limits = list(groups)
+            bounds = params.get("extended_bounds", {})
+            for bound in ("min", "max"):
+                if bounds.get(bound) is not None:
+                    limits.extend(floor(pd.Series([to_timestamp(bounds[bound])])))
+            periods = key_range(min(limits), max(limits)) if limits else []
+        else:
+            periods = sorted(key for key, group in groups.items() if len(group) >= min_doc_count)
+
+        buckets = []
+        empty = np.array([], dtype=int)
+        for period, key in zip(periods, key_dates(list(periods)) if len(periods) else []):
+            buckets.append(self.bucket(mem_index, groups.get(period, empty), sub_aggs,
+                                       key_as_string=format_date(key), key=to_millis(key)))
+        return {"buckets": buckets}
+
+    def agg_filter(self, mem_index, rows, params, sub_aggs):
+        mask = self.query_mask(mem_index, params)[rows]
+        return self.bucket(mem_index, rows[mask], sub_aggs)
+
+    def agg_filters(self, mem_index, rows, params, sub_aggs):
+        filters = params["filters"]
+        if isinstance(filters, dict):
+            buckets = {name: self.agg_filter(mem_index, rows, query, sub_aggs)
+                       for name, query in filters.items()}
+        else:
+            buckets = [self.agg_filter(mem_index, rows, query, sub_aggs) for query in filters]
+        return {"buckets": buckets}
+
+    def agg_terms(self, mem_index, rows, params, sub_aggs):
+        field = params["field"]
+        size = params.get("size", DEFAULT_TERMS_SIZE)
+        order = params.get("order", [{"_count": "desc"}])
+        if isinstance(order, dict):
+            order = [{k: v} for k, v in order.items()]
+        # Ties are broken by the term, as Elasticsearch does
+        order = order + [{"_key": "asc"}]
+
+        values = mem_index.values(field, rows)
+        if params.get("missing") is not None:
+            values = values.astype(object).where(values.notna(), params["missing"])
+        else:
+            values = values.dropna()
+
+        groups = {key: np.unique(group.to_numpy())
+                  for key, group in values.index.to_series().groupby(values.to_numpy(), sort=False)}
+
+        buckets = [self.bucket(mem_index, group, {}, key=key) for key, group in groups.items()]
+        for bucket in buckets:
+            bucket["rows"] = groups[bucket["key"]]
+
+        # Buckets ordered by a sub-aggregation need it computed for all of them
+        by_metric = any(k not in ("_count", "_key") for item in order for k in item)
+        if by_metric:
+            for bucket in buckets:
+                bucket.update(self.aggregations(mem_index, bucket["rows"], sub_aggs))
+
+        for item in reversed(order):
+            (criteria, direction), = item.items()
+            buckets.sort(key=lambda bucket: self.sort_value(bucket, criteria),
+                         reverse=(direction == "desc"))
+
+        total = sum(bucket["doc_count"] for bucket in buckets)
+        buckets = buckets[:size]
+        for bucket in buckets:
+            group_rows = bucket.pop("rows")
+            if not by_metric:
+                bucket.update(self.aggregations(mem_index, group_rows, sub_aggs))
+            key = bucket["key"]
+            if isinstance(key, (bool, np.bool_)):
+                bucket["key"] = int(key)
+                bucket["key_as_string"] = str(bool(key)).lower()
+            else:
+                bucket["key"] = native(key)
+
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": total - sum(bucket["doc_count"] for bucket in buckets),
+            "buckets": buckets
+        }
+
+    @staticmethod
+    def metric_value(result, metric=None):
+        if metric:
+            return result["values"][metric] if "values" in result else result[metric]
+        value = result["value"]
+        return value if value is not None else float("-inf")
+
+    @classmethod
+    def sort_value(cls, bucket, criteria):
+        if criteria == "_count":
+            return bucket["doc_count"]
+        if criteria == "_key":
+            return bucket["key"]
+        name, _, metric = criteria.partition(".")
+        return cls.metric_value(bucket[name], metric)
+
+    @staticmethod
+    def field_values(mem_index, rows, params):
+        values = mem_index.numbers(params["field"], rows)
+        if params.get("missing") is not None:
+            return values.fillna(float(params["missing"])).to_numpy()
+        return values.dropna().to_numpy()
+
+    def agg_cardinality(self, mem_index, rows, params):
+        values = mem_index.values(params["field"], rows)
+        return {"value": int(values.dropna().astype(str).nunique())}
+
+    def agg_value_count(self, mem_index, rows, params):
+        values = mem_index.values(params["field"], rows)
+        return {"value": int(values.notna().sum())}
+
+    def agg_sum(self, mem_index, rows, params):
+        return {"value": float(self.field_values(mem_index, rows, params).sum())}
+
+    def agg_avg(self, mem_index, rows, params):
+        values = self.field_values(mem_index, rows, params)
+        return {"value": float(values.mean()) if len(values) else None}
+
+    def agg_min(self, mem_index, rows, params):
+        return self.single_value(mem_index, rows, params, np.min)
+
+    def agg_max(self, mem_index, rows, params):
+        return self.single_value(mem_index, rows, params, np.max)
+
+    def single_value(self, mem_index, rows, params, func):
+        values = self.field_values(mem_index, rows, params)
+        if not len(values):
+            return {"value": None}
+        result = {"value": float(func(values))}
+        if not mem_index.is_numeric(params["field"]):
+            result["value_as_string"] = format_date(pd.Timestamp(result["value"], unit='ms', tz='UTC'))
+        return result
+
+    def agg_percentiles(self, mem_index, rows, params):
+        percents = [float(p) for p in params.get("percents", DEFAULT_PERCENTS)]
+        values = self.field_values(mem_index, rows, params)
+        if len(values):
+            results = [float(v) for v in np.percentile(values, percents)]
+        else:
+            results = [None] * len(percents)
+
+        if params.get("keyed", True):
+            return {"values": {str(p): v for p, v in zip(percents, results)}}
+        return {"values": [{"key": p, "value": v} for p, v in zip(percents, results)]}
+
+    def agg_extended_stats(self, mem_index, rows, params):
+        values = self.field_values(mem_index, rows, params)
+        sigma = params.get("sigma", 2.0)
+        if not len(values):
+            return {"count": 0, "min": None, "max": None, "avg": None, "sum": 0.0,
+                    "sum_of_squares": None, "variance": None, "std_deviation": None,
+                    "std_deviation_bounds": {"upper": None, "lower": None}}
+
+        avg = float(values.mean())
+        std = float(values.std())
+        return {
+            "count": len(values),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "avg": avg,
+            "sum": float(values.sum()),
+            "sum_of_squares": float((values ** 2).sum()),
+            "variance": float(values.var()),
+            "std_deviation": std,
+            "std_deviation_bounds": {"upper": avg + sigma * std, "lower": avg - sigma * std}
+        }
+
+
+def use_memory_engine(paths, mappings=None):
+    """
+    Answer all the searches from now on with the items of index dumps
+    loaded in memory, without connecting to Elasticsearch
+
+    :param paths: list of dump files or directories. A path can be given as
+                  INDEX=PATH to load its items in the index INDEX.
+    :param mappings: list of INDEX=FILE with the mappings of the indices
+    :returns: the MemoryClient used
+    """
+
+    from .clients import add_client_wrapper
+
+    memory_client = MemoryClient()
+    for path in paths:
+        index = None
+        if "=" in path and not os.path.exists(path):
+            index, path = path.split("=", 1)
+        memory_client.load(path, index)
+    for mapping in mappings or []:
+        index, filename = mapping.split("=", 1)
+        memory_client.load_mappings(index, filename)
+
+    add_client_wrapper(lambda client: memory_client)
+    return memory_client
@@ -21,11 +21,13 @@
 #
 
 import logging
+import time
 
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
 
+from ..clients import es_client
 from ..esquery import ElasticQuery
+from ..profiler import profiler
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +57,7 @@ class Metrics(object):
     interval = '1M'  # interval to be used in all metrics
     offset = None  # offset to be used in date histogram in all metrics
     es_headers = {'Content-Type': 'application/json'}
+    ds = None  # data source class for the metric
 
     def __init__(self, es_url, es_index, start=None, end=None, esfilters={},
                  interval=None, offset=None):
@@ -157,16 +160,20 @@ class Metrics(object):
             url = self.es_url
         else:
             url = 'http://' + self.es_url
-        es = Elasticsearch(url)
+        es = es_client(url)
         s = Search(using=es, index=self.es_index)
         s = s.update_from_dict(query)
         try:
-            response = s.execute()
-            return response.to_dict()
+            start = time.perf_counter()
+            response = s.execute().to_dict()
+            ds_name = self.ds.name if self.ds else self.es_index
+            profiler.record_query(self.id, ds_name, time.perf_counter() - start, response)
+            profiler.profile_search(s, self.id, ds_name)
+            return response
         except Exception as e:
             print()
             print("In get_metrics_data: Failed to fetch data.\n Query: {}, \n Error Info: {}"
-                  .format(query, e.info))
+                  .format(query, getattr(e, 'info', e)))
             raise
 
     def get_ts(self):
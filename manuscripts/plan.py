@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Dry run of a report: the sections of the report are generated answering
+their searches with empty indices, so all the searches of the report are
+known without sending them to Elasticsearch. The searches are collected in
+a query plan with the aggregations of each one, its date range and an
+estimate of the buckets of its response, computed from the histogram
+intervals and the terms sizes.
+
+Searches which depend on the data got by others are not in the plan, like
+the ones of each project, as no project is found in empty indices.
+"""
+
+import json
+import logging
+import tempfile
+
+import pandas as pd
+
+from .clients import add_client_wrapper, request_key, search_body
+from .memory_engine import (CALENDAR_INTERVALS, DEFAULT_TERMS_SIZE, MemoryClient,
+                            MemoryIndex, parse_time_value, to_timestamp)
+from .profiler import SUMMARY_TOP, profiler
+
+logger = logging.getLogger(__name__)
+
+# Aggregations whose number of buckets is given by a param of the aggregation
+LIST_BUCKETS = ["ranges", "filters"]
+
+
+class PlanningClient(MemoryClient):
+    """Client which collects the searches of a report, answering them as if
+    all the indices searched were empty"""
+
+    def __init__(self):
+        super().__init__()
+        self.searches = []
+
+    def resolve(self, index):
+        names = index if isinstance(index, (list, tuple)) else (index or "_all").split(",")
+        for name in names:
+            if name not in self.indices:
+                self.indices[name] = MemoryIndex(name, [], pd.DataFrame(), sources=[])
+        return super().resolve(index)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        if isinstance(index, (list, tuple)):
+            index = ",".join(index)
+        self.searches.append({"index": index, "body": body, "params": params,
+                              "section": profiler.section})
+        return super().search(index=index, body=body, **params)
+
+
+def plan_searches():
+    """
+    Collect all the searches from now on in a query plan, without sending them
+    to Elasticsearch
+
+    :returns: the PlanningClient answering the searches
+    """
+
+    planner = PlanningClient()
+    add_client_wrapper(lambda client: planner)
+    return planner
+
+
+def get_agg_type(agg):
+    """Get the type and the params of an aggregation"""
+
+    agg_type = [key for key in agg if key not in ("aggs", "aggregations", "meta")][0]
+    return agg_type, agg[agg_type]
+
+
+def get_date_ranges(query, ranges=None):
+    """
+    Get the date ranges of the filters of a query
+
+    :param query: dict with the query of a search
+    :param ranges: dict in which to add the ranges found
+    :returns: a dict with the range of each field, as a dict with its bounds
+    """
+
+    if ranges is None:
+        ranges = {}
+    if isinstance(query, list):
+        for clause in query:
+            get_date_ranges(clause, ranges)
+    elif isinstance(query, dict):
+        for key, value in query.items():
+            if key == "range":
+                for field, bounds in value.items():
+                    ranges.setdefault(field, {}).update({op: bound for op, bound in bounds.items()
+                                                         if op in ("gt", "gte", "lt", "lte")})
+            elif key != "must_not":
+                get_date_ranges(value, ranges)
+    return ranges
+
+
+def count_periods(params, date_ranges):
+    """
+    Estimate the buckets of a date histogram: the intervals between its
+    extended bounds, or between the bounds of the date range of its field
+
+    :param params: params of the date_histogram aggregation
+    :param date_ranges: date ranges of the query, as returned by get_date_ranges
+    :returns: the number of buckets, or None if the histogram has no bounds
+    """
+
+    bounds = params.get("extended_bounds") or {}
+    field_range = date_ranges.get(params.get("field"), {})
+    start = bounds.get("min", field_range.get("gte", field_range.get("gt")))
+    end = bounds.get("max", field_range.get("lte", field_range.get("lt")))
+    if start is None or end is None:
+        return None
+
+    start = to_timestamp(start).tz_convert(None)
+    end = to_timestamp(end).tz_convert(None)
+    interval = params.get("calendar_interval", params.get("interval", params.get("fixed_interval")))
+    if interval in CALENDAR_INTERVALS:
+        return len(pd.period_range(start, end, freq=CALENDAR_INTERVALS[interval]))
+    return int((end - start) / parse_time_value(interval)) + 1
+
+
+def estimate_buckets(aggs, date_ranges):
+    """
+    Estimate the buckets of the response to some aggregations, counted as the
+    profiler does: including the buckets of the nested aggregations
+
+    :param aggs: dict with the aggregations of a search
+    :param date_ranges: date ranges of the query, as returned by get_date_ranges
+    :returns: the number of buckets, or None if it can not be estimated
+    """
+
+    total = 0
+    for agg in aggs.values():
+        agg_type, params = get_agg_type(agg)
+        if agg_type == "date_histogram":
+            buckets = count_periods(params, date_ranges)
+        elif agg_type == "terms":
+            buckets = params.get("size", DEFAULT_TERMS_SIZE)
+        elif any(key in params for key in LIST_BUCKETS):
+            buckets = len([param for key in LIST_BUCKETS for param in params.get(key, [])])
+        else:
+            # Metric and single bucket aggregations
+            buckets = 0
+        if buckets is None:
+            return None
+
+        sub_aggs = agg.get("aggs", agg.get("aggregations"))
+        sub_buckets = estimate_buckets(sub_aggs, date_ranges) if sub_aggs else 0
+        if sub_buckets is None:
+            return None
+        total += buckets + max(buckets, 1) * sub_buckets
+    return total
+
+
+def describe_aggs(aggs):
+    """
+    Describe the tree of aggregations of a search
+
+    :param aggs: dict with the aggregations of a search
+    :returns: a string like date_histogram(grimoire_creation_date, month) > cardinality(hash)
+    """
+
+    descriptions = []
+    for agg in aggs.values():
+        agg_type, params = get_agg_type(agg)
+        args = [str(params[key]) for key in ("field", "calendar_interval", "interval", "fixed_interval", "size")
+                if key in params]
+        description = "%s(%s)" % (agg_type, ", ".join(args))
+        sub_aggs = agg.get("aggs", agg.get("aggregations"))
+        if sub_aggs:
+            description += " > " + describe_aggs(sub_aggs)
+        descriptions.append(description)
+    if len(descriptions) == 1:
+        return descriptions[0]
+    return "[%s]" % ", ".join(descriptions)
+
+
+def index_stats(client, indices):
+    """
+    Get the number of items and the size of some indices
+
+    :param client: Elasticsearch client
+    :param indices: list of index names
+    :returns: a dict with the docs and size_in_bytes of each index, or None
+              if the stats can not be got
+    """
+
+    try:
+        stats = client.indices.stats(index=",".join(indices), metric="docs,store")
+    except Exception as e:
+        logger.warning("Can not get the stats of the indices: %s", e)
+        return None
+
+    return {name: {"docs": index["primaries"]["docs"]["count"],
+                   "size_in_bytes": index["primaries"]["store"]["size_in_bytes"]}
+            for name, index in stats.get("indices", {}).items()}
+
+
+def build_plan(searches, stats=None):
+    """
+    Build the query plan of a list of searches, joining the repeated ones
+
+    :param searches: searches collected by a PlanningClient
+    :param stats: stats of the indices, as returned by index_stats
+    :returns: a dict with the queries of the plan and the totals
+    """
+
+    queries = {}
+    for search in searches:
+        key = request_key(search["index"], search["body"], search["params"])
+        if key in queries:
+            query = queries[key]
+            query["count"] += 1
+            if search["section"] not in query["sections"]:
+                query["sections"].append(search["section"])
+            continue
+
+        body = search["body"]
+        aggs = body.get("aggs", body.get("aggregations", {}))
+        date_ranges = get_date_ranges(body.get("query", {}))
+        queries[key] = {
+            "index": search["index"],
+            "sections": [search["section"]],
+            "count": 1,
+            "aggregations": describe_aggs(aggs) if aggs else None,
+            "date_ranges": date_ranges,
+            "size": body.get("size"),
+            "buckets": estimate_buckets(aggs, date_ranges) if aggs else 0,
+            "body": body
+        }
+
+    queries = list(queries.values())
+    buckets = [query["buckets"] * query["count"] for query in queries if query["buckets"] is not None]
+    return {
+        "requests": len(searches),
+        "unique_queries": len(queries),
+        "buckets": sum(buckets),
+        "queries_without_estimate": len(queries) - len(buckets),
+        "indices": stats,
+        "queries": queries
+    }
+
+
+def plan_summary(plan, top=SUMMARY_TOP):
+    """
+    Build a summary of a query plan with the queries with more buckets
+
+    :param plan: dict with the query plan
+    :param top: number of queries to be included
+    :returns: a string with the summary
+    """
+
+    lines = ["Dry run: %i requests, %i unique queries, %i buckets estimated" %
+             (plan["requests"], plan["unique_queries"], plan["buckets"])]
+    if plan["queries_without_estimate"]:
+        lines.append("  %i queries without bucket estimate" % plan["queries_without_estimate"])
+    for name, index in sorted((plan["indices"] or {}).items()):
+        lines.append("  index %s: %i docs, %.1fMB" % (name, index["docs"], index["size_in_bytes"] / 2 ** 20))
+
+    queries = sorted(plan["queries"], key=lambda query: query["buckets"] or 0, reverse=True)
+    lines.append("Queries with more buckets:")
+    for query in queries[:top]:
+        lines.append("  %6s buckets x%-3i %s [%s] %s" %
+                     (query["buckets"], query["count"], query["index"],
+                      ", ".join(str(section) for section in query["sections"]), query["aggregations"]))
+    return "\n".join(lines)
+
+
+def plan_report(report, planner, filename=None, stats=None):
+    """
+    Build the query plan of a report, generating its data in a temporary
+    directory with the searches answered by the planner
+
+    :param report: manuscripts or manuscripts2 Report, created once plan_searches was called
+    :param planner: PlanningClient returned by plan_searches
+    :param filename: JSON file in which to write the plan, if any
+    :param stats: stats of the indices of the report, as returned by index_stats
+    :returns: a dict with the query plan
+    """
+
+    data_dir = report.data_dir
+    with tempfile.TemporaryDirectory(prefix="manuscripts_plan_") as tmp_dir:
+        report.data_dir = tmp_dir
+        try:
+            report.create_data_figs()
+        finally:
+            report.data_dir = data_dir
+
+    if getattr(report, "projects", False):
+        logger.warning("The searches of each project are not in the plan, they are the ones "
+                       "of the general project with a filter on the project")
+
+    plan = build_plan(planner.searches, stats)
+    if filename:
+        with open(filename, "w") as f:
+            json.dump(plan, f, indent=4, sort_keys=True, default=str)
+        logger.info("Query plan written to %s", filename)
+    return plan
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Number of entries shown by default in the summary of a run
+SUMMARY_TOP = 10
+
+
+def count_buckets(data):
+    """
+    Count the buckets included in the aggregations of an Elasticsearch response
+
+    :param data: aggregations dict (or any part of it) from an Elasticsearch response
+    :return: the total number of buckets, including the ones in nested aggregations
+    """
+
+    count = 0
+    if isinstance(data, dict):
+        buckets = data.get('buckets')
+        if isinstance(buckets, list):
+            count += len(buckets)
+        elif isinstance(buckets, dict):
+            count += len(buckets)
+            buckets = list(buckets.values())
+        for key, value in data.items():
+            if key == 'buckets':
+                value = buckets
+            count += count_buckets(value)
+    elif isinstance(data, list):
+        for item in data:
+            count += count_buckets(item)
+    return count
+
+
+def flatten_aggregations(aggs, parent=None):
+    """
+    Flatten the tree of aggregation timings of a shard from the ES Profile API
+
+    :param aggs: list of aggregations from the profile of a shard
+    :param parent: description of the parent aggregation
+    :return: a list of dicts with the type, description, time and breakdown of each aggregation
+    """
+
+    flat = []
+    for agg in aggs:
+        description = agg.get('description')
+        if parent:
+            description = parent + ">" + description
+        flat.append({
+            "type": agg.get('type'),
+            "description": description,
+            "time_in_nanos": agg.get('time_in_nanos', 0),
+            "breakdown": agg.get('breakdown', {})
+        })
+        flat.extend(flatten_aggregations(agg.get('children', []), description))
+    return flat
+
+
+def parse_es_profile(profile):
+    """
+    Extract the per shard timings from the "profile" section of an ES response
+
+    :param profile: dict with the profile section of the response
+    :return: a list with the query, collector and aggregation timings of each shard
+    """
+
+    shards = []
+    for shard in profile.get('shards', []):
+        query_time = 0
+        collectors = []
+        for search in shard.get('searches', []):
+            query_time += sum(q.get('time_in_nanos', 0) for q in search.get('query', []))
+            collectors.extend({"name": c.get('name'),
+                               "reason": c.get('reason'),
+                               "time_in_nanos": c.get('time_in_nanos', 0)}
+                              for c in search.get('collector', []))
+        shards.append({
+            "id": shard.get('id'),
+            "query_time_in_nanos": query_time,
+            "collectors": collectors,
+            "aggregations": flatten_aggregations(shard.get('aggregations', []))
+        })
+    return shards
+
+
+class Profiler():
+    """Collect the timings of a report run: the queries sent to Elasticsearch
+    and the stages (CSV, figure and PDF generation) of the report.
+
+    The profiler is disabled by default, so nothing is collected unless
+    `enabled` is set. Entries are grouped by the report section active when
+    they are recorded. The section is kept in a context variable, so the
+    threads and the asyncio tasks computing the metrics of different
+    sections at the same time record them in their own section.
+
+    Queries can also be profiled by Elasticsearch itself setting `es_profile`
+    to the list of metric ids to be profiled (an empty list for all of them).
+    These queries are sent again with the Profile API enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.es_profile = None
+        self._section = contextvars.ContextVar("profiler_section", default=None)
+        self.queries = []
+        self.stages = []
+        self.es_profiles = []
+        self.request_cache = None
+        self.throttle = []
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Remove all the entries collected"""
+
+        with self._lock:
+            self.queries = []
+            self.stages = []
+            self.es_profiles = []
+            self.request_cache = None
+            self.throttle = []
+
+    @property
+    def section(self):
+        """Report section active in the current thread or asyncio task"""
+
+        return self._section.get()
+
+    @contextmanager
+    def in_section(self, section):
+        """Record the entries collected in the block as part of `section`"""
+
+        token = self._section.set(section)
+        try:
+            yield
+        finally:
+            self._section.reset(token)
+
+    def record_query(self, metric, data_source, wall_time, response):
+        """
+        Record a query sent to Elasticsearch
+
+        :param metric: name of the metric the query is for
+        :param data_source: data source (or index) queried
+        :param wall_time: seconds spent waiting for the response
+        :param response: dict with the Elasticsearch response
+        """
+
+        if not self.enabled:
+            return
+
+        entry = {
+            "metric": metric,
+            "data_source": data_source,
+            "section": self.section,
+            "wall_time": wall_time,
+            "took": response.get('took'),
+            "response_bytes": len(json.dumps(response, default=str)),
+            "buckets": count_buckets(response.get('aggregations', {}))
+        }
+        with self._lock:
+            self.queries.append(entry)
+
+    def wants_es_profile(self, metric):
+        """Check whether the queries of a metric must be profiled by Elasticsearch"""
+
+        if self.es_profile is None:
+            return False
+        return not self.es_profile or metric in self.es_profile
+
+    def profile_search(self, search, metric, data_source):
+        """
+        Send again a search with the ES Profile API enabled and record the
+        timings of its shards. Errors are logged but not raised, so profiling
+        does not break the report.
+
+        :param search: elasticsearch_dsl Search object already executed
+        :param metric: name of the metric the query is for
+        :param data_source: data source (or index) queried
+        """
+
+        if not self.wants_es_profile(metric):
+            return
+
+        try:
+            response = search.extra(profile=True).execute().to_dict()
+        except Exception as e:
+            logger.warning("Can not profile the query for %s: %s", metric, e)
+            return
+        self.record_es_profile(metric, data_source, response)
+
+    async def aprofile_search(self, es, index, body, metric, data_source, **params):
+        """
+        Async version of profile_search, sending the search with an asyncio client
+
+        :param es: asyncio Elasticsearch client
+        :param index: index searched
+        :param body: body of the search already sent
+        :param metric: name of the metric the query is for
+        :param data_source: data source (or index) queried
+        :param params: params of the search
+        """
+
+        if not self.wants_es_profile(metric):
+            return
+
+        try:
+            response = await es.search(index=index, body=dict(body, profile=True), **params)
+        except Exception as e:
+            logger.warning("Can not profile the query for %s: %s", metric, e)
+            return
+        self.record_es_profile(metric, data_source, response)
+
+    def record_es_profile(self, metric, data_source, response):
+        """
+        Record the timings of the shards of a search profiled by Elasticsearch
+
+        :param metric: name of the metric the query is for
+        :param data_source: data source (or index) queried
+        :param response: dict with the Elasticsearch response of the profiled search
+        """
+
+        entry = {
+            "metric": metric,
+            "data_source": data_source,
+            "section": self.section,
+            "shards": parse_es_profile(response.get('profile', {}))
+        }
+        with self._lock:
+            self.es_profiles.append(entry)
+
+    def top_aggregations(self, top=SUMMARY_TOP):
+        """
+        Get the most expensive aggregations profiled by Elasticsearch, adding
+        up their time in all the shards and queries of the same metric
+
+        :param top: number of aggregations to be returned
+        :return: a list of dicts sorted by time_in_nanos
+        """
+
+        totals = {}
+        for entry in self.es_profiles:
+            for shard in entry['shards']:
+                for agg in shard['aggregations']:
+                    key = (entry['data_source'], entry['metric'], agg['type'], agg['description'])
+                    totals[key] = totals.get(key, 0) + agg['time_in_nanos']
+
+        aggs = [{"data_source": key[0], "metric": key[1], "type": key[2],
+                 "description": key[3], "time_in_nanos": nanos}
+                for key, nanos in totals.items()]
+        aggs.sort(key=lambda agg: agg['time_in_nanos'], reverse=True)
+        return aggs[:top]
+
+    def dump_es_profiles(self, dir_name):
+        """
+        Write the ES profile of each query in its own JSON file
+
+        :param dir_name: directory in which to write the files
+        :return: list with the files written
+        """
+
+        os.makedirs(dir_name, exist_ok=True)
+        files = []
+        for i, entry in enumerate(self.es_profiles):
+            file_name = "%03i_%s_%s.json" % (i, entry['data_source'], entry['metric'])
+            file_name = os.path.join(dir_name, file_name.replace(os.sep, "_"))
+            with open(file_name, "w") as f:
+                json.dump(entry, f, indent=4, sort_keys=True)
+            files.append(file_name)
+
+        logger.info("%i ES query profiles written to %s", len(files), dir_name)
+        return files
+
+    def es_profile_summary(self, top=SUMMARY_TOP):
+        """
+        Build a summary with the most expensive aggregations profiled by Elasticsearch
+
+        :param top: number of aggregations to be included
+        :return: a string with the summary
+        """
+
+        aggs = self.top_aggregations(top)
+        lines = ["ES profiled queries: %i. Most expensive aggregations:" % len(self.es_profiles)]
+        for agg in aggs:
+            lines.append("  %9.3fms %-20s %s/%s %s" %
+                         (agg['time_in_nanos'] / 1e6, agg['type'], agg['data_source'],
+                          agg['metric'], agg['description']))
+        return "\n".join(lines)
+
+    def record_stage(self, stage, name, wall_time):
+        """
+        Record a stage of the report generation
+
+        :param stage: kind of stage: csv, figure, pdf
+        :param name: name of the item generated, usually a file name
+        :param wall_time: seconds spent in the stage
+        """
+
+        if not self.enabled:
+            return
+
+        entry = {
+            "stage": stage,
+            "name": name,
+            "section": self.section,
+            "wall_time": wall_time
+        }
+        with self._lock:
+            self.stages.append(entry)
+
+    @contextmanager
+    def stage(self, stage, name):
+        """Record the time spent in the block as a stage of the report"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, name, time.perf_counter() - start)
+
+    def record_request_cache(self, before, after):
+        """
+        Record the use of the shard request cache of Elasticsearch in the run
+
+        :param before: dict with the hit_count and miss_count of the cache at the start of the run
+        :param after: dict with the hit_count and miss_count of the cache at the end of the run
+        :return: a dict with the hits, misses and hit ratio of the run
+        """
+
+        hits = after['hit_count'] - before['hit_count']
+        misses = after['miss_count'] - before['miss_count']
+        self.request_cache = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None
+        }
+        return self.request_cache
+
+    def record_throttle(self, event, **details):
+        """
+        Record a decision of the throttle of the searches
+
+        :param event: kind of decision: limit_decreased, retry, breaker_open, breaker_closed
+        :param details: values of the decision, like the new limit or the seconds waited
+        """
+
+        if not self.enabled:
+            return
+
+        entry = dict(details, event=event, section=self.section, time=time.time())
+        with self._lock:
+            self.throttle.append(entry)
+
+    def to_dict(self):
+        """Return the collected entries and their totals per section"""
+
+        sections = {}
+        for entry in self.queries + self.stages:
+            totals = sections.setdefault(str(entry['section']),
+                                         {"queries": 0, "query_time": 0, "stage_time": 0})
+            if 'metric' in entry:
+                totals['queries'] += 1
+                totals['query_time'] += entry['wall_time']
+            else:
+                totals['stage_time'] += entry['wall_time']
+
+        return {
+            "queries": self.queries,
+            "stages": self.stages,
+            "es_profiles": self.es_profiles,
+            "request_cache": self.request_cache,
+            "throttle": self.throttle,
+            "sections": sections
+        }
+
+    def dump(self, filename):
+        """
+        Write the profile of the run in a JSON file
+
+        :param filename: path of the JSON file
+        """
+
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+        logger.info("Profile written to %s", filename)
+
+    def summary(self, top=SUMMARY_TOP):
+        """
+        Build a summary of the run with the slowest queries and stages
+
+        :param top: number of queries and stages to be included
+        :return: a string with the summary
+        """
+
+        lines = []
+        queries = sorted(self.queries, key=lambda e: e['wall_time'], reverse=True)
+        total = sum(e['wall_time'] for e in self.queries)
+        lines.append("Queries: %i in %.2fs. Slowest %i:" % (len(queries), total, min(top, len(queries))))
+        for e in queries[:top]:
+            lines.append("  %7.3fs took=%sms %8iB %5i buckets  %s/%s [%s]" %
+                         (e['wall_time'], e['took'], e['response_bytes'], e['buckets'],
+                          e['data_source'], e['metric'], e['section']))
+
+        stages = sorted(self.stages, key=lambda e: e['wall_time'], reverse=True)
+        total = sum(e['wall_time'] for e in self.stages)
+        lines.append("Stages: %i in %.2fs. Slowest %i:" % (len(stages), total, min(top, len(stages))))
+        for e in stages[:top]:
+            lines.append("  %7.3fs %-6s %s [%s]" % (e['wall_time'], e['stage'], e['name'], e['section']))
+
+        if self.request_cache:
+            cache = self.request_cache
+            ratio = "-" if cache['hit_ratio'] is None else "%.1f%%" % (cache['hit_ratio'] * 100)
+            lines.append("ES request cache: %i hits, %i misses (hit ratio %s)" %
+                         (cache['hits'], cache['misses'], ratio))
+
+        if self.throttle:
+            events = [e['event'] for e in self.throttle]
+            paused = sum(e['paused'] for e in self.throttle if e['event'] == 'breaker_closed')
+            lines.append("Throttle: %i limit decreases, %i retries, circuit breaker opened %i times "
+                         "(%.1fs paused)" % (events.count('limit_decreased'), events.count('retry'),
+                                             events.count('breaker_open'), paused))
+
+        return "\n".join(lines)
+
+
+# Profiler shared by all the reports generated in the run
+profiler = Profiler()
@@ -21,21 +21,12 @@
 
 import logging
 import os
-import subprocess
 import sys
 import glob
 
-import matplotlib as mpl
-# This avoids the use of the $DISPLAY value for the charts
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-import prettyplotlib as ppl
-import numpy as np
-
 from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from distutils.dir_util import copy_tree
-from distutils.file_util import copy_file
 
 from dateutil import parser, relativedelta
 
@@ -48,10 +39,33 @@ from .metrics import gerrit
 from .metrics import stackexchange
 
 from .metrics.metrics import Metrics
+from .clients import es_client
+from .csv_writer import CSVWriter, format_value, write_csv
+from .latex import build_pdf
+from .manifest import IndexChanges
+from .profiler import profiler
 
 logger = logging.getLogger(__name__)
 
 
+def get_plot_modules():
+    """
+    Import the modules used to create the charts. They take a long time to load,
+    so they are not imported until the first chart of a report is created.
+
+    :return: a tuple with the matplotlib.pyplot, prettyplotlib and numpy modules
+    """
+
+    import matplotlib as mpl
+    # This avoids the use of the $DISPLAY value for the charts
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    import prettyplotlib as ppl
+    import numpy as np
+
+    return plt, ppl, np
+
+
 class Report():
     """ Class which represents a Manuscripts report """
 
@@ -99,7 +113,9 @@ class Report():
 
     def __init__(self, es_url, start, end, data_dir=None, filters=None,
                  interval="month", offset=None, data_sources=None,
-                 report_name=None, projects=False, indices=[], logo=None):
+                 report_name=None, projects=False, indices=[], logo=None,
+                 latex_timeout=None, project_reports=False, workers=None,
+                 merge_projects=False, manifest=None):
         """
         Report init method called when creating a new Report object
 
@@ -115,6 +131,12 @@ class Report():
         :param projects: generate a specific report for each project
         :param indices: list of data source indices in Elasticsearch to be used to get the metrics values
         :param logo: logo to be used in the report (in the title and headers of the pages)
+        :param latex_timeout: max number of seconds for each pdflatex pass (default: no limit)
+        :param project_reports: create a standalone PDF report for each project
+        :param workers: max number of project reports compiled in parallel (default: number of CPUs)
+        :param merge_projects: merge all the project reports in a single PDF file
+        :param manifest: file with the state of the indices in the last run, to skip
+                         the report if none of them changed since then
         """
 
         if not (es_url and start and end and data_sources):
@@ -127,14 +149,15 @@ class Report():
         self.end = end
         self.data_dir = data_dir
         self.logo = logo
+        self.latex_timeout = latex_timeout
         self.filters = filters  # Report filters for all metrics in the report
-        if self.filters:
-            # Use the filters as core filters for all the metrics in the report
-            Metrics.filters_core = self.filters
+        # Use the filters as core filters for all the metrics in the report. They
+        # are always set, so a report does not get the ones of the previous report
+        # created in the same process (as in the workers of a batch)
+        Metrics.filters_core = self.filters or {}
         self.offset = offset
-        if self.offset:
-            # Offset to be used in all the metrics in the report
-            Metrics.offset = self.offset
+        # Offset to be used in all the metrics in the report
+        Metrics.offset = self.offset
         self.interval = interval
         if self.interval:
             # Interval to be used in all the metrics in the report
@@ -185,7 +208,12 @@ class Report():
         # End temporal hack
         self.config = self.__get_config(self.data_sources)
         self.report_name = report_name
-        self.projects = projects
+        self.projects = projects or project_reports
+        self.project_reports = project_reports
+        self.project_names = []  # names of the projects with per project data
+        self.workers = workers if workers else os.cpu_count()
+        self.merge_projects = merge_projects
+        self.manifest = manifest
 
     def __get_config(self, data_sources=None):
         """
@@ -258,6 +286,7 @@ class Report():
         """
 
         colors = ["orange", "grey"]
+        plt, ppl, np = get_plot_modules()
 
         data1 = self.__convert_none_to_zero(data1)
         data2 = self.__convert_none_to_zero(data2)
@@ -294,6 +323,7 @@ class Report():
         """
 
         colors = ["orange", "grey"]
+        plt, ppl, np = get_plot_modules()
 
         data1 = self.__convert_none_to_zero(data1)
         data2 = self.__convert_none_to_zero(data2)
@@ -347,22 +377,15 @@ class Report():
 
         logger.debug("CSV file %s generation in progress", file_name)
 
-        csv = 'metricsnames,netvalues,relativevalues,datasource\n'
-        for metric in metrics:
-            # comparing current metric month count with previous month
-            es_index = self.get_metric_index(metric)
-            ds = metric.ds.name
-            m = metric(self.es_url, es_index, start=self.start, end=self.end)
-            (last, percentage) = m.get_trend()
-            csv += "%s,%i,%i,%s" % (metric.name, last, percentage, ds)
-            csv += "\n"
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "w") as f:
-            # Hack, we need to fix LaTeX escaping in a central place
-            csv = csv.replace("_", r"\_")
-            f.write(csv)
-
-        logger.debug("CSV file: %s was generated", file_name)
+        header = ['metricsnames', 'netvalues', 'relativevalues', 'datasource']
+        with CSVWriter(file_name, header) as writer:
+            for metric in metrics:
+                # comparing current metric month count with previous month
+                es_index = self.get_metric_index(metric)
+                ds = metric.ds.name
+                m = metric(self.es_url, es_index, start=self.start, end=self.end)
+                (last, percentage) = m.get_trend()
+                writer.writerow([metric.name, "%i" % last, "%i" % percentage, ds])
 
         """
         Git Authors:
@@ -384,35 +407,22 @@ class Report():
         bmi = []
         ttc = []  # time to close
 
-        csv_labels = ''
+        csv_labels = []
         for m in self.config['overview']['bmi_metrics']:
             metric = m(self.es_url, self.get_metric_index(m),
                        start=self.end_prev_month, end=self.end)
-            csv_labels += m.id + ","
+            csv_labels.append(m.id)
             bmi.append(metric.get_agg())
 
         for m in self.config['overview']['time_to_close_metrics']:
             metric = m(self.es_url, self.get_metric_index(m),
                        start=self.end_prev_month, end=self.end)
-            csv_labels += m.id + ","
+            csv_labels.append(m.id)
             ttc.append(metric.get_agg())
 
-        csv = csv_labels[:-1] + "\n"  # remove last comma
-        csv = csv.replace("_", "")
-        for val in bmi:
-            csv += "%s," % (self.str_val(val))
-        for val in ttc:
-            csv += "%s," % (self.str_val(val))
-        if csv[-1] == ',':
-            csv = csv[:-1]
-
         data_path = os.path.join(self.data_dir, "data")
         file_name = os.path.join(data_path, 'efficiency.csv')
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "w") as f:
-            f.write(csv)
-
-        logger.debug("CSV file: %s was generated", file_name)
+        write_csv(file_name, csv_labels, [bmi + ttc])
 
     def sec_com_channels(self):
         """
@@ -437,14 +447,7 @@ class Report():
         :return: a string with the formatted value
         """
 
-        str_val = val
-        if val is None:
-            str_val = "NA"
-        elif type(val) == float:
-            str_val = '%0.2f' % val
-        else:
-            str_val = str(val)
-        return str_val
+        return format_value(val)
 
     def __create_csv_eps(self, metric1, metric2, csv_labels, file_label,
                          title_label, project=None):
@@ -462,7 +465,6 @@ class Report():
         logger.debug("CSV file %s generation in progress", file_label)
 
         esfilters = None
-        csv_labels = csv_labels.replace("_", "")  # LaTeX not supports
 
         if project and project != self.GLOBAL_PROJECT:
             esfilters = {"project": project}
@@ -477,18 +479,6 @@ class Report():
                          start=self.start, end=self.end)
             m2_ts = m2.get_ts()
 
-        csv = csv_labels + '\n'
-        for i in range(0, len(m1_ts['date'])):
-            if self.interval == 'quarter':
-                date_str = self.build_period_name(parser.parse(m1_ts['date'][i]), start_date=True)
-            else:
-                date_str = parser.parse(m1_ts['date'][i]).strftime("%y-%m")
-            csv += date_str
-            csv += "," + self.str_val(m1_ts['value'][i])
-            if metric2:
-                csv += "," + self.str_val(m2_ts['value'][i])
-            csv += "\n"
-
         data_path = os.path.join(self.data_dir, "data")
 
         if project:
@@ -496,9 +486,16 @@ class Report():
         else:
             file_name = os.path.join(data_path, file_label + ".csv")
 
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "w") as f:
-            f.write(csv)
+        with CSVWriter(file_name, csv_labels.split(",")) as writer:
+            for i in range(0, len(m1_ts['date'])):
+                if self.interval == 'quarter':
+                    date_str = self.build_period_name(parser.parse(m1_ts['date'][i]), start_date=True)
+                else:
+                    date_str = parser.parse(m1_ts['date'][i]).strftime("%y-%m")
+                row = [date_str, m1_ts['value'][i]]
+                if metric2:
+                    row.append(m2_ts['value'][i])
+                writer.writerow(row)
 
         logger.debug("CSV file %s was generated", file_label)
 
@@ -518,13 +515,14 @@ class Report():
             for val in m1_ts['date']:
                 period = self.build_period_name(parser.parse(val), start_date=True)
                 x_val.append(period)
-        if metric2:
-            self.bar_chart(title, x_val, m1_ts['value'],
-                           file_name, m2_ts['value'],
-                           legend=[m1.name, m2.name])
-        else:
-            self.bar_chart(title, x_val, m1_ts['value'], file_name,
-                           legend=[m1.name])
+        with profiler.stage("figure", file_name):
+            if metric2:
+                self.bar_chart(title, x_val, m1_ts['value'],
+                               file_name, m2_ts['value'],
+                               legend=[m1.name, m2.name])
+            else:
+                self.bar_chart(title, x_val, m1_ts['value'], file_name,
+                               legend=[m1.name])
 
     def sec_project_activity(self, project=None):
         """
@@ -556,7 +554,6 @@ class Report():
 
         def create_csv(metric1, csv_labels, file_label):
             esfilters = None
-            csv_labels = csv_labels.replace("_", "")  # LaTeX not supports "_"
             if project != self.GLOBAL_PROJECT:
                 esfilters = {"project": project}
 
@@ -569,17 +566,8 @@ class Report():
             m1 = metric1(self.es_url, self.get_metric_index(metric1),
                          esfilters=esfilters, start=self.end_prev_month, end=self.end)
             top = m1.get_list()
-            csv = csv_labels + '\n'
-            for i in range(0, len(top['value'])):
-                if i > self.TOP_MAX:
-                    break
-                csv += top[metric1.FIELD_NAME][i] + "," + self.str_val(top['value'][i])
-                csv += "\n"
-
-            with open(file_name, "w") as f:
-                f.write(csv)
-
-            logger.debug("CSV file %s was generated", file_name)
+            rows = zip(top[metric1.FIELD_NAME], top['value'])
+            write_csv(file_name, csv_labels.split(","), rows, max_rows=self.TOP_MAX + 1)
 
         logger.info("Community data for: %s", project)
 
@@ -728,6 +716,7 @@ class Report():
         for project in projects:
             # The name of the project is used to create files
             project = project.replace("/", "_")
+            self.project_names.append(project)
             self.sec_project_activity(project)
             self.sec_project_community(project)
             self.sec_project_process(project)
@@ -757,7 +746,8 @@ class Report():
 
         for section in self.sections():
             logger.info("Generating %s", section)
-            self.sections()[section]()
+            with profiler.in_section(section):
+                self.sections()[section]()
 
         logger.info("Data and figs done")
 
@@ -832,17 +822,20 @@ class Report():
         for file in glob.iglob(os.path.join(directory, file_type)):
             self.replace_text(file, to_replace, replacement)
 
-    def create_pdf(self):
+    def fill_template(self, report_path, report_name):
         """
-        Create the report pdf file filling the LaTeX templates with the figs and data for the report
+        Create the LaTeX report in a directory from the templates, filling them
+        with the report data
 
+        :param report_path: directory in which to create the LaTeX report
+        :param report_name: name of the report to be used in the title
         :return:
         """
 
-        logger.info("Generating PDF report")
+        from distutils.dir_util import copy_tree
+        from distutils.file_util import copy_file
 
         # First step is to create the report dir from the template
-        report_path = self.data_dir
         templates_path = os.path.join(os.path.dirname(__file__),
                                       "latex_template")
 
@@ -856,7 +849,7 @@ class Report():
             print(copy_file(self.logo, os.path.join(report_path, "logo." + self.logo.split('/')[-1].split('.')[-1])))
 
         # Change the project global name
-        project_replace = self.report_name.replace(' ', r'\ ')
+        project_replace = report_name.replace(' ', r'\ ')
         self.replace_text_dir(report_path, 'PROJECT-NAME', project_replace)
         self.replace_text_dir(os.path.join(report_path, 'overview'), 'PROJECT-NAME', project_replace)
 
@@ -878,10 +871,6 @@ class Report():
         # Change the date Copyright
         self.replace_text_dir(report_path, '(cc) 2016', '(cc) ' + datetime.now().strftime('%Y'))
 
-        # Fix LaTeX special chars
-        self.replace_text_dir(report_path, '&', '\&', 'data/git_top_organizations_*')
-        self.replace_text_dir(report_path, '^#', '', 'data/git_top_organizations_*')
-
         # Activity section
         activity = ''
         for activity_ds in ['git', 'github', 'gerrit', 'mls']:
@@ -922,16 +911,122 @@ class Report():
         with open(os.path.join(report_path, "process.tex"), "w") as flatex:
             flatex.write(process)
 
+    def create_pdf(self):
+        """
+        Create the report pdf file filling the LaTeX templates with the figs and data for the report
+
+        :return:
+        """
+
+        logger.info("Generating PDF report")
+
+        report_path = self.data_dir
+        self.fill_template(report_path, self.report_name)
+
         # Time to generate the pdf report
-        res = subprocess.call("pdflatex report.tex", shell=True, cwd=report_path)
-        if res > 0:
-            logger.error("Error generating PDF")
+        if build_pdf(report_path, timeout=self.latex_timeout) is None:
             return
-        # A second time so the TOC is generated
-        subprocess.call("pdflatex report.tex", shell=True, cwd=report_path)
 
         logger.info("PDF report done %s", report_path + "/report.pdf")
 
+        if self.project_reports:
+            self.create_project_pdfs()
+
+    def __copy_project_data(self, project, report_path):
+        """
+        Copy the data and figs of a project to its own report directory, using
+        the names of the general project data so the LaTeX templates can be reused.
+        Data which is not generated per project (overview) is copied as is.
+
+        :param project: name of the project
+        :param report_path: directory of the project report
+        :return:
+        """
+
+        from distutils.file_util import copy_file
+
+        all_projects = self.project_names + [self.GLOBAL_PROJECT]
+        for subdir in ["data", "figs"]:
+            src_path = os.path.join(self.data_dir, subdir)
+            dst_path = os.path.join(report_path, subdir)
+            os.makedirs(dst_path, exist_ok=True)
+            for file_name in os.listdir(src_path):
+                name, ext = os.path.splitext(file_name)
+                # The longest matching name wins: "git_authors_a_b" is from "a_b", not from "b"
+                matches = [p for p in all_projects if name.endswith("_" + p)]
+                if not matches:
+                    copy_file(os.path.join(src_path, file_name), os.path.join(dst_path, file_name))
+                elif max(matches, key=len) == project:
+                    general_name = name[:-len(project)] + self.GLOBAL_PROJECT + ext
+                    copy_file(os.path.join(src_path, file_name), os.path.join(dst_path, general_name))
+
+    def create_project_pdfs(self):
+        """
+        Create a standalone PDF report for each project. The reports are compiled
+        in parallel using up to self.workers pdflatex processes.
+
+        :return: a list with the paths of the PDF files generated
+        """
+
+        projects_path = os.path.join(self.data_dir, "projects")
+        report_paths = []
+        for project in self.project_names:
+            report_path = os.path.join(projects_path, project)
+            self.__copy_project_data(project, report_path)
+            self.fill_template(report_path, self.report_name + " " + project.replace("_", r"\_"))
+            report_paths.append(report_path)
+
+        logger.info("Generating %i project PDF reports using %i workers",
+                    len(report_paths), self.workers)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(lambda path: build_pdf(path, timeout=self.latex_timeout),
+                                        report_paths))
+
+        pdfs = []
+        for report_path, timings in zip(report_paths, results):
+            if timings is None:
+                logger.error("Error generating PDF report for %s", report_path)
+                continue
+            pdfs.append(os.path.join(report_path, "report.pdf"))
+
+        logger.info("%i project PDF reports done in %s", len(pdfs), projects_path)
+
+        if self.merge_projects and pdfs:
+            # The general report goes first in the merged document
+            general_pdf = os.path.join(self.data_dir, "report.pdf")
+            if os.path.exists(general_pdf):
+                pdfs = [general_pdf] + pdfs
+            self.merge_pdfs(pdfs, projects_path)
+
+        return pdfs
+
+    @staticmethod
+    def merge_pdfs(pdfs, report_path, name="projects"):
+        """
+        Merge several PDF files in a single one using the LaTeX pdfpages package
+
+        :param pdfs: list of PDF files to be merged
+        :param report_path: directory in which to create the merged PDF file
+        :param name: name of the merged file, without extension
+        :return: the path of the merged PDF file, or None if it can not be created
+        """
+
+        tex_file = name + ".tex"
+        with open(os.path.join(report_path, tex_file), "w") as flatex:
+            flatex.write("\\documentclass{article}\n\\usepackage{pdfpages}\n\\begin{document}\n")
+            for pdf in pdfs:
+                pdf = os.path.relpath(pdf, report_path)
+                flatex.write("\\includepdf[pages=-]{" + pdf + "}\n")
+            flatex.write("\\end{document}\n")
+
+        if build_pdf(report_path, tex_file) is None:
+            return None
+
+        merged_pdf = os.path.join(report_path, name + ".pdf")
+        logger.info("Merged PDF report done %s", merged_pdf)
+        return merged_pdf
+
     def create(self):
         """
         Generate the data and figs for the report and fill the LaTeX templates with them
@@ -941,11 +1036,58 @@ class Report():
         """
         logger.info("Generating the report from %s to %s", self.start, self.end)
 
+        changes = None
+        if self.manifest:
+            changes = IndexChanges(self.manifest, es_client(self.es_url), self.get_indices(),
+                                   self.get_params())
+            if not changes.data_sources:
+                logger.info("No index changed since the last report, nothing to generate")
+                return
+
         self.create_data_figs()
         self.create_pdf()
 
+        if changes:
+            changes.save()
+
         logger.info("Report completed")
 
+    def get_indices(self):
+        """
+        Get the Elasticsearch index of each data source of the report
+
+        :return: a dict with the index name of each data source
+        """
+
+        indices = {}
+        for ds in self.data_sources:
+            if self.index_dict[ds]:
+                indices[ds] = self.index_dict[ds]
+            else:
+                indices[ds] = self.ds2index[self.ds2class[ds]]
+        return indices
+
+    def get_params(self):
+        """
+        Get the params which define the contents of the report
+
+        :return: a dict with the params of the report
+        """
+
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "interval": self.interval,
+            "offset": self.offset,
+            "filters": self.filters,
+            "data_sources": sorted(self.data_sources),
+            "report_name": self.report_name,
+            "logo": self.logo,
+            "projects": self.projects,
+            "project_reports": self.project_reports,
+            "merge_projects": self.merge_projects
+        }
+
     @classmethod
     def get_core_filters(cls, filters):
         core_filters = {}
@@ -19,31 +19,98 @@
 #     Pranjal Aswani <aswani.pranjal@gmail.com>
 #
 
+import asyncio
+import contextvars
+import hashlib
+import json
+import time
+
 from dateutil import parser
-from datetime import timezone
+from datetime import datetime, timezone
 from collections import OrderedDict, defaultdict
 
-import pandas as pd
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import A, Q, Search
 
+from manuscripts.clients import async_es_client, es_client
+from manuscripts.profiler import profiler
+
 
 class Index():
     """
     Index class representing an elasticsearch index
     """
 
+    es = None  # client shared by all the indices, set by the report
+
     def __init__(self, index_name, es=None):
         """
         :param index_name: name of the elasticsearch index that is to be queried (required)
         :param es: the client used to connect to elasticsearch (optional)
-                   default connects to elasticsearch running at http://localhost:9200
+                   default uses the client shared by all the indices if it is set or
+                   connects to elasticsearch running at http://localhost:9200
+        """
+
+        self.index_name = index_name
+        if es:
+            self.es = es
+        elif not self.es:
+            self.es = es_client()
+
+
+class AsyncIndex(Index):
+    """
+    Index class representing an elasticsearch index queried with an asyncio client.
+    The metrics on it are computed with their async methods (atimeseries, aaggregations).
+    """
+
+    es = None  # async client shared by all the async indices, set by the report
+
+    def __init__(self, index_name, es=None):
+        """
+        :param index_name: name of the elasticsearch index that is to be queried (required)
+        :param es: the async client used to connect to elasticsearch (optional)
+                   default uses the client shared by all the async indices if it is set or
+                   connects to elasticsearch running at http://localhost:9200
         """
 
         self.index_name = index_name
-        if not es:
-            es = Elasticsearch()
-        self.es = es
+        if es:
+            self.es = es
+        elif not self.es:
+            self.es = async_es_client()
+
+
+# Max number of searches sent at the same time by gather_metrics
+CONCURRENCY = 10
+
+# Semaphore limiting the async searches of the metrics computed by gather_metrics
+_search_slots = contextvars.ContextVar("search_slots", default=None)
+
+
+async def gather_metrics(calls, concurrency=CONCURRENCY):
+    """
+    Compute many metrics at the same time, limiting the queries sent at once.
+    The limit is on the searches, so the metrics sending several searches at
+    the same time (eg, BMI) share it with the rest.
+
+    :param calls: list of coroutines of the async metric methods
+                  (eg, metric.atimeseries(dataframe=True))
+    :param concurrency: max number of searches sent at the same time
+    :returns: a list with the result of each coroutine, in the same order
+    """
+
+    # The tasks of the coroutines, and the ones they create, get the semaphore
+    token = _search_slots.set(asyncio.Semaphore(concurrency))
+    try:
+        return await asyncio.gather(*calls)
+    finally:
+        _search_slots.reset(token)
+
+
+# Name of the sampler aggregation of the queries in preview mode, and seed
+# of the random scores used to sample the items
+SAMPLE_AGG = "sample"
+SAMPLE_SEED = 42
 
 
 class Query():
@@ -56,6 +123,8 @@ class Query():
     end_date = None
     interval_ = "month"
     offset_ = None
+    name = None  # name of the metric computed by the query, used in the run profile
+    sample_size = None  # items sampled per shard in preview mode, None for exact results
 
     def __init__(self, index, esfilters={}, interval=None, offset=None):
         """
@@ -79,6 +148,7 @@ class Query():
             self.interval_ = interval
         if offset:
             self.offset_ = offset
+        self.approximate = False  # whether the last results were estimated from a sample
 
     def add_query(self, key_val={}):
         """
@@ -440,25 +510,149 @@ class Query():
 
         self.aggregations = OrderedDict()
 
-    def fetch_aggregation_results(self):
+    def normalize(self):
         """
-        Loops though the self.aggregations dict and adds them to the Search object
-        in order in which they were created. Queries elasticsearch and returns a dict
-        containing the results
+        Rewrite the query of the Search object in its canonical form (see normalize_query),
+        so the queries with the same filters are sent in the same way
 
-        :returns: a dictionary containing the response from elasticsearch
+        :returns: self, which allows the method to be chainable with the other methods
+        """
+
+        query = self.search.to_dict().get("query")
+        if query:
+            self.search.update_from_dict({"query": normalize_query(query)})
+        return self
+
+    def fingerprint(self):
+        """
+        Get a hash of the search sent by fetch_aggregation_results, equal for the
+        queries with the same filters and aggregations whatever the order and the
+        number of times the filters were added
+
+        :returns: a hex string with the hash
+        """
+
+        self.normalize()
+        body = self.search.to_dict()
+        body["aggs"] = {str(pos): agg.to_dict() for pos, agg in enumerate(self.aggregations.values())}
+        body["size"] = 0
+        key = {"index": self.index.index_name, "body": body, "params": self.search._params,
+               "sample_size": self.sample_size}
+        return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def preview(self, sample_size):
+        """
+        Compute the aggregations of the query from a random sample of the items,
+        which is much faster in big indices. The counts and sums are scaled to
+        the total number of items, and the results are marked as approximate.
+
+        :param sample_size: number of items sampled in each shard, None for exact results
+        :returns: self, which allows the method to be chainable with the other methods
+        """
+
+        self.sample_size = sample_size
+        return self
+
+    def add_aggregations(self):
+        """
+        Loops though the self.aggregations dict and adds them to the Search object
+        in order in which they were created. In preview mode they are added inside
+        a sampler aggregation.
         """
 
+        self.normalize()
         self.reset_aggregations()
 
+        aggs = self.search.aggs
+        if self.sample_size and self.aggregations:
+            aggs = aggs.bucket(SAMPLE_AGG, "sampler", shard_size=self.sample_size)
         for key, val in self.aggregations.items():
-            self.search.aggs.bucket(self.parent_agg_counter, val)
+            aggs.bucket(self.parent_agg_counter, val)
             self.parent_agg_counter += 1
 
         self.search = self.search.extra(size=0)
-        response = self.search.execute()
+
+    def get_search(self):
+        """
+        Get the Search object to be sent to elasticsearch. In preview mode, the
+        items get random scores, so the sampler aggregation takes random items.
+
+        :returns: an elasticsearch_dsl Search object
+        """
+
+        if not (self.sample_size and self.aggregations):
+            return self.search
+        random_score = Q("function_score", random_score={"seed": SAMPLE_SEED, "field": "_seq_no"})
+        return self.search.query(random_score).extra(track_total_hits=True)
+
+    def parse_sample(self, response):
+        """
+        Get the aggregations computed in a sample as if they were computed
+        with all the items, scaling the counts to the total number of items
+
+        :param response: dictionary containing the response from elasticsearch
+        :returns: the response, with the scaled aggregations in place of the sampler one
+        """
+
+        self.approximate = False
+        sample = response.get('aggregations', {}).pop(SAMPLE_AGG, None)
+        if sample is None:
+            return response
+
+        total = response['hits']['total']
+        if isinstance(total, dict):
+            total = total['value']
+        sampled = sample.pop('doc_count')
+        factor = total / sampled if sampled else 1
+        definitions = self.search.to_dict()['aggs'][SAMPLE_AGG].get('aggs', {})
+        response['aggregations'] = scale_aggregations(sample, definitions, factor, sampled)
+        self.approximate = factor > 1
+        return response
+
+    def fetch_aggregation_results(self):
+        """
+        Adds the aggregations to the Search object, queries elasticsearch
+        and returns a dict containing the results
+
+        :returns: a dictionary containing the response from elasticsearch
+        """
+
+        self.add_aggregations()
+        search = self.get_search()
+        start = time.perf_counter()
+        response = search.execute().to_dict()
+        name = self.name or ",".join(self.aggregations)
+        profiler.record_query(name, self.index.index_name, time.perf_counter() - start, response)
+        profiler.profile_search(search, name, self.index.index_name)
+        self.flush_aggregations()
+        return self.parse_sample(response)
+
+    async def afetch_aggregation_results(self):
+        """
+        Async version of fetch_aggregation_results, for queries on an AsyncIndex
+
+        :returns: a dictionary containing the response from elasticsearch
+        """
+
+        self.add_aggregations()
+        search = self.get_search()
+        body = search.to_dict()
+        name = self.name or ",".join(self.aggregations)
+        slots = _search_slots.get()
+        if slots:
+            await slots.acquire()
+        try:
+            start = time.perf_counter()
+            response = await self.index.es.search(index=self.index.index_name, body=body,
+                                                  **search._params)
+            profiler.record_query(name, self.index.index_name, time.perf_counter() - start, response)
+            await profiler.aprofile_search(self.index.es, self.index.index_name, body, name,
+                                           self.index.index_name, **search._params)
+        finally:
+            if slots:
+                slots.release()
         self.flush_aggregations()
-        return response.to_dict()
+        return self.parse_sample(response)
 
     def fetch_results_from_source(self, *fields, dataframe=False):
         """
@@ -474,6 +668,7 @@ class Query():
         if not fields:
             raise AttributeError("Please provide the fields to get from elasticsearch!")
 
+        self.normalize()
         self.reset_aggregations()
 
         self.search = self.search.extra(_source=fields)
@@ -483,6 +678,7 @@ class Query():
         data = [item["_source"] for item in hits]
 
         if dataframe:
+            import pandas as pd
             df = pd.DataFrame.from_records(data)
             return df.fillna(0)
         return data
@@ -500,6 +696,23 @@ class Query():
         """
 
         res = self.fetch_aggregation_results()
+        return self.parse_timeseries(res, child_agg_count, dataframe)
+
+    async def aget_timeseries(self, child_agg_count=0, dataframe=False):
+        """Async version of get_timeseries, for queries on an AsyncIndex"""
+
+        res = await self.afetch_aggregation_results()
+        return self.parse_timeseries(res, child_agg_count, dataframe)
+
+    def parse_timeseries(self, res, child_agg_count=0, dataframe=False):
+        """
+        Get the time series from the response of the query
+
+        :param res: dictionary containing the response from elasticsearch
+        :param child_agg_count: the child aggregation count to be used
+        :param dataframe: if dataframe=True, return a pandas.DataFrame object
+        :returns: dictionary containing "date", "value" and "unixtime" keys
+        """
 
         ts = {"date": [], "value": [], "unixtime": []}
 
@@ -525,8 +738,11 @@ class Query():
             ts['unixtime'].append(bucket['key'] / 1000)
 
         if dataframe:
+            import pandas as pd
             df = pd.DataFrame.from_records(ts, index="date")
-            return df.fillna(0)
+            df = df.fillna(0)
+            df.attrs["approximate"] = self.approximate
+            return df
         return ts
 
     def get_aggs(self):
@@ -537,6 +753,22 @@ class Query():
         """
 
         res = self.fetch_aggregation_results()
+        return self.parse_aggs(res)
+
+    async def aget_aggs(self):
+        """Async version of get_aggs, for queries on an AsyncIndex"""
+
+        res = await self.afetch_aggregation_results()
+        return self.parse_aggs(res)
+
+    def parse_aggs(self, res):
+        """
+        Get the single aggregation value from the response of the query
+
+        :param res: dictionary containing the response from elasticsearch
+        :returns: the single aggregation value
+        """
+
         if 'aggregations' in res and 'values' in res['aggregations'][str(self.parent_agg_counter - 1)]:
             try:
                 agg = res['aggregations'][str(self.parent_agg_counter - 1)]['values']["50.0"]
@@ -562,6 +794,23 @@ class Query():
         """
 
         res = self.fetch_aggregation_results()
+        return self.parse_list(res, dataframe)
+
+    async def aget_list(self, dataframe=False):
+        """Async version of get_list, for queries on an AsyncIndex"""
+
+        res = await self.afetch_aggregation_results()
+        return self.parse_list(res, dataframe)
+
+    def parse_list(self, res, dataframe=False):
+        """
+        Get the keys and values of a multi-valued aggregation from the response of the query
+
+        :param res: dictionary containing the response from elasticsearch
+        :param dataframe: if dataframe=True, return a pandas.DataFrame object
+        :returns: a dict containing 'keys' and their corresponding 'values'
+        """
+
         keys = []
         values = []
         for bucket in res['aggregations'][str(self.parent_agg_counter - 1)]['buckets']:
@@ -570,6 +819,7 @@ class Query():
 
         result = {"keys": keys, "values": values}
         if dataframe:
+            import pandas as pd
             result = pd.DataFrame.from_records(result)
         return result
 
@@ -587,6 +837,137 @@ class Issues(Query):
         super().add_query({"pull_request": "false"})
 
 
+# Bounds of the ranges which are intersected by normalize_query
+RANGE_BOUNDS = {"gte": max, "lte": min}
+
+
+def _range_value(value):
+    """
+    Get a range bound comparable with the rest of bounds of its field
+
+    :param value: bound of a range
+    :returns: the number, the date (in UTC if it has no time zone), or None
+              if it can not be compared, like date math
+    """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        date = parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not date.tzinfo:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def normalize_query(query):
+    """
+    Get the canonical form of a query: the range filters on the same field
+    of its bool queries are collapsed to their intersection (the latest start
+    and the earliest end), and the clauses of each kind are sorted. Both
+    forms match the same items, as all the filters of a bool query must match.
+
+    Ranges with other params than gte and lte, and the ones of the fields
+    with bounds which can not be compared, like date math or numbers and
+    dates, are kept as they are.
+
+    :param query: dict with the query of a search
+    :returns: a dict with the normalized query
+    """
+
+    if "bool" not in query:
+        return query
+
+    normalized = {}
+    for kind, clauses in query["bool"].items():
+        if not isinstance(clauses, list):
+            if isinstance(clauses, dict):
+                clauses = [clauses]
+            else:
+                normalized[kind] = clauses  # eg, minimum_should_match
+                continue
+        clauses = [normalize_query(clause) for clause in clauses]
+
+        if kind == "filter":
+            ranges = OrderedDict()
+            others = []
+            for clause in clauses:
+                fields = clause.get("range", {})
+                if len(clause) == 1 and len(fields) == 1:
+                    field, bounds = list(fields.items())[0]
+                    if bounds and set(bounds) <= set(RANGE_BOUNDS):
+                        ranges.setdefault(field, []).append(bounds)
+                        continue
+                others.append(clause)
+
+            clauses = others
+            for field, field_ranges in ranges.items():
+                values = [_range_value(value) for rng in field_ranges for value in rng.values()]
+                if None in values or len({isinstance(value, datetime) for value in values}) > 1:
+                    clauses.extend({"range": {field: rng}} for rng in field_ranges)
+                    continue
+                bounds = {}
+                for op, pick in RANGE_BOUNDS.items():
+                    values = [rng[op] for rng in field_ranges if op in rng]
+                    if values:
+                        bounds[op] = pick(values, key=_range_value)
+                clauses.append({"range": {field: bounds}})
+
+        normalized[kind] = sorted(clauses, key=lambda clause: json.dumps(clause, sort_keys=True))
+
+    return {"bool": normalized}
+
+
+# Aggregations whose values are scaled in preview mode, and their fields scaled
+SCALED_VALUES = {
+    "sum": ["value"],
+    "value_count": ["value"],
+    "stats": ["count", "sum"],
+    "extended_stats": ["count", "sum"],
+    "terms": ["sum_other_doc_count"]
+}
+
+
+def scale_aggregations(aggs, definitions, factor, doc_count):
+    """
+    Scale the counts of aggregations computed in a sample of the items: the
+    number of items of the buckets, and the sums and counts of the metric
+    aggregations. Cardinalities are only scaled when all the items of the
+    sample had different values (eg, the number of commits), as the number
+    of distinct values does not grow with the number of items otherwise
+    (eg, the number of authors). Averages, percentiles, min and max are not
+    changed.
+
+    :param aggs: dict with the aggregations of the response
+    :param definitions: dict with the definitions of the aggregations sent
+    :param factor: total number of items divided by the items in the sample
+    :param doc_count: items in the sample of the bucket of the aggregations
+    :returns: the aggregations dict, scaled
+    """
+
+    for name, definition in definitions.items():
+        agg = aggs.get(str(name))
+        if agg is None:
+            continue
+        agg_type = [key for key in definition if key not in ("aggs", "meta")][0]
+        sub_aggs = definition.get("aggs", {})
+
+        for field in SCALED_VALUES.get(agg_type, []):
+            if agg.get(field) is not None:
+                agg[field] = agg[field] * factor
+        if agg_type == "cardinality" and agg.get("value") == doc_count:
+            agg["value"] = round(agg["value"] * factor)
+
+        buckets = agg.get("buckets", [])
+        if isinstance(buckets, dict):
+            buckets = buckets.values()
+        for bucket in buckets:
+            scale_aggregations(bucket, sub_aggs, factor, bucket["doc_count"])
+            bucket["doc_count"] = round(bucket["doc_count"] * factor)
+    return aggs
+
+
 def get_trend(timeseries):
     """
     Using the values returned by get_timeseries(), compare the current
@@ -625,6 +1006,8 @@ def calculate_bmi(closed, submitted):
               number of items submitted in a "period" of analysis
     """
 
+    import pandas as pd
+
     if sorted(closed.keys()) != sorted(submitted.keys()):
         raise AttributeError("The buckets supplied are not congruent!")
 
@@ -651,6 +1034,8 @@ def buckets_to_df(buckets):
     :param buckets: elasticsearch aggregation buckets to be converted to a DataFrame obj
     :returns: a DataFrame object created by parsing the buckets
     """
+    import pandas as pd
+
     cleaned_buckets = []
     for item in buckets:
         if type(item) == str:
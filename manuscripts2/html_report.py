@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import base64
+import logging
+
+from html import escape
+
+from manuscripts.csv_writer import latex_unescape, read_csv
+
+logger = logging.getLogger(__name__)
+
+# Sections of the report in the order in which they are displayed
+SECTIONS = [
+    ("overview", "Project overview"),
+    ("activity", "Activity"),
+    ("community", "Community"),
+    ("process", "Process")
+]
+
+IMAGE_TYPES = {
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg"
+}
+
+STYLE = """
+body { font-family: sans-serif; margin: 2em auto; max-width: 60em; color: #333; }
+h1, h2 { color: #1a1a1a; }
+h3 { margin-top: 2em; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 0.2em 0.6em; text-align: right; }
+th { background: #eee; }
+td:first-child { text-align: left; }
+.figure img, .figure svg { max-width: 100%; height: auto; }
+"""
+
+
+def csv_to_html(filename):
+    """
+    Convert a CSV file with a header row into an HTML table
+
+    :param filename: path of the CSV file
+    :returns: a string with the HTML table
+    """
+
+    with open(filename, newline='') as f:
+        rows = [[latex_unescape(field) for field in row] for row in read_csv(f.read())]
+
+    if not rows:
+        return ""
+
+    table = "<table>\n<tr>" + "".join("<th>{}</th>".format(escape(h)) for h in rows[0]) + "</tr>\n"
+    for row in rows[1:]:
+        table += "<tr>" + "".join("<td>{}</td>".format(escape(val)) for val in row) + "</tr>\n"
+    table += "</table>\n"
+    return table
+
+
+def image_to_html(filename):
+    """
+    Embed an image file in the HTML document. SVG images are inlined as
+    they are, the rest of formats are included as base64 data URIs.
+
+    :param filename: path of the image file
+    :returns: a string with the HTML figure
+    """
+
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".svg":
+        with open(filename) as f:
+            image = f.read()
+        # Remove the XML prolog, not allowed inside an HTML document
+        image = image[image.find("<svg"):]
+    else:
+        with open(filename, "rb") as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        image = '<img src="data:{};base64,{}"/>'.format(IMAGE_TYPES[ext], data)
+    return '<div class="figure">\n' + image + '\n</div>\n'
+
+
+def section_to_html(section_path):
+    """
+    Convert all the CSV and image files generated for a section of the report
+    into HTML. Figures are displayed together with the table of their data.
+
+    :param section_path: directory with the files of the section
+    :returns: a string with the HTML content of the section
+    """
+
+    content = ""
+    files = sorted(os.listdir(section_path))
+    for file_name in files:
+        name, ext = os.path.splitext(file_name)
+        if ext != ".csv":
+            continue
+        content += "<h3>{}</h3>\n".format(escape(name.replace("_", " ")))
+        for image_ext in IMAGE_TYPES:
+            if name + image_ext in files:
+                content += image_to_html(os.path.join(section_path, name + image_ext))
+                break
+        content += csv_to_html(os.path.join(section_path, file_name))
+    return content
+
+
+def create_html(data_dir, report_name, period=None, file_name="report.html"):
+    """
+    Create a self-contained HTML report from the data and figs generated
+    for each section of a report.
+
+    :param data_dir: directory with the data of the report
+    :param report_name: name of the report to be used in the title
+    :param period: string with the period of time covered by the report
+    :param file_name: name of the HTML file created in data_dir
+    :returns: the path of the HTML report
+    """
+
+    title = escape(report_name.replace(r"\_", "_"))
+    html = "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+    html += "<title>{}</title>\n<style>{}</style>\n</head>\n<body>\n".format(title, STYLE)
+    html += "<h1>{}</h1>\n".format(title)
+    if period:
+        html += "<p>{}</p>\n".format(escape(period))
+
+    for section, section_title in SECTIONS:
+        section_path = os.path.join(data_dir, section)
+        if not os.path.isdir(section_path):
+            continue
+        html += '<h2 id="{}">{}</h2>\n'.format(section, section_title)
+        html += section_to_html(section_path)
+
+    html += "</body>\n</html>\n"
+
+    report_file = os.path.join(data_dir, file_name)
+    with open(report_file, "w") as f:
+        f.write(html)
+
+    logger.info("HTML report done %s", report_file)
+    return report_file
@@ -51,12 +51,48 @@ class GitMetrics():
         :return: return the date histogram aggregations
         """
 
-        return self.query.get_timeseries(dataframe=dataframe)
+        self.build_timeseries()
+        self.query.name = self.id
+        return self.parse_timeseries(self.query.get_timeseries(dataframe=dataframe))
 
     def aggregations(self):
         """Obtain a single valued aggregation from the current query."""
 
-        return self.query.get_aggs()
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.parse_aggregations(self.query.get_aggs())
+
+    async def atimeseries(self, dataframe=False):
+        """Async version of timeseries, for metrics on an AsyncIndex."""
+
+        self.build_timeseries()
+        self.query.name = self.id
+        return self.parse_timeseries(await self.query.aget_timeseries(dataframe=dataframe))
+
+    async def aaggregations(self):
+        """Async version of aggregations, for metrics on an AsyncIndex."""
+
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.parse_aggregations(await self.query.aget_aggs())
+
+    def build_timeseries(self):
+        """Add to the query the params of the time series, shared by
+        timeseries and atimeseries."""
+
+    def parse_timeseries(self, ts):
+        """Get the value of the metric from the time series of the query."""
+
+        return ts
+
+    def build_aggregations(self):
+        """Add to the query the params of the single valued aggregation,
+        shared by aggregations and aaggregations."""
+
+    def parse_aggregations(self, agg):
+        """Get the value of the metric from the aggregation of the query."""
+
+        return agg
 
 
 class Commits(GitMetrics):
@@ -97,19 +133,28 @@ class Authors(GitMetrics):
         :returns: a data frame containing terms and their corresponding values
         """
 
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.query.get_list(dataframe=True)
+
+    async def aaggregations(self):
+        """Async version of aggregations."""
+
+        self.build_aggregations()
+        self.query.name = self.id
+        return await self.query.aget_list(dataframe=True)
+
+    def build_aggregations(self):
+        """Get the terms of the previous time interval."""
+
         prev_month_start = get_prev_month(self.end, self.query.interval_)
         self.query.since(prev_month_start)
         self.query.get_terms("author_name")
-        return self.query.get_list(dataframe=True)
 
-    def timeseries(self, dataframe=False):
-        """Get the date histogram aggregations.
-
-        :param dataframe: if true, return a pandas.DataFrame object
-        """
+    def build_timeseries(self):
+        """Add the date histogram aggregation to the query."""
 
         self.query.get_cardinality("author_uuid").by_period()
-        return super().timeseries(dataframe)
 
 
 class Organizations(GitMetrics):
@@ -134,10 +179,23 @@ class Organizations(GitMetrics):
         :returns: a data frame containing terms and their corresponding values
         """
 
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.query.get_list(dataframe=True)
+
+    async def aaggregations(self):
+        """Async version of aggregations."""
+
+        self.build_aggregations()
+        self.query.name = self.id
+        return await self.query.aget_list(dataframe=True)
+
+    def build_aggregations(self):
+        """Get the terms of the previous time interval."""
+
         prev_month_start = get_prev_month(self.end, self.query.interval_)
         self.query.since(prev_month_start)
         self.query.get_terms("author_org_name")
-        return self.query.get_list(dataframe=True)
 
 
 def overview(index, start, end):
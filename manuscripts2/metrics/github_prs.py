@@ -19,6 +19,8 @@
 #     Pranjal Aswani <aswani.pranjal@gmail.com>
 #
 
+import asyncio
+
 from manuscripts2.elasticsearch import PullRequests, calculate_bmi
 from manuscripts2.utils import get_prev_month
 
@@ -47,12 +49,48 @@ class GitHubPRsMetrics():
     def timeseries(self, dataframe=False):
         """Obtain a time series from the current query."""
 
-        return self.query.get_timeseries(dataframe=dataframe)
+        self.build_timeseries()
+        self.query.name = self.id
+        return self.parse_timeseries(self.query.get_timeseries(dataframe=dataframe))
 
     def aggregations(self):
         """Obtain a single valued aggregation from the current query."""
 
-        return self.query.get_aggs()
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.parse_aggregations(self.query.get_aggs())
+
+    async def atimeseries(self, dataframe=False):
+        """Async version of timeseries, for metrics on an AsyncIndex."""
+
+        self.build_timeseries()
+        self.query.name = self.id
+        return self.parse_timeseries(await self.query.aget_timeseries(dataframe=dataframe))
+
+    async def aaggregations(self):
+        """Async version of aggregations, for metrics on an AsyncIndex."""
+
+        self.build_aggregations()
+        self.query.name = self.id
+        return self.parse_aggregations(await self.query.aget_aggs())
+
+    def build_timeseries(self):
+        """Add to the query the params of the time series, shared by
+        timeseries and atimeseries."""
+
+    def parse_timeseries(self, ts):
+        """Get the value of the metric from the time series of the query."""
+
+        return ts
+
+    def build_aggregations(self):
+        """Add to the query the params of the single valued aggregation,
+        shared by aggregations and aaggregations."""
+
+    def parse_aggregations(self, agg):
+        """Get the value of the metric from the aggregation of the query."""
+
+        return agg
 
 
 class SubmittedPRs(GitHubPRsMetrics):
@@ -105,25 +143,27 @@ class DaysToClosePRMedian(GitHubPRsMetrics):
         self.query.is_closed()
         self.query.get_percentiles("time_to_close_days")
 
-    def aggregations(self):
-        """Get the single valued aggregations with respect to the
-        previous time interval."""
+    def build_aggregations(self):
+        """Restrict the query to the previous time interval."""
 
         prev_month_start = get_prev_month(self.end, self.query.interval_)
         self.query.since(prev_month_start)
-        agg = super().aggregations()
+
+    def parse_aggregations(self, agg):
+        """Convert the missing values to 0."""
+
         if agg is None:
             agg = 0  # None is because NaN in ES. Let's convert to 0
         return agg
 
-    def timeseries(self, dataframe=False):
-        """Get the date histogram aggregations.
-
-        :param dataframe: if true, return a pandas.DataFrame object
-        """
+    def build_timeseries(self):
+        """Add the date histogram aggregation to the query."""
 
         self.query.by_period()
-        ts = super().timeseries(dataframe=dataframe)
+
+    def parse_timeseries(self, ts):
+        """Round the values to two decimals."""
+
         ts['value'] = ts['value'].apply(lambda x: float("%.2f" % x))
         return ts
 
@@ -145,14 +185,14 @@ class DaysToClosePRAverage(GitHubPRsMetrics):
         self.query.is_closed()
         self.query.get_average("time_to_close_days")
 
-    def timeseries(self, dataframe=False):
-        """Get the date histogram aggregations.
-
-        :param dataframe: if true, return a pandas.DataFrame object
-        """
+    def build_timeseries(self):
+        """Add the date histogram aggregation to the query."""
 
         self.query.by_period()
-        ts = super().timeseries(dataframe=dataframe)
+
+    def parse_timeseries(self, ts):
+        """Round the values to two decimals."""
+
         ts['value'] = ts['value'].apply(lambda x: float("%.2f" % x))
         return ts
 
@@ -182,13 +222,39 @@ class BMIPR():
         """Get the single valued aggregations with respect to the
         previous time interval."""
 
+        self.build_aggregations()
+        closed_agg = self.closed.aggregations()
+        opened_agg = self.opened.aggregations()
+        return self.parse_aggregations(closed_agg, opened_agg)
+
+    def timeseries(self, dataframe=False):
+        """Get BMIPR as a time series."""
+
+        closed_timeseries = self.closed.timeseries(dataframe=dataframe)
+        opened_timeseries = self.opened.timeseries(dataframe=dataframe)
+        return calculate_bmi(closed_timeseries, opened_timeseries)
+
+    async def aaggregations(self):
+        """Async version of aggregations, getting the closed and the opened
+        items at the same time."""
+
+        self.build_aggregations()
+        closed_agg, opened_agg = await asyncio.gather(self.closed.aaggregations(),
+                                                      self.opened.aaggregations())
+        return self.parse_aggregations(closed_agg, opened_agg)
+
+    def build_aggregations(self):
+        """Restrict the queries to the previous time interval, shared by
+        aggregations and aaggregations."""
+
         prev_month_start = get_prev_month(self.end,
                                           self.closed.query.interval_)
         self.closed.query.since(prev_month_start,
                                 field="updated_at")
-        closed_agg = self.closed.aggregations()
         self.opened.query.since(prev_month_start)
-        opened_agg = self.opened.aggregations()
+
+    def parse_aggregations(self, closed_agg, opened_agg):
+        """Get the BMI from the closed and the opened items."""
 
         if opened_agg == 0:
             bmi = 1.0  # if no submitted issues/prs, bmi is at 100%
@@ -196,11 +262,12 @@ class BMIPR():
             bmi = closed_agg / opened_agg
         return bmi
 
-    def timeseries(self, dataframe=False):
-        """Get BMIPR as a time series."""
+    async def atimeseries(self, dataframe=False):
+        """Async version of timeseries."""
 
-        closed_timeseries = self.closed.timeseries(dataframe=dataframe)
-        opened_timeseries = self.opened.timeseries(dataframe=dataframe)
+        closed_timeseries, opened_timeseries = await asyncio.gather(
+            self.closed.atimeseries(dataframe=dataframe),
+            self.opened.atimeseries(dataframe=dataframe))
         return calculate_bmi(closed_timeseries, opened_timeseries)
 
 
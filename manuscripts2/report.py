@@ -19,55 +19,57 @@
 #     Pranjal Aswani <aswani.pranjal@gmail.com>
 #
 
+import asyncio
 import os
 import sys
 import glob
 import logging
-import subprocess
 
 from datetime import datetime
 from dateutil import relativedelta
 from collections import defaultdict
-from distutils.dir_util import copy_tree
-from distutils.file_util import copy_file
-
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import figure
-# Plot figures in style similar to 'seaborn'
-plt.style.use('seaborn')
-import pandas as pd
-
-from elasticsearch import Elasticsearch
 
 from .elasticsearch import (Query,
                             Index,
+                            AsyncIndex,
+                            gather_metrics,
                             get_trend)
 
 from .metrics import git
 from .metrics import github_prs
 from .metrics import github_issues
 
-from .utils import str_val
+from .html_report import create_html
+
+from manuscripts.clients import async_es_client, es_client
+from manuscripts.csv_writer import CSVWriter, write_csv
+from manuscripts.latex import build_pdf
+from manuscripts.manifest import IndexChanges
+from manuscripts.profiler import profiler
 
 logger = logging.getLogger(__name__)
 
+_pyplot = None
+
 
-def create_csv(filename, csv_data, mode="w"):
+def get_pyplot():
     """
-    Create a CSV file with the given data and store it in the
-    file with the given name.
+    Import and set up matplotlib. It takes a long time to load, so it is not
+    imported until the first figure of a report has to be created.
 
-    :param filename: name of the file to store the data in
-    :pram csv_data: the data to be stored in the file
-    :param mode: the mode in which we have to open the file. It can
-                 be 'w', 'a', etc. Default is 'w'
+    :returns: the matplotlib.pyplot module
     """
 
-    with open(filename, mode) as f:
-        csv_data.replace("_", r"\_")
-        f.write(csv_data)
+    global _pyplot
+
+    if not _pyplot:
+        import matplotlib
+        matplotlib.use('agg')
+        import matplotlib.pyplot as plt
+        # Plot figures in style similar to 'seaborn'
+        plt.style.use('seaborn')
+        _pyplot = plt
+    return _pyplot
 
 
 class Report():
@@ -77,6 +79,7 @@ class Report():
     GITHUB_ISSUES_INDEX = 'github_issues'
     GITHUB_PRS_INDEX = 'github_prs'
     TOP_MAX = 20  # maxinum number of top performers/orgs to be displayed
+    IMAGE_TYPES = {"pdf": "eps", "html": "svg"}  # image type of the figures for each output format
 
     # Helper dict to map a data source class with its Elasticsearch index
     class2index = {
@@ -90,7 +93,9 @@ class Report():
 
     def __init__(self, es_url=None, start=None, end=None, data_dir=None, filters=None,
                  interval="month", offset=None, data_sources=None,
-                 report_name=None, projects=False, indices=[], logo=None):
+                 report_name=None, projects=False, indices=[], logo=None,
+                 latex_timeout=None, output_format="pdf", manifest=None, concurrency=None,
+                 preview=None):
         """
         Report init method called when creating a new Report object.
 
@@ -106,15 +111,31 @@ class Report():
         :param projects: generate a specific report for each project
         :param indices: list of data source indices in Elasticsearch to be used to get the metrics values
         :param logo: logo to be used in the report (in the title and headers of the pages)
+        :param latex_timeout: max number of seconds for each pdflatex pass (default: no limit)
+        :param output_format: format of the report: 'pdf' (LaTeX) or 'html'
+        :param manifest: file with the state of the indices in the last run, to only
+                         regenerate the data sources whose index changed since then
+        :param concurrency: max number of searches sent at the same time by the
+                            metrics computed with asyncio queries (default: one
+                            after the other)
+        :param preview: number of items sampled in each shard to compute the metrics,
+                        for a quick report with approximate values (default: exact values)
         """
 
         self.es = es_url
-        self.es_client = Elasticsearch(self.es)
+        self.es_client = es_client(self.es)
 
         # Set the interval for all the metrics that are being calculated
         Query.interval_ = interval
         self.interval = interval
 
+        # Set the sample size for all the metrics, None to get exact values
+        Query.sample_size = preview
+        self.preview = preview
+        if preview:
+            # Mark the report so it is not mistaken for the exact one
+            report_name = "%s (approximate preview)" % report_name
+
         # Set the client for all metrics that are being calculated
         Index.es = self.es_client
 
@@ -128,7 +149,23 @@ class Report():
             self.index_dict[data_sources[pos]] = index
 
         self.logo = logo
+        self.latex_timeout = latex_timeout
+
+        if output_format not in self.IMAGE_TYPES:
+            raise RuntimeError("Output format not supported ", output_format)
+        self.output_format = output_format
+        # HTML reports embed the figures, so they are created in a web format
+        self.image_type = self.IMAGE_TYPES[output_format]
         self.report_name = report_name
+        self.manifest = manifest
+
+        self.concurrency = concurrency
+        self.loop = None
+        if concurrency:
+            # The metrics are computed with async queries in a loop of the report
+            self.loop = asyncio.new_event_loop()
+            self.async_es_client = async_es_client(self.es)
+            AsyncIndex.es = self.async_es_client
 
     def get_metric_index(self, data_source):
         """
@@ -144,8 +181,35 @@ class Report():
             index = self.index_dict[data_source]
         else:
             index = self.class2index[self.ds2class[data_source]]
+        if self.concurrency:
+            return AsyncIndex(index_name=index)
         return Index(index_name=index)
 
+    def get_values(self, metrics, method, **params):
+        """
+        Compute the same method for a list of metrics. With a concurrency set,
+        their async versions are run at the same time in the loop of the report.
+
+        :param metrics: list of metric objects
+        :param method: name of the method to be called: timeseries or aggregations
+        :param params: params of the method (eg, dataframe=True)
+        :returns: a list with the value of each metric, in the same order
+        """
+
+        if not self.concurrency:
+            return [getattr(metric, method)(**params) for metric in metrics]
+
+        calls = [getattr(metric, "a" + method)(**params) for metric in metrics]
+        return self.loop.run_until_complete(gather_metrics(calls, self.concurrency))
+
+    def close(self):
+        """Close the async client and the loop of the report, if any"""
+
+        if self.loop:
+            self.loop.run_until_complete(self.async_es_client.close())
+            self.loop.close()
+            self.loop = None
+
     def get_sec_overview(self):
         """
         Generate the "overview" section of the report.
@@ -180,14 +244,12 @@ class Report():
         file_name = overview_config['activity_file_csv']
         file_name = os.path.join(data_path, file_name)
 
-        csv = "metricsnames, netvalues, relativevalues, datasource\n"
-
-        for metric in metrics:
-            (last, percentage) = get_trend(metric.timeseries())
-            csv += "{}, {}, {}, {}\n".format(metric.name, last,
-                                             percentage, metric.DS_NAME)
-        csv = csv.replace("_", "\_")
-        create_csv(file_name, csv)
+        header = ["metricsnames", "netvalues", "relativevalues", "datasource"]
+        timeseries = self.get_values(metrics, "timeseries")
+        with CSVWriter(file_name, header, sep=", ") as writer:
+            for metric, ts in zip(metrics, timeseries):
+                (last, percentage) = get_trend(ts)
+                writer.writerow([metric.name, str(last), str(percentage), metric.DS_NAME])
 
         # AUTHOR METRICS
         """
@@ -204,42 +266,26 @@ class Report():
             authors_by_period = author[0]
             title_label = file_label = authors_by_period.name + ' per ' + self.interval
             file_path = os.path.join(data_path, file_label)
-            csv_data = authors_by_period.timeseries(dataframe=True)
+            csv_data, = self.get_values([authors_by_period], "timeseries", dataframe=True)
             # generate the CSV and the image file displaying the data
             self.create_csv_fig_from_df([csv_data], file_path, [authors_by_period.name],
                                         fig_type="bar", title=title_label, xlabel="time_period",
                                         ylabel=authors_by_period.id)
-        # BMI METRICS
-        bmi = []
-        bmi_metrics = overview_config['bmi_metrics']
-        csv = ""
-        for metric in bmi_metrics:
-            bmi.append(metric.aggregations())
-            csv += metric.id + ", "
-
-        # Time to close METRICS
-        ttc = []
-        ttc_metrics = overview_config['time_to_close_metrics']
-        for metric in ttc_metrics:
-            ttc.append(metric.aggregations())
-            csv += metric.id + ", "
+        # BMI and Time to close METRICS
+        efficiency_metrics = overview_config['bmi_metrics'] + overview_config['time_to_close_metrics']
+        csv_labels = [metric.id for metric in efficiency_metrics]
+        efficiency = self.get_values(efficiency_metrics, "aggregations")
 
         # generate efficiency file
-        csv = csv[:-2] + "\n"
-        csv = csv.replace("_", "")
-        bmi.extend(ttc)
-        for val in bmi:
-            csv += "%s, " % str_val(val)
-        if csv[-2:] == ", ":
-            csv = csv[:-2]
-
         file_name = os.path.join(data_path, 'efficiency.csv')
-        create_csv(file_name, csv)
+        write_csv(file_name, csv_labels, [efficiency], sep=", ")
         logger.debug("Overview metrics generation complete!")
 
-    def get_sec_project_activity(self):
+    def get_sec_project_activity(self, data_sources=None):
         """
         Generate the "project activity" section of the report.
+
+        :param data_sources: data sources to be included in the section, all of them if None
         """
 
         logger.debug("Calculating Project Activity metrics.")
@@ -248,20 +294,30 @@ class Report():
         if not os.path.exists(data_path):
             os.makedirs(data_path)
 
-        for ds in self.data_sources:
+        if data_sources is None:
+            data_sources = self.data_sources
+
+        ds_metrics = []
+        for ds in data_sources:
             metric_file = self.ds2class[ds]
             metric_index = self.get_metric_index(ds)
             project_activity = metric_file.project_activity(metric_index, self.start_date,
                                                             self.end_date)
+            ds_metrics.append(project_activity['metrics'])
+
+        # The metrics of all the data sources are computed at once
+        all_data_frames = self.get_values(sum(ds_metrics, []), "timeseries", dataframe=True)
+
+        for metrics in ds_metrics:
             headers = []
-            data_frames = []
+            data_frames = all_data_frames[:len(metrics)]
+            all_data_frames = all_data_frames[len(metrics):]
             title_names = []
             file_name = ""
-            for metric in project_activity['metrics']:
+            for metric in metrics:
                 file_name += metric.DS_NAME + "_" + metric.id + "_"
                 title_names.append(metric.name)
                 headers.append(metric.id)
-                data_frames.append(metric.timeseries(dataframe=True))
 
             file_name = file_name[:-1]  # remove trailing underscore
             file_path = os.path.join(data_path, file_name)
@@ -296,7 +352,11 @@ class Report():
 
         # Get git authors:
         author = project_community_config['author_metrics'][0]
-        author_ts = author.timeseries(dataframe=True)
+        authors = project_community_config['people_top_metrics'][0]
+        orgs = project_community_config['orgs_top_metrics'][0]
+        author_ts, = self.get_values([author], "timeseries", dataframe=True)
+        authors_df, orgs_df = self.get_values([authors, orgs], "aggregations")
+
         csv_labels = [author.id]
         file_label = author.DS_NAME + "_" + author.id
         file_path = os.path.join(data_path, file_label)
@@ -305,26 +365,22 @@ class Report():
                                     title=title_label)
 
         """Main developers"""
-        authors = project_community_config['people_top_metrics'][0]
-        authors_df = authors.aggregations()
-        authors_df = authors_df.head(self.TOP_MAX)
-        authors_df.columns = [authors.id, "commits"]
         file_label = authors.DS_NAME + "_top_" + authors.id + ".csv"
         file_path = os.path.join(data_path, file_label)
-        authors_df.to_csv(file_path, index=False)
+        write_csv(file_path, [authors.id, "commits"], authors_df.itertuples(index=False),
+                  max_rows=self.TOP_MAX)
 
         """Main organizations"""
-        orgs = project_community_config['orgs_top_metrics'][0]
-        orgs_df = orgs.aggregations()
-        orgs_df = orgs_df.head(self.TOP_MAX)
-        orgs_df.columns = [orgs.id, "commits"]
         file_label = orgs.DS_NAME + "_top_" + orgs.id + ".csv"
         file_path = os.path.join(data_path, file_label)
-        orgs_df.to_csv(file_path, index=False)
+        write_csv(file_path, [orgs.id, "commits"], orgs_df.itertuples(index=False),
+                  max_rows=self.TOP_MAX)
 
-    def get_sec_project_process(self):
+    def get_sec_project_process(self, data_sources=None):
         """
         Generate the "project process" section of the report.
+
+        :param data_sources: data sources to be included in the section, all of them if None
         """
 
         logger.debug("Calculating Project Process metrics.")
@@ -340,7 +396,10 @@ class Report():
             "patchsets_metrics": []
         }
 
-        for ds in self.data_sources:
+        if data_sources is None:
+            data_sources = self.data_sources
+
+        for ds in data_sources:
             metric_file = self.ds2class[ds]
             metric_index = self.get_metric_index(ds)
             project_process = metric_file.project_process(metric_index, self.start_date,
@@ -351,13 +410,19 @@ class Report():
         project_process_config["time_to_close_title"] = "Days to close (median and average)"
         project_process_config["time_to_close_review_title"] = "Days to close review (median and average)"
 
+        # The metrics of all the section are computed at once
+        metrics = [metric for section in ['bmi_metrics', 'time_to_close_metrics',
+                                          'time_to_close_review_metrics', 'patchsets_metrics']
+                   for metric in project_process_config[section]]
+        timeseries = dict(zip(metrics, self.get_values(metrics, "timeseries", dataframe=True)))
+
         """
         BMI Pull Requests, BMI Issues
         description: closed PRs/issues out of open PRs/issues in a period of time
         """
         for bmi_metric in project_process_config['bmi_metrics']:
             headers = bmi_metric.id
-            dataframe = bmi_metric.timeseries(dataframe=True)
+            dataframe = timeseries[bmi_metric]
             file_label = bmi_metric.DS_NAME + "_" + bmi_metric.id
             file_path = os.path.join(data_path, file_label)
             title_name = bmi_metric.name
@@ -375,8 +440,7 @@ class Report():
                 headers = [metrics[i].id, metrics[i + 1].id]
                 file_label += metrics[i].DS_NAME + "_" + metrics[i].id + "_"
                 file_label += metrics[i + 1].DS_NAME + "_" + metrics[i + 1].id
-                dataframes = [metrics[i].timeseries(dataframe=True),
-                              metrics[i + 1].timeseries(dataframe=True)]
+                dataframes = [timeseries[metrics[i]], timeseries[metrics[i + 1]]]
                 title_name = project_process_config['time_to_close_title']
                 file_path = os.path.join(data_path, file_label)
                 self.create_csv_fig_from_df(dataframes, file_path, headers,
@@ -394,8 +458,7 @@ class Report():
                 headers = [metrics[i].id, metrics[i + 1].id]
                 file_label += metrics[i].DS_NAME + "_" + metrics[i].id + "_"
                 file_label += metrics[i + 1].DS_NAME + "_" + metrics[i + 1].id
-                dataframes = [metrics[i].timeseries(dataframe=True),
-                              metrics[i + 1].timeseries(dataframe=True)]
+                dataframes = [timeseries[metrics[i]], timeseries[metrics[i + 1]]]
                 title_name = project_process_config['time_to_close_review_title']
                 file_path = os.path.join(data_path, file_label)
                 self.create_csv_fig_from_df(dataframes, file_path, headers,
@@ -409,8 +472,7 @@ class Report():
             file_label = ""
             metrics = project_process_config['patchsets_metrics']
             headers = [metrics[0].id, metrics[1].id]
-            dataframes = [metrics[0].timeseries(dataframe=True),
-                          metrics[1].timeseries(dataframe=True)]
+            dataframes = [timeseries[metrics[0]], timeseries[metrics[1]]]
             file_label = metrics[0].DS_NAME + "_" + metrics[0].id + "_"
             file_label += metrics[1].DS_NAME + "_" + metrics[1].id
             file_path = os.path.join(data_path, file_label)
@@ -420,7 +482,7 @@ class Report():
 
     def create_csv_fig_from_df(self, data_frames=[], filename=None, headers=[], index_label=None,
                                fig_type=None, title=None, xlabel=None, ylabel=None, xfont=10,
-                               yfont=10, titlefont=15, fig_size=(8, 10), image_type="eps"):
+                               yfont=10, titlefont=15, fig_size=(8, 10), image_type=None):
         """
         Joins all the datafarames horizontally and creates a CSV and an image file from
         those dataframes.
@@ -440,12 +502,14 @@ class Report():
         :param titlefont: font size of title of the figure
         :param fig_size: tuple describing size of the figure (in centimeters) (W x H)
         :param image_type: the image type to save the image as: jpg, png, etc
-                           default: png
+                           default: the one for the report output format (eps for PDF reports)
 
         :returns: creates a csv having name as "filename".csv and an image file
                   having the name as "filename"."image_type"
         """
 
+        import pandas as pd
+
         if not data_frames:
             logger.error("No dataframes provided to create CSV")
             sys.exit(1)
@@ -464,48 +528,65 @@ class Report():
 
         # Create the CSV file:
         csv_name = filename + ".csv"
-        res_df.to_csv(csv_name, index_label=index_label)
+        with profiler.stage("csv", csv_name):
+            res_df.to_csv(csv_name, index_label=index_label)
         logger.debug("file: {} was created.".format(csv_name))
 
         # Create the Image:
+        if not image_type:
+            image_type = self.image_type
         image_name = filename + "." + image_type
         title = title.replace("_", "")
-        figure(figsize=fig_size)
-        plt.subplot(111)
-
-        if fig_type == "bar":
-            ax = res_df.plot.bar(figsize=fig_size)
-            ticklabels = res_df.index
-            ax.xaxis.set_major_formatter(matplotlib.ticker.FixedFormatter(ticklabels))
-        else:
-            plt.plot(res_df)
-
-        if not ylabel:
-            ylabel = "num " + " & ".join(headers)
-        if not xlabel:
-            xlabel = index_label
-
-        plt.title(title, fontsize=titlefont)
-        plt.ylabel(ylabel, fontsize=yfont)
-        plt.xlabel(xlabel, fontsize=xfont)
-        plt.grid(True)
-        plt.savefig(image_name)
+        plt = get_pyplot()
+        from matplotlib.ticker import FixedFormatter
+        with profiler.stage("figure", image_name):
+            plt.figure(figsize=fig_size)
+            plt.subplot(111)
+
+            if fig_type == "bar":
+                ax = res_df.plot.bar(figsize=fig_size)
+                ticklabels = res_df.index
+                ax.xaxis.set_major_formatter(FixedFormatter(ticklabels))
+            else:
+                plt.plot(res_df)
+
+            if not ylabel:
+                ylabel = "num " + " & ".join(headers)
+            if not xlabel:
+                xlabel = index_label
+
+            plt.title(title, fontsize=titlefont)
+            plt.ylabel(ylabel, fontsize=yfont)
+            plt.xlabel(xlabel, fontsize=xfont)
+            plt.grid(True)
+            plt.savefig(image_name)
+            # The figures are not reused, and the service workers generate many reports
+            plt.close('all')
         logger.debug("Figure {} was generated.".format(image_name))
 
-    def create_data_figs(self):
+    def create_data_figs(self, data_sources=None):
         """
         Generate the data and figs files for the report
 
+        :param data_sources: data sources whose data and figs have to be generated,
+                             all of them if None. The overview joins all the data
+                             sources, so it is always generated.
         :return:
         """
 
         logger.info("Generating the report data and figs from %s to %s",
                     self.start_date, self.end_date)
 
-        self.get_sec_overview()
-        self.get_sec_project_activity()
-        self.get_sec_project_community()
-        self.get_sec_project_process()
+        with profiler.in_section("overview"):
+            self.get_sec_overview()
+        with profiler.in_section("activity"):
+            self.get_sec_project_activity(data_sources)
+        # The community metrics are the git ones
+        if data_sources is None or 'git' in data_sources:
+            with profiler.in_section("community"):
+                self.get_sec_project_community()
+        with profiler.in_section("process"):
+            self.get_sec_project_process(data_sources)
 
         logger.info("Data and figs done")
 
@@ -545,6 +626,9 @@ class Report():
         :return:
         """
 
+        from distutils.dir_util import copy_tree
+        from distutils.file_util import copy_file
+
         logger.info("Generating PDF report")
 
         # First step is to create the report dir from the template
@@ -580,10 +664,6 @@ class Report():
         # Change the date Copyright
         self.replace_text_dir(report_path, '(cc) 2016', '(cc) ' + datetime.now().strftime('%Y'))
 
-        # Fix LaTeX special chars
-        self.replace_text_dir(report_path, '&', '\&', 'data/git_top_organizations_*')
-        self.replace_text_dir(report_path, '^#', '', 'data/git_top_organizations_*')
-
         # Activity section
         activity = ''
         for activity_ds in ['git', 'github_prs', 'github_issues']:
@@ -617,25 +697,79 @@ class Report():
             flatex.write(process)
 
         # Time to generate the pdf report
-        res = subprocess.call("pdflatex report.tex", shell=True, cwd=report_path)
-        if res > 0:
-            logger.error("Error generating PDF")
+        if build_pdf(report_path, timeout=self.latex_timeout) is None:
             return
-        # A second time so the TOC is generated
-        subprocess.call("pdflatex report.tex", shell=True, cwd=report_path)
 
         logger.info("PDF report done %s", report_path + "/report.pdf")
 
+    def create_html(self):
+        """
+        Create a self-contained HTML report with the figs and data for the report,
+        without the need of LaTeX.
+
+        :return: the path of the HTML report
+        """
+
+        logger.info("Generating HTML report")
+
+        period = "From {} to {}".format(self.start_date.strftime('%Y-%m-%d'),
+                                        self.end_date.strftime('%Y-%m-%d'))
+        return create_html(self.data_dir, self.report_name, period)
+
     def create(self):
         """
         Generate the data and figs for the report and fill the LaTeX templates with them
-        to generate a PDF file with the report.
+        to generate a PDF file with the report, or an HTML file if that is the output format.
 
         :return:
         """
         logger.info("Generating the report from %s to %s", self.start_date, self.end_date)
 
-        self.create_data_figs()
-        self.create_pdf()
+        changes = None
+        if self.manifest:
+            changes = IndexChanges(self.manifest, self.es_client, self.get_indices(),
+                                   self.get_params())
+            if not changes.data_sources:
+                logger.info("No index changed since the last report, nothing to generate")
+                self.close()
+                return
+
+        try:
+            self.create_data_figs(changes.data_sources if changes else None)
+        finally:
+            self.close()
+        if self.output_format == "html":
+            self.create_html()
+        else:
+            self.create_pdf()
+
+        if changes:
+            changes.save()
 
         logger.info("Report completed")
+
+    def get_indices(self):
+        """
+        Get the Elasticsearch index of each data source of the report
+
+        :returns: a dict with the index name of each data source
+        """
+
+        return {ds: self.get_metric_index(ds).index_name for ds in self.data_sources}
+
+    def get_params(self):
+        """
+        Get the params which define the contents of the report
+
+        :returns: a dict with the params of the report
+        """
+
+        return {
+            "start": self.start_date.isoformat(),
+            "end": self.end_date.isoformat(),
+            "interval": self.interval,
+            "data_sources": sorted(self.data_sources),
+            "output_format": self.output_format,
+            "report_name": self.report_name,
+            "logo": self.logo
+        }
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Monthly rollups of the enriched indices, kept up to date by Elasticsearch
+transforms, so the additive metrics of the reports are computed from small
+indices instead of from all the items.
+
+The transform of each index groups its items by the month of their dates,
+their project, their organization and the rest of the fields filtered by
+the metrics, with the number of items and of distinct ids of each group.
+It runs in continuous mode, so the items enriched later are added to the
+rollup.
+
+In rollup mode, the searches on an index with a rollup are sent to the
+rollup when they can be answered with it: all their filters are on the
+fields of the groups, with date ranges starting and ending at the start of
+a month, and their aggregations are monthly, quarterly or yearly histograms
+of the dates and counts of ids. The rest of the searches, like the ones of
+the authors or the time to close, are sent to the index of the items.
+
+The distinct ids of the groups are only added up when an id is not shared
+by items of several groups, as the commits found in the repositories of
+several projects. The distinct counts of the shared ids are only sent to
+the rollup when the query selects a single value of each field of the
+groups.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from elasticsearch import NotFoundError
+
+from manuscripts.clients import add_client_wrapper, es_client, search_body
+from manuscripts.memory_engine import to_timestamp
+from manuscripts.plan import get_agg_type
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the names of the transforms and of their rollup indices
+ROLLUP_PREFIX = "manuscripts_rollup_"
+
+# Fields of the items of each data source: the id counted, the dates
+# grouped by month and the rest of the fields of the groups
+ROLLUP_FIELDS = {
+    "git": {"id": "hash",
+            "dates": ["grimoire_creation_date"],
+            "terms": ["project", "author_org_name"]},
+    "github_issues": {"id": "id",
+                      "dates": ["grimoire_creation_date", "closed_at"],
+                      "terms": ["project", "author_org_name", "state", "pull_request"]},
+    "github_prs": {"id": "id",
+                   "dates": ["grimoire_creation_date", "closed_at"],
+                   "terms": ["project", "author_org_name", "state", "pull_request"]}
+}
+
+# Ids which can be shared by items of several groups, like the hashes of
+# the commits of a repository found in several projects
+SHARED_IDS = ["hash"]
+
+# Fields of the rollups with the distinct ids and the items of each group
+ITEMS_FIELD = "items"
+DOCS_FIELD = "docs"
+
+# Field with the date in which the items were enriched, to find the new ones
+SYNC_FIELD = "metadata__enriched_on"
+FREQUENCY = "5m"
+DELAY = "60s"
+
+# Histogram intervals made of whole months
+ROLLUP_INTERVALS = ["month", "1M", "quarter", "1q", "year", "1y"]
+
+# Aggregation added to the searches sent to a rollup, with the items of each bucket
+DOCS_AGG = "rollup_docs"
+
+
+def rollup_name(index):
+    """Get the name of the transform of an index, and of its rollup index"""
+
+    return ROLLUP_PREFIX + re.sub(r"[^a-z0-9_-]", "_", index.lower())
+
+
+def transform_config(data_source, index, frequency=FREQUENCY, delay=DELAY):
+    """
+    Build the config of the transform creating the rollup of an index
+
+    :param data_source: data source of the items of the index
+    :param index: name of the enriched index
+    :param frequency: time between the checks for new items
+    :param delay: time for the new items to be searchable
+    :returns: a dict with the config of the transform
+    """
+
+    if data_source not in ROLLUP_FIELDS:
+        raise RuntimeError("Rollups not supported for data source", data_source)
+    fields = ROLLUP_FIELDS[data_source]
+
+    group_by = OrderedDict()
+    for field in fields["dates"]:
+        group_by[field] = {"date_histogram": {"field": field, "calendar_interval": "1M",
+                                              "missing_bucket": True}}
+    for field in fields["terms"]:
+        group_by[field] = {"terms": {"field": field, "missing_bucket": True}}
+
+    config = {
+        "source": {"index": [index]},
+        "dest": {"index": rollup_name(index)},
+        "frequency": frequency,
+        "sync": {"time": {"field": SYNC_FIELD, "delay": delay}},
+        "pivot": {
+            "group_by": group_by,
+            "aggregations": {
+                ITEMS_FIELD: {"cardinality": {"field": fields["id"]}},
+                DOCS_FIELD: {"value_count": {"field": fields["id"]}}
+            }
+        }
+    }
+    # The fingerprint tells whether a transform already created is up to date
+    fingerprint = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    config["description"] = "Monthly rollup of %s for manuscripts [%s]" % (index, fingerprint[:12])
+    return config
+
+
+def get_transform(es, name):
+    """
+    Get the config and the stats of a transform
+
+    :param es: Elasticsearch client
+    :param name: name of the transform
+    :returns: a tuple with the config and the stats, or None if it does not exist
+    """
+
+    try:
+        config = es.transform.get_transform(transform_id=name)["transforms"][0]
+        stats = es.transform.get_transform_stats(transform_id=name)["transforms"][0]
+    except NotFoundError:
+        return None
+    return config, stats
+
+
+def delete_rollup(es, name):
+    """Delete a transform and its rollup index"""
+
+    es.transform.stop_transform(transform_id=name, force=True, wait_for_completion=True)
+    es.transform.delete_transform(transform_id=name, force=True)
+    es.indices.delete(index=name, ignore_unavailable=True)
+
+
+def create_rollups(url, data_sources, indices=None, frequency=FREQUENCY, delay=DELAY):
+    """
+    Create the transforms of the rollups of some indices, or update them
+    when their config changed, and start them
+
+    :param url: Elasticsearch URL
+    :param data_sources: list of data sources
+    :param indices: index of each data source (default: the data source name)
+    :param frequency: time between the checks for new items
+    :param delay: time for the new items to be searchable
+    """
+
+    es = es_client(url)
+    for data_source, index in zip(data_sources, indices or data_sources):
+        config = transform_config(data_source, index, frequency, delay)
+        name = rollup_name(index)
+
+        transform = get_transform(es, name)
+        if transform and transform[0].get("description") == config["description"]:
+            state = transform[1]["state"]
+            if state == "failed":
+                logger.warning("Rollup of %s failed: %s", index, transform[1].get("reason"))
+                es.transform.stop_transform(transform_id=name, force=True, wait_for_completion=True)
+            if state in ("failed", "stopped"):
+                es.transform.start_transform(transform_id=name)
+                logger.info("Rollup of %s started again", index)
+            else:
+                logger.info("Rollup of %s up to date (%s)", index, state)
+            continue
+
+        if transform:
+            logger.info("Rollup of %s changed, creating it again", index)
+            delete_rollup(es, name)
+        else:
+            # An index left by a deleted transform would have stale groups
+            es.indices.delete(index=name, ignore_unavailable=True)
+        es.transform.put_transform(transform_id=name, body=config)
+        es.transform.start_transform(transform_id=name)
+        logger.info("Rollup of %s created in %s", index, name)
+
+
+def delete_rollups(url, data_sources, indices=None):
+    """
+    Delete the transforms and the rollups of some indices
+
+    :param url: Elasticsearch URL
+    :param data_sources: list of data sources
+    :param indices: index of each data source (default: the data source name)
+    """
+
+    es = es_client(url)
+    for index in indices or data_sources:
+        name = rollup_name(index)
+        if not get_transform(es, name):
+            logger.info("Rollup of %s not found", index)
+            continue
+        delete_rollup(es, name)
+        logger.info("Rollup of %s deleted", index)
+
+
+def read_rollup(config):
+    """
+    Get the fields of a rollup from the config of its transform
+
+    :param config: dict with the config of the transform
+    :returns: a dict with the rollup index, the id counted, whether it is
+              shared by items of several groups, the dates and the rest of
+              the fields of the groups
+    """
+
+    pivot = config["pivot"]
+    id_field = pivot["aggregations"][ITEMS_FIELD]["cardinality"]["field"]
+    return {
+        "index": config["dest"]["index"],
+        "id": id_field,
+        "shared_id": id_field in SHARED_IDS,
+        "dates": [name for name, group in pivot["group_by"].items() if "date_histogram" in group],
+        "terms": [name for name, group in pivot["group_by"].items() if "terms" in group]
+    }
+
+
+def is_month_start(bound, exclusive=False):
+    """
+    Check whether a bound of a date range is the start of a month
+
+    :param bound: date of the bound
+    :param exclusive: whether the bound is the last date included (lte),
+                      so the month starts after it
+    :returns: True if the range starts or ends at the start of a month
+    """
+
+    try:
+        millis = to_timestamp(bound).value // 10 ** 6
+    except ValueError:
+        # Date math, like now-1y
+        return False
+    if exclusive:
+        millis += 1
+    start = datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+    return start == start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_query(query, rollup):
+    """
+    Check whether a query can be applied to a rollup: all its clauses are
+    on the fields of the groups, with months as date ranges
+
+    :param query: dict (or list of dicts) with the query of a search
+    :param rollup: dict with the fields of the rollup
+    :returns: True if the query selects whole groups of the rollup
+    """
+
+    if isinstance(query, list):
+        return all(rollup_query(clause, rollup) for clause in query)
+    if not isinstance(query, dict) or len(query) != 1:
+        return False
+
+    (kind, params), = query.items()
+    if kind == "match_all":
+        return True
+    if kind == "bool":
+        return set(params) <= {"must", "filter", "must_not"} and \
+            all(rollup_query(clauses, rollup) for clauses in params.values())
+    if kind in ("match", "term", "terms"):
+        return len(params) == 1 and list(params)[0] in rollup["terms"]
+    if kind == "range":
+        if len(params) != 1:
+            return False
+        (field, bounds), = params.items()
+        return field in rollup["dates"] and set(bounds) <= {"gte", "lt", "lte"} and \
+            all(is_month_start(bound, op == "lte") for op, bound in bounds.items())
+    return False
+
+
+def pinned_terms(query):
+    """
+    Get the fields with a single value in all the items selected by a query
+    checked by rollup_query
+
+    :param query: dict (or list of dicts) with the query of a search
+    :returns: a set with the fields matched with a single value
+    """
+
+    if isinstance(query, list):
+        return set().union(*[pinned_terms(clause) for clause in query])
+
+    (kind, params), = query.items()
+    if kind == "bool":
+        return pinned_terms(params.get("must", [])) | pinned_terms(params.get("filter", []))
+    if kind in ("match", "term"):
+        return set(params)
+    if kind == "terms":
+        (field, values), = params.items()
+        return {field} if len(values) == 1 else set()
+    return set()
+
+
+def rollup_aggs(aggs, rollup, pinned=True):
+    """
+    Get the aggregations computing from a rollup the ones of a search
+
+    :param aggs: dict with the aggregations of the search
+    :param rollup: dict with the fields of the rollup
+    :param pinned: whether the query selects a single value of each field
+                   of the groups, so the distinct ids of each month are
+                   the ones of a single group
+    :returns: a dict with the aggregations for the rollup, or None if they
+              can not be computed from it
+    """
+
+    results = {}
+    for name, agg in aggs.items():
+        agg_type, params = get_agg_type(agg)
+        sub_aggs = agg.get("aggs", agg.get("aggregations", {}))
+        if agg_type == "date_histogram":
+            interval = params.get("calendar_interval", params.get("interval"))
+            if params.get("field") not in rollup["dates"] or interval not in ROLLUP_INTERVALS \
+                    or params.get("time_zone", "UTC") not in ("UTC", "Z", "+00:00") or "offset" in params:
+                return None
+            sub_results = rollup_aggs(sub_aggs, rollup, pinned)
+            if sub_results is None:
+                return None
+            sub_results[DOCS_AGG] = {"sum": {"field": DOCS_FIELD}}
+            results[str(name)] = {"date_histogram": params, "aggs": sub_results}
+        elif agg_type == "cardinality" and rollup.get("shared_id") and not pinned:
+            # Ids of several groups would be counted once per group
+            return None
+        elif agg_type in ("cardinality", "value_count") and params.get("field") == rollup["id"] \
+                and not sub_aggs:
+            field = ITEMS_FIELD if agg_type == "cardinality" else DOCS_FIELD
+            results[str(name)] = {"sum": {"field": field}}
+        else:
+            return None
+    return results
+
+
+def rollup_search(body, rollup):
+    """
+    Get the search computing from a rollup the results of a search
+
+    :param body: body of the search
+    :param rollup: dict with the fields of the rollup
+    :returns: the body of the search for the rollup, or None if the search
+              can not be answered with it
+    """
+
+    if body.get("size") != 0 or set(body) - {"query", "aggs", "aggregations", "size", "track_total_hits"}:
+        return None
+    query = body.get("query", {"match_all": {}})
+    if not rollup_query(query, rollup):
+        return None
+    pinned = set(rollup["terms"]) <= pinned_terms(query)
+    aggs = rollup_aggs(body.get("aggs", body.get("aggregations", {})), rollup, pinned)
+    if aggs is None:
+        return None
+
+    aggs[DOCS_AGG] = {"sum": {"field": DOCS_FIELD}}
+    return {"query": query, "aggs": aggs, "size": 0}
+
+
+def rollup_results(results, aggs):
+    """
+    Convert the results of the aggregations of a rollup to the ones of the
+    search on the items: the items of the buckets are in their doc_count,
+    and the counts are integers
+
+    :param results: dict with the results of the aggregations, by name
+    :param aggs: dict with the aggregations sent to the rollup
+    """
+
+    for name, agg in aggs.items():
+        if name == DOCS_AGG:
+            continue
+        result = results[name]
+        if "date_histogram" in agg:
+            for bucket in result["buckets"]:
+                bucket["doc_count"] = int(bucket.pop(DOCS_AGG)["value"])
+                rollup_results(bucket, agg["aggs"])
+        else:
+            result["value"] = int(result["value"])
+
+
+class RollupClient():
+    """Elasticsearch client which sends to the rollups the searches which
+    can be answered with them
+
+    :param client: Elasticsearch client used to run the searches
+    :param rollups: dict with the fields of the rollup of each index
+    """
+
+    def __init__(self, client, rollups):
+        self.client = client
+        self.rollups = rollups
+        self.searches = 0
+        self.rollup_searches = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def search(self, index=None, body=None, **params):
+        body, params = search_body(body, params)
+        names = index if isinstance(index, (list, tuple)) else (index or "").split(",")
+        rollup = self.rollups.get(names[0]) if len(names) == 1 else None
+        rollup_body = rollup_search(body, rollup) if rollup and "scroll" not in params else None
+        with self._lock:
+            self.searches += 1
+            self.rollup_searches += rollup_body is not None
+        if rollup_body is None:
+            return self.client.search(index=index, body=body, **params)
+
+        logger.debug("Search on %s sent to its rollup %s", names[0], rollup["index"])
+        response = self.client.search(index=rollup["index"], body=rollup_body, **params)
+        aggregations = response["aggregations"]
+        total = int(aggregations.pop(DOCS_AGG)["value"])
+        rollup_results(aggregations, rollup_body["aggs"])
+
+        hits = dict(response["hits"], hits=[])
+        hits["total"] = dict(hits["total"], value=total, relation="eq") \
+            if isinstance(hits["total"], dict) else total
+        return dict(response, hits=hits)
+
+
+def rollup_searches(url):
+    """
+    Send the searches from now on to the rollups of their indices, when
+    they can be answered with them
+
+    :param url: Elasticsearch URL
+    :returns: a function to log the number of searches answered with the
+              rollups once done
+    """
+
+    es = es_client(url)
+    try:
+        configs = es.transform.get_transform(transform_id=ROLLUP_PREFIX + "*",
+                                             allow_no_match=True, size=1000)["transforms"]
+        stats = es.transform.get_transform_stats(transform_id=ROLLUP_PREFIX + "*",
+                                                 allow_no_match=True, size=1000)["transforms"]
+    except Exception as e:
+        logger.warning("Can not get the rollups, all the searches are sent to the indices: %s", e)
+        configs, stats = [], []
+    stats = {transform["id"]: transform for transform in stats}
+
+    rollups = {}
+    for config in configs:
+        transform = stats.get(config["id"], {})
+        last = transform.get("checkpointing", {}).get("last", {})
+        if transform.get("state") == "failed" or not last.get("checkpoint"):
+            logger.warning("Rollup %s not used, its transform is %s and has no checkpoint done",
+                           config["id"], transform.get("state"))
+            continue
+        rollup = read_rollup(config)
+        for index in config["source"]["index"]:
+            rollups[index] = rollup
+        updated = datetime.fromtimestamp(last.get("timestamp_millis", 0) / 1000, tz=timezone.utc)
+        logger.info("Rollup %s of %s updated on %s", config["id"],
+                    ",".join(config["source"]["index"]), updated.isoformat())
+
+    clients = []
+
+    def wrap(client):
+        rollup_client = RollupClient(client, rollups)
+        clients.append(rollup_client)
+        return rollup_client
+
+    add_client_wrapper(wrap)
+    return lambda: log_rollup_searches(clients)
+
+
+def log_rollup_searches(clients):
+    """Log the number of searches answered with the rollups by some clients"""
+
+    searches = sum(client.searches for client in clients)
+    rollup_searches = sum(client.rollup_searches for client in clients)
+    logger.info("%i of %i searches answered with the rollups", rollup_searches, searches)
+    if searches and not rollup_searches:
+        logger.warning("No search answered with the rollups, check the report dates are month starts")
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Report service: a long running process generating manuscripts2 reports
+requested through a local HTTP/JSON API.
+
+    POST /reports                     submit a report, returns its id
+    GET  /reports                     status of all the reports
+    GET  /reports/<id>                status and artifacts of a report
+    GET  /reports/<id>/files/<path>   get a file of a report
+
+Reports are generated by a pool of worker processes which live as long as
+the service, so the imports, matplotlib, the Elasticsearch connections and
+a cache of the search responses are reused by all the reports they run.
+Each worker runs a report at a time, as the metrics share the interval
+and client set by the report at class level. Reports waiting for a worker
+are limited by the size of the queue, submissions beyond it are rejected.
+Only the status of the last finished reports is kept, their files are left
+in the output directory.
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import threading
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dateutil import parser
+
+from manuscripts.clients import CACHE_TTL, cache_searches
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+PORT = 8000
+QUEUE_SIZE = 100
+MAX_REPORTS = 1000
+
+INTERVALS = ["month", "quarter", "year"]
+
+# Report params accepted by the API, besides data_sources
+REPORT_PARAMS = ["indices", "start_date", "end_date", "interval", "name", "format"]
+
+
+def get_report_dates(start_date, end_date):
+    """
+    Get the UTC dates of a report as the command line does: the end date is
+    not included, and it is today if it is 'now'
+
+    :param start_date: start date string
+    :param end_date: end date string or 'now'
+    :returns: a tuple with the start and end datetimes
+    """
+
+    if end_date == 'now':
+        end_date = date.today().strftime('%Y-%m-%d')
+    end = parser.parse(end_date).replace(tzinfo=timezone.utc)
+    end += timedelta(microseconds=-1)
+    start = parser.parse(start_date).replace(tzinfo=timezone.utc)
+    return start, end
+
+
+def check_spec(spec):
+    """
+    Check the params of a report submitted, adding the default values
+
+    :param spec: dict with the params of the report
+    :returns: the params of the report with the default values
+    :raises ValueError: if the params are not valid
+    """
+
+    from manuscripts2.report import Report
+
+    if not isinstance(spec, dict):
+        raise ValueError("The report must be a JSON object")
+    unknown = set(spec) - set(REPORT_PARAMS + ["data_sources"])
+    if unknown:
+        raise ValueError("Unknown params: " + ", ".join(sorted(unknown)))
+
+    spec = dict({"indices": [], "start_date": None, "end_date": "now",
+                 "interval": "month", "name": "UnnamedReport", "format": "pdf"}, **spec)
+
+    data_sources = spec.get("data_sources")
+    if not data_sources or not isinstance(data_sources, list):
+        raise ValueError("data_sources must be a list of data sources")
+    unsupported = [ds for ds in data_sources if ds not in Report.ds2class]
+    if unsupported:
+        raise ValueError("Data sources not supported: " + ", ".join(map(str, unsupported)))
+    if spec["indices"] and len(spec["indices"]) != len(data_sources):
+        raise ValueError("Number of indices do not match the number of data sources")
+    if spec["interval"] not in INTERVALS:
+        raise ValueError("Interval not supported: " + str(spec["interval"]))
+    if spec["format"] not in Report.IMAGE_TYPES:
+        raise ValueError("Output format not supported: " + str(spec["format"]))
+    try:
+        get_report_dates(spec["start_date"] or "2000-01-01", spec["end_date"])
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("Wrong start_date or end_date")
+
+    return spec
+
+
+def init_worker(cache_ttl=CACHE_TTL):
+    """
+    Set up a worker process: the search responses are cached and the
+    modules used by the reports are loaded once
+
+    :param cache_ttl: seconds the search responses are cached, not cached if 0
+    """
+
+    if cache_ttl:
+        cache_searches(cache_ttl)
+
+    from manuscripts2.report import get_pyplot
+
+    get_pyplot()
+
+
+def run_report(es_url, data_dir, spec, latex_timeout=None):
+    """
+    Generate a report in a worker process
+
+    :param es_url: Elasticsearch URL
+    :param data_dir: directory in which to generate the report
+    :param spec: dict with the params of the report, checked by check_spec
+    :param latex_timeout: max number of seconds for each pdflatex pass
+    """
+
+    from manuscripts2.report import Report
+
+    os.makedirs(data_dir, exist_ok=True)
+    start_date = spec["start_date"]
+    if not start_date:
+        # The first date of the indices, as the command line does
+        from manuscripts.esquery import get_start_date
+
+        start_date = get_start_date(es_url, spec["indices"] or spec["data_sources"])
+    start, end = get_report_dates(start_date, spec["end_date"])
+    report = Report(es_url=es_url, start=start, end=end, data_dir=data_dir,
+                    interval=spec["interval"], data_sources=spec["data_sources"],
+                    report_name=spec["name"].replace("_", r"\_"), indices=spec["indices"],
+                    latex_timeout=latex_timeout, output_format=spec["format"])
+    report.create()
+
+
+def get_artifacts(data_dir, output_format):
+    """
+    Get the files generated for a report
+
+    :param data_dir: directory of the report
+    :param output_format: format of the report: 'pdf' or 'html'
+    :returns: a dict with the path of the report and the ones of its data files,
+              relative to the report directory
+    """
+
+    report_file = "report." + output_format
+    data_files = []
+    for root, _, files in os.walk(data_dir):
+        for name in files:
+            if name.endswith(".csv"):
+                data_files.append(os.path.relpath(os.path.join(root, name), data_dir))
+    return {
+        "report": report_file if os.path.exists(os.path.join(data_dir, report_file)) else None,
+        "data": sorted(data_files)
+    }
+
+
+class ReportService():
+    """Queue of reports generated by an executor
+
+    :param es_url: Elasticsearch URL with the enriched indices
+    :param output_dir: directory in which a directory is created for each report
+    :param executor: concurrent.futures executor running the reports
+    :param queue_size: max number of reports waiting to be run
+    :param latex_timeout: max number of seconds for each pdflatex pass
+    :param run: function generating a report, with the params of run_report
+    :param max_reports: max number of finished reports whose status is kept
+    """
+
+    def __init__(self, es_url, output_dir, executor, queue_size=QUEUE_SIZE,
+                 latex_timeout=None, run=run_report, max_reports=MAX_REPORTS):
+        self.es_url = es_url
+        self.output_dir = output_dir
+        self.executor = executor
+        self.queue_size = queue_size
+        self.max_reports = max_reports
+        self.latex_timeout = latex_timeout
+        self.run = run
+        self.reports = {}
+        self._lock = threading.Lock()
+
+    def submit(self, spec):
+        """
+        Add a report to the queue
+
+        :param spec: dict with the params of the report
+        :returns: the id of the report, or None if the queue is full
+        :raises ValueError: if the params are not valid
+        """
+
+        spec = check_spec(spec)
+        with self._lock:
+            waiting = sum(1 for report in self.reports.values()
+                          if not (report["future"].running() or report["future"].done()))
+            if waiting >= self.queue_size:
+                return None
+
+            report_id = uuid.uuid4().hex
+            data_dir = os.path.join(self.output_dir, report_id)
+            future = self.executor.submit(self.run, self.es_url, data_dir, spec,
+                                          self.latex_timeout)
+            self.reports[report_id] = {"spec": spec, "data_dir": data_dir, "future": future}
+            self._evict()
+
+        logger.info("Report %s submitted: %s", report_id, spec)
+        return report_id
+
+    def _evict(self):
+        """Forget the oldest finished reports beyond max_reports"""
+
+        finished = [report_id for report_id, report in self.reports.items()
+                    if report["future"].done()]
+        for report_id in finished[:max(len(finished) - self.max_reports, 0)]:
+            logger.debug("Report %s evicted", report_id)
+            del self.reports[report_id]
+
+    def status(self, report_id):
+        """
+        Get the status of a report
+
+        :param report_id: id of the report
+        :returns: a dict with the status of the report, or None if it is unknown
+        """
+
+        report = self.reports.get(report_id)
+        if not report:
+            return None
+
+        future = report["future"]
+        status = {"id": report_id, "params": report["spec"]}
+        if not future.done():
+            status["status"] = "running" if future.running() else "queued"
+        elif future.exception():
+            status["status"] = "failed"
+            status["error"] = repr(future.exception())
+        else:
+            status["status"] = "done"
+            status["artifacts"] = get_artifacts(report["data_dir"], report["spec"]["format"])
+        return status
+
+    def get_file(self, report_id, path):
+        """
+        Get the full path of a file of a report
+
+        :param report_id: id of the report
+        :param path: path of the file in the report directory
+        :returns: the full path, or None if it is not a file of the report
+        """
+
+        report = self.reports.get(report_id)
+        if not report:
+            return None
+
+        data_dir = os.path.realpath(report["data_dir"])
+        file_path = os.path.realpath(os.path.join(data_dir, path))
+        if not file_path.startswith(data_dir + os.sep) or not os.path.isfile(file_path):
+            return None
+        return file_path
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Handler of the requests to the report service API"""
+
+    # ReportService answering the requests, set by the server
+    service = None
+
+    def send_json(self, code, data):
+        content = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_json(self, code, message):
+        self.send_json(code, {"error": message})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/reports":
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = json.loads(self.rfile.read(length).decode("utf-8"))
+            report_id = self.service.submit(spec)
+        except ValueError as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        if not report_id:
+            self.send_error_json(HTTPStatus.SERVICE_UNAVAILABLE, "Queue full, try again later")
+            return
+        self.send_json(HTTPStatus.ACCEPTED, self.service.status(report_id))
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/", 3)
+
+        if parts == ["reports"]:
+            self.send_json(HTTPStatus.OK, [self.service.status(report_id)
+                                           for report_id in list(self.service.reports)])
+            return
+        if parts[0] != "reports":
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+
+        if len(parts) == 2:
+            status = self.service.status(parts[1])
+            if not status:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "Report not found")
+                return
+            self.send_json(HTTPStatus.OK, status)
+        elif len(parts) == 4 and parts[2] == "files":
+            file_path = self.service.get_file(parts[1], parts[3])
+            if not file_path:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "File not found")
+                return
+            content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.path.getsize(file_path)))
+            self.end_headers()
+            with open(file_path, "rb") as f:
+                self.wfile.write(f.read())
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def create_server(service, host=HOST, port=PORT):
+    """
+    Create the HTTP server of the report service API
+
+    :param service: ReportService answering the requests
+    :param host: address to listen on
+    :param port: port to listen on, any free one if 0
+    :returns: a ThreadingHTTPServer
+    """
+
+    handler = type("Handler", (ReportRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(es_url, output_dir, host=HOST, port=PORT, workers=None, queue_size=QUEUE_SIZE,
+          cache_ttl=CACHE_TTL, latex_timeout=None, max_reports=MAX_REPORTS):
+    """
+    Run the report service until it is interrupted
+
+    :param es_url: Elasticsearch URL with the enriched indices
+    :param output_dir: directory in which a directory is created for each report
+    :param host: address to listen on
+    :param port: port to listen on
+    :param workers: number of reports generated at the same time (default: number of CPUs)
+    :param queue_size: max number of reports waiting to be run
+    :param cache_ttl: seconds the search responses are cached by each worker, not cached if 0
+    :param latex_timeout: max number of seconds for each pdflatex pass
+    :param max_reports: max number of finished reports whose status is kept
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache_ttl,)) as executor:
+        service = ReportService(es_url, output_dir, executor, queue_size, latex_timeout,
+                                max_reports=max_reports)
+        server = create_server(service, host, port)
+        logger.info("Report service listening on http://%s:%i", *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Columnar snapshots of the enriched indices, so reports can be generated
+offline with the memory engine (manuscripts.memory_engine) instead of
+querying the cluster.
+
+Only the fields used by the metrics are copied. They are streamed from
+Elasticsearch in batches and written to a compressed Parquet file per
+index, named after the index, with the types of the index mappings.
+Parquet files are written with pyarrow, which is only needed to create
+and read snapshots.
+"""
+
+import logging
+import os
+
+import pandas as pd
+
+from manuscripts.clients import es_client
+from manuscripts.memory_engine import parse_dates
+
+logger = logging.getLogger(__name__)
+
+# Fields used by the metrics of each data source
+SNAPSHOT_FIELDS = {
+    "git": ["grimoire_creation_date", "hash", "author_uuid", "author_name",
+            "author_org_name", "project"],
+    "github_issues": ["grimoire_creation_date", "created_at", "closed_at", "updated_at",
+                      "id", "state", "pull_request", "time_to_close_days", "author_uuid",
+                      "author_name", "author_org_name", "project"],
+    "github_prs": ["grimoire_creation_date", "created_at", "closed_at", "updated_at",
+                   "id", "state", "pull_request", "time_to_close_days", "author_uuid",
+                   "author_name", "author_org_name", "project"]
+}
+
+BATCH_SIZE = 10000
+COMPRESSION = "zstd"
+
+
+def get_pyarrow():
+    """Import pyarrow, needed to write the snapshots"""
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is needed to create snapshots: pip install pyarrow")
+    return pyarrow
+
+
+def get_mapping_properties(es, index):
+    """
+    Get the mappings of the fields of an index
+
+    :param es: Elasticsearch client
+    :param index: name of the index
+    :returns: a dict with the mapping of each field
+    """
+
+    properties = {}
+    for index_mappings in es.indices.get_mapping(index=index).values():
+        mappings = index_mappings.get("mappings", {})
+        if "properties" not in mappings:
+            # Mappings with a type name (Elasticsearch 6)
+            mappings = next(iter(mappings.values()), {})
+        properties.update(mappings.get("properties", {}))
+    return properties
+
+
+def get_field_types(properties, fields):
+    """
+    Get the types of some fields from the mappings of an index
+
+    :param properties: dict with the mapping of each field
+    :param fields: list of fields
+    :returns: a dict with the mapping type of each field, keyword for the
+              fields not found in the mappings
+    """
+
+    return {field: properties.get(field, {}).get("type", "keyword") for field in fields}
+
+
+def arrow_schema(field_types):
+    """
+    Build the schema of a snapshot from the mapping types of its fields
+
+    :param field_types: dict with the mapping type of each field
+    :returns: a pyarrow Schema, with the ids of the items in the _id column
+    """
+
+    pa = get_pyarrow()
+
+    types = {
+        "date": pa.timestamp("ms", tz="UTC"),
+        "float": pa.float32(),
+        "half_float": pa.float32(),
+        "double": pa.float64(),
+        "scaled_float": pa.float64(),
+        "long": pa.int64(),
+        "integer": pa.int32(),
+        "short": pa.int16(),
+        "byte": pa.int8(),
+        "boolean": pa.bool_()
+    }
+    columns = [pa.field("_id", pa.string())]
+    columns.extend(pa.field(field, types.get(field_type, pa.string()))
+                   for field, field_type in field_types.items())
+    return pa.schema(columns)
+
+
+def batch_table(hits, schema, field_types):
+    """
+    Convert a batch of hits to a table with the schema of the snapshot
+
+    :param hits: list of hits from Elasticsearch
+    :param schema: pyarrow Schema of the snapshot
+    :param field_types: dict with the mapping type of each field
+    :returns: a pyarrow Table
+    """
+
+    pa = get_pyarrow()
+
+    df = pd.DataFrame.from_records([hit.get("_source", {}) for hit in hits],
+                                   columns=list(field_types))
+    df.insert(0, "_id", [hit["_id"] for hit in hits])
+    for field, field_type in field_types.items():
+        if field_type == "date":
+            df[field] = parse_dates(df[field])
+        elif schema.field(field).type == pa.string():
+            df[field] = df[field].map(str, na_action='ignore').astype(object)
+
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+
+
+def write_snapshot(hits, filename, field_types, batch_size=BATCH_SIZE, compression=COMPRESSION):
+    """
+    Write some fields of the items of an index to a Parquet file, a batch
+    of items at a time
+
+    :param hits: iterable with the hits of the items
+    :param filename: Parquet file to be written
+    :param field_types: dict with the mapping type of each field to be written
+    :param batch_size: number of items written at once
+    :param compression: Parquet compression codec
+    :returns: the number of items written
+    """
+
+    pa = get_pyarrow()
+    schema = arrow_schema(field_types)
+
+    nitems = 0
+    tmp_filename = filename + ".tmp"
+    with pa.parquet.ParquetWriter(tmp_filename, schema, compression=compression) as writer:
+        batch = []
+        for hit in hits:
+            batch.append(hit)
+            if len(batch) >= batch_size:
+                writer.write_table(batch_table(batch, schema, field_types))
+                nitems += len(batch)
+                batch = []
+        if batch or not nitems:
+            writer.write_table(batch_table(batch, schema, field_types))
+            nitems += len(batch)
+
+    # The snapshot is replaced only once it is complete
+    os.replace(tmp_filename, filename)
+    return nitems
+
+
+def snapshot_index(es, index, filename, fields, batch_size=BATCH_SIZE, compression=COMPRESSION):
+    """
+    Stream some fields of all the items of an index to a Parquet file
+
+    :param es: Elasticsearch client
+    :param index: name of the index
+    :param filename: Parquet file to be written
+    :param fields: list of fields to be copied
+    :param batch_size: number of items fetched and written at once
+    :param compression: Parquet compression codec
+    :returns: the number of items written
+    """
+
+    from elasticsearch import helpers
+
+    field_types = get_field_types(get_mapping_properties(es, index), fields)
+    query = {"query": {"match_all": {}}, "_source": fields}
+    hits = helpers.scan(es, index=index, query=query, size=batch_size)
+
+    nitems = write_snapshot(hits, filename, field_types, batch_size, compression)
+    logger.info("%i items of %s written to %s", nitems, index, filename)
+    return nitems
+
+
+def create_snapshot(es_url, data_sources, output_dir, indices=None, fields=None,
+                    batch_size=BATCH_SIZE, compression=COMPRESSION):
+    """
+    Create a snapshot of the indices of some data sources
+
+    :param es_url: Elasticsearch URL
+    :param data_sources: list of data sources (git, github_issues, github_prs)
+    :param output_dir: directory in which to write the Parquet files
+    :param indices: list with the index of each data source, the data source
+                    name is used as index if None
+    :param fields: list of fields to be copied besides the ones used by the metrics
+    :param batch_size: number of items fetched and written at once
+    :param compression: Parquet compression codec
+    :returns: a list with the files written
+    """
+
+    indices = indices or data_sources
+    if len(indices) != len(data_sources):
+        raise RuntimeError("Number of indices do not match the number of data sources")
+
+    os.makedirs(output_dir, exist_ok=True)
+    es = es_client(es_url)
+
+    filenames = []
+    for data_source, index in zip(data_sources, indices):
+        if data_source not in SNAPSHOT_FIELDS:
+            raise RuntimeError("Data source not supported in snapshots", data_source)
+        ds_fields = SNAPSHOT_FIELDS[data_source] + [f for f in fields or []
+                                                    if f not in SNAPSHOT_FIELDS[data_source]]
+        filename = os.path.join(output_dir, index + ".parquet")
+        snapshot_index(es, index, filename, ds_fields, batch_size, compression)
+        filenames.append(filename)
+
+    return filenames
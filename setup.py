@@ -75,14 +75,19 @@ setup(name="manuscripts",
           'manuscripts2.metrics'
       ],
       package_data={'': template_files},
+      python_requires='>=3.7',
       # package_data={'': ['latex_template/report.tex']},
       install_requires=[
           'matplotlib==2.0.2',
           'prettyplotlib',
           'elasticsearch-dsl',
+          'pandas>=1.0',
           'grimoire-elk>=0.30.4',
           'sortinghat>=0.4.2'
       ],
+      extras_require={
+          'snapshot': ['pyarrow']
+      },
       scripts=[
           'bin/manuscripts',
           'bin/manuscripts2'
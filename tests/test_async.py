@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import sys
+import unittest
+
+from datetime import datetime
+
+from numpy.testing import assert_array_equal
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import ThreadedAsyncClient, async_es_client, reset_clients
+from manuscripts.memory_engine import MemoryClient, use_memory_engine
+from manuscripts.profiler import profiler
+from manuscripts2.elasticsearch import AsyncIndex, Index, Query, gather_metrics
+from manuscripts2.metrics import git, github_prs
+from manuscripts2.report import Report
+from utils import AsyncCountingClient
+
+GIT_DUMP = "data/indices/git_commit.json"
+GIT_MAPPINGS = "data/mappings/git_commit_mappings.json"
+PRS_DUMP = "data/indices/github_prs.json"
+PRS_MAPPINGS = "data/mappings/github_prs_mappings.json"
+
+
+class ProfiledClient():
+    """Async client answering the searches profiled by Elasticsearch with an empty profile"""
+
+    def __init__(self, client):
+        self.client = client
+        self.profiled = []
+
+    async def search(self, index=None, body=None, **params):
+        if not body.get("profile"):
+            return self.client.search(index=index, body=body, **params)
+        self.profiled.append(index)
+        return {"took": 1, "profile": {"shards": []}}
+
+
+class TestAsync(unittest.TestCase):
+    """Tests for the asyncio queries of manuscripts2 metrics"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = MemoryClient()
+        cls.client.load(GIT_DUMP, "git_enrich")
+        cls.client.load_mappings("git_enrich", GIT_MAPPINGS)
+        cls.client.load(PRS_DUMP, "github_prs_enrich")
+        cls.client.load_mappings("github_prs_enrich", PRS_MAPPINGS)
+
+    def setUp(self):
+        Query.interval_ = "month"
+        self.start = datetime(2015, 1, 1)
+        self.end = datetime(2018, 7, 10)
+
+    def tearDown(self):
+        Index.es = None
+        AsyncIndex.es = None
+        reset_clients()
+
+    def test_metrics(self):
+        """Test whether the async methods of the metrics get the same values as the sync ones"""
+
+        index = Index(index_name="git_enrich", es=self.client)
+        prs_index = Index(index_name="github_prs_enrich", es=self.client)
+        async_client = ThreadedAsyncClient(self.client)
+        async_index = AsyncIndex(index_name="git_enrich", es=async_client)
+        async_prs_index = AsyncIndex(index_name="github_prs_enrich", es=async_client)
+
+        async def compute():
+            return await gather_metrics([
+                git.Commits(async_index, self.start, self.end).atimeseries(dataframe=True),
+                git.Authors(async_index, self.start, self.end).aaggregations(),
+                github_prs.DaysToClosePRMedian(async_prs_index, self.start, self.end).atimeseries(dataframe=True),
+                github_prs.BMIPR(async_prs_index, self.start, self.end).aaggregations()
+            ])
+
+        commits, authors, median, bmi = asyncio.run(compute())
+
+        expected = git.Commits(index, self.start, self.end).timeseries(dataframe=True)
+        assert_array_equal(commits['value'], expected['value'])
+        assert_array_equal(commits.index, expected.index)
+        expected = git.Authors(index, self.start, self.end).aggregations()
+        assert_array_equal(authors['keys'], expected['keys'])
+        assert_array_equal(authors['values'], expected['values'])
+        expected = github_prs.DaysToClosePRMedian(prs_index, self.start, self.end).timeseries(dataframe=True)
+        assert_array_equal(median['value'], expected['value'])
+        expected = github_prs.BMIPR(prs_index, self.start, self.end).aggregations()
+        self.assertEqual(bmi, expected)
+
+    def test_concurrency(self):
+        """Test whether no more searches than the concurrency given are sent at once"""
+
+        client = AsyncCountingClient(self.client)
+        index = AsyncIndex(index_name="git_enrich", es=client)
+        metrics = [git.Commits(index, self.start, self.end) for _ in range(6)]
+
+        values = asyncio.run(gather_metrics([metric.aaggregations() for metric in metrics], concurrency=2))
+        self.assertEqual(client.max_running, 2)
+        self.assertEqual(len(set(values)), 1)
+
+        # BMI sends its two searches at the same time, within the same limit
+        client = AsyncCountingClient(self.client)
+        prs_index = AsyncIndex(index_name="github_prs_enrich", es=client)
+        metrics = [github_prs.BMIPR(prs_index, self.start, self.end) for _ in range(3)]
+        asyncio.run(gather_metrics([metric.aaggregations() for metric in metrics], concurrency=1))
+        self.assertEqual(client.max_running, 1)
+
+    def test_es_profile(self):
+        """Test whether the async searches are profiled by Elasticsearch as the sync ones"""
+
+        client = ProfiledClient(self.client)
+        index = AsyncIndex(index_name="git_enrich", es=client)
+        profiler.es_profile = ["commits"]
+        try:
+            asyncio.run(gather_metrics([git.Commits(index, self.start, self.end).aaggregations(),
+                                        git.Authors(index, self.start, self.end).aaggregations()]))
+            self.assertListEqual(client.profiled, ["git_enrich"])
+            self.assertEqual(profiler.es_profiles[-1]["metric"], "commits")
+        finally:
+            profiler.es_profile = None
+            profiler.reset()
+
+    def test_report(self):
+        """Test whether a report with a concurrency computes its metrics with async queries"""
+
+        use_memory_engine(["git_enrich=" + GIT_DUMP], ["git_enrich=" + GIT_MAPPINGS])
+        self.assertIsInstance(async_es_client(), ThreadedAsyncClient)
+
+        report = Report(start=self.start, end=self.end, data_dir=".", data_sources=["git"],
+                        indices=["git_enrich"], concurrency=2)
+        metrics = git.project_activity(report.get_metric_index("git"), self.start, self.end)['metrics']
+        self.assertIsInstance(metrics[0].query.index, AsyncIndex)
+        values = report.get_values(metrics, "timeseries", dataframe=True)
+        report.close()
+
+        report = Report(start=self.start, end=self.end, data_dir=".", data_sources=["git"],
+                        indices=["git_enrich"])
+        metrics = git.project_activity(report.get_metric_index("git"), self.start, self.end)['metrics']
+        expected = report.get_values(metrics, "timeseries", dataframe=True)
+        for value, expected_value in zip(values, expected):
+            assert_array_equal(value['value'], expected_value['value'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import unittest
+
+from datetime import datetime, timedelta, timezone
+
+from pandas.testing import assert_frame_equal
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.backfill import BackfillClient, get_end_dates
+from manuscripts.memory_engine import MemoryClient
+from manuscripts2.elasticsearch import Index, Query
+from manuscripts2.metrics import git
+from utils import CountingClient
+
+GIT_DUMP = "data/indices/git_commit.json"
+
+
+class TestBackfill(unittest.TestCase):
+    """Tests for the backfill of reports"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.memory_client = MemoryClient()
+        cls.memory_client.load(GIT_DUMP, "git_enrich")
+
+    def setUp(self):
+        Query.interval_ = "quarter"
+        self.start = datetime(2015, 1, 1)
+
+    def timeseries(self, client, metric, end):
+        index = Index(index_name="git_enrich", es=client)
+        return metric(index, self.start, end).timeseries(dataframe=True)
+
+    def test_get_end_dates(self):
+        """Test whether the reports end at each interval"""
+
+        ends = get_end_dates(datetime(2017, 1, 1), datetime(2018, 7, 1), "quarter")
+        self.assertEqual(len(ends), 7)
+        self.assertEqual(ends[1], datetime(2017, 4, 1))
+        self.assertEqual(ends[-1], datetime(2018, 7, 1))
+
+        ends = get_end_dates(datetime(2017, 1, 31), datetime(2017, 4, 15), "month")
+        self.assertListEqual(ends, [datetime(2017, 1, 31), datetime(2017, 2, 28),
+                                    datetime(2017, 3, 31), datetime(2017, 4, 15)])
+
+    def test_backfill(self):
+        """Test whether the time series of shorter periods are taken from longer ones"""
+
+        counter = CountingClient(self.memory_client)
+        backfill = BackfillClient(counter)
+        ends = [datetime(2018, 7, 1, tzinfo=timezone.utc), datetime(2017, 1, 1, tzinfo=timezone.utc)]
+        for metric in [git.Commits, git.Authors]:
+            for end in ends:
+                end += timedelta(microseconds=-1)
+                series = self.timeseries(backfill, metric, end)
+                assert_frame_equal(series, self.timeseries(self.memory_client, metric, end))
+        self.assertEqual(len(counter.bodies), 2)
+
+        # Periods not ending at the start of an interval are queried
+        end = datetime(2016, 11, 15, tzinfo=timezone.utc)
+        series = self.timeseries(backfill, git.Commits, end)
+        assert_frame_equal(series, self.timeseries(self.memory_client, git.Commits, end))
+        self.assertEqual(len(counter.bodies), 3)
+
+        # Other searches are only sent once
+        index = Index(index_name="git_enrich", es=backfill)
+        for _ in range(2):
+            value = git.Commits(index, datetime(2018, 4, 1), datetime(2018, 7, 1)).aggregations()
+        self.assertEqual(value, git.Commits(Index(index_name="git_enrich", es=self.memory_client),
+                                            datetime(2018, 4, 1), datetime(2018, 7, 1)).aggregations())
+        self.assertEqual(len(counter.bodies), 4)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
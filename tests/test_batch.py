@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+import manuscripts.batch
+
+from manuscripts.batch import (PDF_STEP, BatchState, checkpoint, create_report,
+                               read_batch, run_batch, run_steps)
+from manuscripts.metrics.metrics import Metrics
+
+SECTIONS = ["Overview", "Communication Channels", "Detailed Activity by Project"]
+
+
+def fake_run(report_id, spec, end_date, done):
+    """Do the steps of a report, failing once in the section given in the report"""
+
+    with open(os.path.join(spec["data_dir"], "runs.json"), "a") as f:
+        f.write(json.dumps(done) + "\n")
+    for step in SECTIONS + [PDF_STEP]:
+        if step in done:
+            continue
+        fail_file = os.path.join(spec["data_dir"], "failed")
+        if step == spec.get("fail") and not os.path.exists(fail_file):
+            open(fail_file, "w").close()
+            raise RuntimeError("Search failed")
+        checkpoint(report_id, step)
+
+
+class FakeReport():
+    """Report with sections keeping the order in which they are built"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.projects = True
+        self.project_names = []
+        self.built = []
+
+    def sections(self):
+        secs = OrderedDict()
+        for section in SECTIONS:
+            secs[section] = lambda section=section: self.built.append(section)
+        return secs
+
+    def create_pdf(self):
+        self.built.append(PDF_STEP)
+
+
+class TestBatch(unittest.TestCase):
+    """Tests for the resumable batch runner"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.state_file = os.path.join(self.tmp_path, "batch.state")
+
+    def tearDown(self):
+        manuscripts.batch._progress = None
+        Metrics.filters_core = {}
+        Metrics.offset = None
+        shutil.rmtree(self.tmp_path)
+
+    def spec(self, name, **params):
+        data_dir = os.path.join(self.tmp_path, name)
+        os.makedirs(data_dir)
+        return dict({"id": name, "data_dir": data_dir, "data_sources": ["git"],
+                     "end_date": "2018-07-01"}, **params)
+
+    def read_runs(self, spec):
+        with open(os.path.join(spec["data_dir"], "runs.json")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_read_batch(self):
+        """Test whether the reports of a batch file get their ids"""
+
+        batch_file = os.path.join(self.tmp_path, "batch.json")
+        with open(batch_file, "w") as f:
+            json.dump([{"data_dir": "a", "data_sources": ["git"]},
+                       {"id": "b", "data_dir": "a", "data_sources": ["git"]}], f)
+        self.assertListEqual([spec["id"] for spec in read_batch(batch_file)], ["a", "b"])
+
+        with open(batch_file, "w") as f:
+            json.dump([{"data_dir": "a", "data_sources": ["git"]},
+                       {"data_dir": "a", "data_sources": ["mls"]}], f)
+        with self.assertRaises(RuntimeError):
+            read_batch(batch_file)
+
+    def test_resume(self):
+        """Test whether a failed batch resumes in the step which failed"""
+
+        specs = [self.spec("ok"), self.spec("failing", fail="Communication Channels")]
+
+        failed = run_batch(specs, self.state_file, workers=2, run=fake_run)
+        self.assertListEqual(failed, ["failing"])
+        state = BatchState(self.state_file)
+        self.assertEqual(state.reports["ok"]["status"], "done")
+        self.assertListEqual(state.reports["ok"]["steps"], SECTIONS + [PDF_STEP])
+        self.assertEqual(state.reports["failing"]["status"], "failed")
+        self.assertIn("Search failed", state.reports["failing"]["error"])
+        self.assertListEqual(state.reports["failing"]["steps"], ["Overview"])
+
+        self.assertListEqual(run_batch(specs, self.state_file, run=fake_run), [])
+        state = BatchState(self.state_file)
+        self.assertEqual(state.reports["failing"]["status"], "done")
+        self.assertListEqual(state.reports["failing"]["steps"], SECTIONS + [PDF_STEP])
+
+        # The done report is not run again, the failed one resumes
+        self.assertListEqual(self.read_runs(specs[0]), [[]])
+        self.assertListEqual(self.read_runs(specs[1]), [[], ["Overview"]])
+
+    def test_params_changed(self):
+        """Test whether a report is started again if its params changed"""
+
+        spec = self.spec("report", end_date="now")
+        run_batch([spec], self.state_file, run=fake_run)
+        end_date = BatchState(self.state_file).reports["report"]["end_date"]
+        self.assertNotEqual(end_date, "now")
+
+        state = BatchState(self.state_file)
+        self.assertIs(state.start(dict(spec)), state.reports["report"])
+        report = state.start(dict(spec, interval="quarter"))
+        self.assertEqual(report["status"], "pending")
+        self.assertListEqual(report["steps"], [])
+
+    def test_create_report(self):
+        """Test whether a report does not get the filters and offset of the previous one"""
+
+        spec = self.spec("filtered", start_date="2015-01-01", elastic_url="http://localhost:9200",
+                         filters=["author_org_name:Acme"], offset="+3d")
+        create_report(spec, "2018-07-01")
+        self.assertDictEqual(Metrics.filters_core, {"author_org_name": "Acme"})
+        self.assertEqual(Metrics.offset, "+3d")
+
+        spec = self.spec("unfiltered", start_date="2015-01-01", elastic_url="http://localhost:9200")
+        create_report(spec, "2018-07-01")
+        self.assertDictEqual(Metrics.filters_core, {})
+        self.assertIsNone(Metrics.offset)
+
+    def test_run_steps(self):
+        """Test whether only the steps not done are run"""
+
+        manuscripts.batch._progress = queue.Queue()
+        with open(os.path.join(self.tmp_path, "projects.txt"), "w") as f:
+            f.write("grimoirelab/perceval\nmanuscripts")
+
+        report = FakeReport(self.tmp_path)
+        run_steps(report, "report", ["Overview", "Detailed Activity by Project"])
+        self.assertListEqual(report.built, ["Communication Channels", PDF_STEP])
+        self.assertListEqual(report.project_names, ["grimoirelab_perceval", "manuscripts"])
+        self.assertEqual(manuscripts.batch._progress.get(), ("report", "Communication Channels"))
+        self.assertEqual(manuscripts.batch._progress.get(), ("report", PDF_STEP))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import time
+import subprocess
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Max number of seconds to show the help of a command line tool
+STARTUP_BUDGET = 1.0
+
+# Modules which must not be loaded just to parse the params
+HEAVY_MODULES = ["matplotlib", "pandas", "numpy", "prettyplotlib",
+                 "elasticsearch", "elasticsearch_dsl", "grimoire_elk"]
+
+LOADED_MODULES_SCRIPT = """
+import runpy, sys
+sys.argv = [sys.argv[1], '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write(','.join(m for m in {} if m in sys.modules))
+""".format(HEAVY_MODULES)
+
+
+class TestCLI(unittest.TestCase):
+    """Startup tests for the command line tools"""
+
+    def run_command(self, *args):
+        return subprocess.run([sys.executable] + list(args), cwd=ROOT_DIR,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_help_startup_time(self):
+        """Test whether the help is shown within the startup budget"""
+
+        for command in ["bin/manuscripts", "bin/manuscripts2"]:
+            # Warm up the file system cache
+            self.run_command(command, "--help")
+
+            start = time.perf_counter()
+            res = self.run_command(command, "--help")
+            elapsed = time.perf_counter() - start
+
+            self.assertEqual(res.returncode, 0)
+            self.assertIn(b"usage:", res.stdout)
+            self.assertLess(elapsed, STARTUP_BUDGET,
+                            "{} --help took {:.2f}s".format(command, elapsed))
+
+    def test_help_no_heavy_imports(self):
+        """Test whether the report modules are not loaded to show the help"""
+
+        for command in ["bin/manuscripts", "bin/manuscripts2"]:
+            res = self.run_command("-c", LOADED_MODULES_SCRIPT, command)
+            self.assertEqual(res.stderr.decode('utf-8'), "")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from elasticsearch.exceptions import ConnectionError, NotFoundError, TransportError
+
+from manuscripts.clients import (AdaptiveLimit, CacheFriendlyClient, CachingClient,
+                                 CircuitBreaker, ReplayClient, RecordingClient,
+                                 RetryingClient, Throttle, ThrottlingClient,
+                                 add_client_wrapper, es_client, replay_searches,
+                                 request_cache_stats, reset_clients, round_bounds,
+                                 save_records)
+from manuscripts.metrics import git
+from manuscripts.profiler import Profiler, profiler
+
+TS_RESPONSE = {
+    "took": 2,
+    "timed_out": False,
+    "hits": {"total": 3, "max_score": 0, "hits": []},
+    "aggregations": {
+        "1": {
+            "buckets": [
+                {"key_as_string": "2018-01-01T00:00:00.000Z", "key": 1514764800000,
+                 "doc_count": 2, "2": {"value": 2}},
+                {"key_as_string": "2018-02-01T00:00:00.000Z", "key": 1517443200000,
+                 "doc_count": 1, "2": {"value": 1}}
+            ]
+        }
+    }
+}
+
+
+class FakeClient():
+    """Client answering all the searches with the same response"""
+
+    def __init__(self):
+        self.searches = 0
+        self.last_search = None
+
+    def search(self, index=None, body=None, **params):
+        self.searches += 1
+        self.last_search = (index, body, params)
+        return TS_RESPONSE
+
+
+class FakeNodes():
+    """Nodes API returning the request cache stats of two nodes"""
+
+    def __init__(self, hits, misses):
+        self.cache = {"hit_count": hits, "miss_count": misses, "evictions": 0}
+
+    def stats(self, metric=None, index_metric=None):
+        return {"nodes": {node: {"indices": {"request_cache": self.cache}} for node in ["n1", "n2"]}}
+
+
+class FailingClient(FakeClient):
+    """Client raising some errors before answering the searches"""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+
+    def search(self, index=None, body=None, **params):
+        if self.errors:
+            self.searches += 1
+            raise self.errors.pop(0)
+        return super().search(index=index, body=body, **params)
+
+
+class TestClients(unittest.TestCase):
+    """Tests for the Elasticsearch client wrappers"""
+
+    def setUp(self):
+        reset_clients()
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.record_file = os.path.join(self.tmp_path, "searches.json")
+
+    def tearDown(self):
+        reset_clients()
+        for file_name in os.listdir(self.tmp_path):
+            os.remove(os.path.join(self.tmp_path, file_name))
+        os.rmdir(self.tmp_path)
+
+    def test_es_client(self):
+        """Test whether clients are shared and wrapped"""
+
+        client = es_client("http://localhost:9200")
+        self.assertIs(es_client("http://localhost:9200"), client)
+
+        fake = FakeClient()
+        add_client_wrapper(lambda client: fake)
+        self.assertIs(es_client("http://localhost:9200"), fake)
+
+    def test_record_replay(self):
+        """Test whether recorded searches are replayed in order"""
+
+        fake = FakeClient()
+        records = []
+        recorder = RecordingClient(fake, records)
+        body = {"query": {"range": {"date": {"gte": datetime(2018, 1, 1)}}}, "size": 0}
+        self.assertEqual(recorder.search(index="git", body=body), TS_RESPONSE)
+        recorder.search(index="git", body={"size": 1}, request_cache=True)
+        save_records(records, self.record_file)
+
+        replay = ReplayClient(self.record_file)
+        self.assertEqual(replay.search(index="git", body=body), TS_RESPONSE)
+        self.assertEqual(replay.search(index=["git"], body={"size": 1}, request_cache=True), TS_RESPONSE)
+        # Replayed searches are answered with the last response
+        self.assertEqual(replay.search(index="git", body=body), TS_RESPONSE)
+
+        with self.assertRaises(RuntimeError):
+            replay.search(index="git", body={"size": 2})
+
+        # The index and node stats are not recorded
+        with self.assertRaises(RuntimeError):
+            replay.indices.stats(index="git")
+        with self.assertRaises(RuntimeError):
+            replay.nodes.stats(metric="indices")
+
+    def test_replay_metric(self):
+        """Test whether a metric is computed from a recorded run without Elasticsearch"""
+
+        fake = FakeClient()
+        records = []
+        add_client_wrapper(lambda client: RecordingClient(fake, records))
+        start = datetime(2018, 1, 1)
+        end = datetime(2018, 3, 1)
+        recorded_ts = git.Commits("http://localhost:9200", "git", start=start, end=end).get_ts()
+        save_records(records, self.record_file)
+
+        reset_clients()
+        replay_searches(self.record_file)
+        ts = git.Commits("http://localhost:9200", "git", start=start, end=end).get_ts()
+
+        self.assertEqual(fake.searches, 1)
+        self.assertDictEqual(ts, recorded_ts)
+        self.assertListEqual(ts['value'], [2, 1])
+
+    def test_cache(self):
+        """Test whether the same searches are answered from the cache"""
+
+        fake = FakeClient()
+        cache = CachingClient(fake, ttl=60, max_searches=2)
+        for _ in range(3):
+            self.assertEqual(cache.search(index="git", body={"size": 0}), TS_RESPONSE)
+        self.assertEqual(fake.searches, 1)
+        self.assertEqual(cache.hits, 2)
+
+        # The least recently used search is dropped
+        cache.search(index="git", body={"size": 1})
+        cache.search(index="git", body={"size": 2})
+        cache.search(index="git", body={"size": 0})
+        self.assertEqual(fake.searches, 4)
+
+        # Responses are not used once expired
+        cache.ttl = 0
+        cache.search(index="git", body={"size": 0})
+        self.assertEqual(fake.searches, 5)
+
+    def test_retries(self):
+        """Test whether searches failed with transient errors are sent again"""
+
+        failing = FailingClient([ConnectionError("N/A", "timeout", None),
+                                 TransportError(503, "unavailable", None)])
+        retrying = RetryingClient(failing, retries=2, backoff=0)
+        self.assertEqual(retrying.search(index="git", body={"size": 0}), TS_RESPONSE)
+        self.assertEqual(failing.searches, 3)
+
+        failing = FailingClient([TransportError(429, "too many requests", None)] * 3)
+        with self.assertRaises(TransportError):
+            RetryingClient(failing, retries=2, backoff=0).search(index="git", body={"size": 0})
+        self.assertEqual(failing.searches, 3)
+
+        # Other errors are not retried
+        failing = FailingClient([NotFoundError(404, "index_not_found_exception", None)])
+        with self.assertRaises(NotFoundError):
+            RetryingClient(failing, retries=2, backoff=0).search(index="git", body={"size": 0})
+        self.assertEqual(failing.searches, 1)
+
+    def test_adaptive_limit(self):
+        """Test whether the searches in flight grow additively and are halved when overloaded"""
+
+        limit = AdaptiveLimit(4, latency=10)
+        for _ in range(6):
+            limit.release(limit.acquire())
+        self.assertEqual(int(limit.limit), 4)
+
+        # All the searches in flight fail, the limit is only halved once
+        started = [limit.acquire() for _ in range(4)]
+        self.assertEqual(limit.release(started[0], overloaded=True), 2)
+        for search_started in started[1:]:
+            self.assertIsNone(limit.release(search_started, overloaded=True))
+        self.assertEqual(int(limit.limit), 2)
+        self.assertEqual(limit.release(limit.acquire(), overloaded=True), 1)
+
+        # Slow searches also decrease the limit
+        limit.latency = -1
+        limit.limit = 4
+        self.assertEqual(limit.release(limit.acquire()), 2)
+
+    def test_throttle(self):
+        """Test whether the circuit breaker pauses the searches instead of failing them"""
+
+        profiler.enabled = True
+        self.addCleanup(profiler.reset)
+        self.addCleanup(setattr, profiler, "enabled", False)
+
+        failing = FailingClient([TransportError(429, "too many requests", None)] * 4)
+        throttle = Throttle(rate=1000, concurrency=2, retries=1, backoff=0,
+                            breaker=CircuitBreaker(failures=2, pause=0.01))
+        # As if some searches were answered in time before
+        throttle.limit.limit = 2
+        client = ThrottlingClient(failing, throttle)
+        self.assertEqual(client.search(index="git", body={"size": 0}), TS_RESPONSE)
+        self.assertEqual(failing.searches, 5)
+        self.assertEqual(throttle.breaker.next_pause, 0.01)
+        self.assertIsNone(throttle.breaker.opened)
+
+        events = [entry["event"] for entry in profiler.to_dict()["throttle"]]
+        self.assertListEqual(events, ["limit_decreased", "retry", "breaker_open",
+                                      "breaker_open", "breaker_open", "breaker_closed"])
+        self.assertIn("1 limit decreases, 1 retries, circuit breaker opened 3 times", profiler.summary())
+
+        # Other errors are not retried
+        failing = FailingClient([NotFoundError(404, "index_not_found_exception", None)])
+        with self.assertRaises(NotFoundError):
+            ThrottlingClient(failing, throttle).search(index="git", body={"size": 0})
+
+    def test_cache_friendly(self):
+        """Test whether searches are sent so they can be cached by Elasticsearch"""
+
+        fake = FakeClient()
+        add_client_wrapper(lambda client: CacheFriendlyClient(fake, "manuscripts-report"))
+        start = datetime(2018, 1, 1, 16, 30)
+        end = datetime(2018, 3, 1) - timedelta(microseconds=1)
+        git.Commits("http://localhost:9200", "git", start=start, end=end).get_ts()
+        index, body, params = fake.last_search
+
+        self.assertEqual(body["size"], 0)
+        self.assertDictEqual(params, {"request_cache": "true", "preference": "manuscripts-report"})
+        bounds = body["query"]["bool"]["filter"][0]["range"]["grimoire_creation_date"]
+        self.assertDictEqual(bounds, {"gte": "2018-01-01T00:00:00", "lt": "2018-03-01T00:00:00"})
+        histogram = body["aggs"][1]["date_histogram"]
+        self.assertDictEqual(histogram["extended_bounds"], {"min": 1514764800000, "max": 1519776000000})
+
+        # Another run of the same day sends the same search
+        end = datetime(2018, 2, 28, 12)
+        git.Commits("http://localhost:9200", "git", start=start, end=end).get_ts()
+        self.assertDictEqual(fake.last_search[1], body)
+
+        # Searches of hits are not changed, besides the preference
+        es_client("http://localhost:9200").search(index="git", body={"size": 10, "aggs": {}})
+        self.assertDictEqual(fake.last_search[2], {"preference": "manuscripts-report"})
+
+    def test_round_bounds(self):
+        """Test whether only the date ranges are extended to whole days"""
+
+        body = {
+            "query": {"bool": {"filter": [
+                {"range": {"grimoire_creation_date": {"gte": "2018-01-01T10:00:00", "lte": "2018-01-31T10:00:00"}}},
+                {"range": {"closed_at": {"gte": "2018-01-01", "lte": "2018-02-01T00:00:00"}}},
+                {"range": {"updated_at": {"gt": "now-1y", "lte": "now"}}},
+                {"range": {"time_to_close_days": {"gte": 5, "lte": 10}}}
+            ]}},
+            "aggs": {"0": {"range": {"field": "time_to_close_days", "ranges": [{"to": 5}, {"from": 5}]}}}
+        }
+        rounded = round_bounds(body)
+        ranges = [clause["range"] for clause in rounded["query"]["bool"]["filter"]]
+        self.assertDictEqual(ranges[0], {"grimoire_creation_date": {"gte": "2018-01-01T00:00:00",
+                                                                    "lt": "2018-02-01T00:00:00"}})
+        self.assertListEqual(ranges[1:], [clause["range"] for clause in body["query"]["bool"]["filter"][1:]])
+        self.assertDictEqual(rounded["aggs"], body["aggs"])
+
+    def test_request_cache_stats(self):
+        """Test whether the request cache hit ratio of a run is recorded"""
+
+        fake = FakeClient()
+        fake.nodes = FakeNodes(10, 5)
+        before = request_cache_stats(fake)
+        self.assertDictEqual(before, {"hit_count": 20, "miss_count": 10})
+        fake.nodes = FakeNodes(16, 6)
+        profiler = Profiler()
+        cache = profiler.record_request_cache(before, request_cache_stats(fake))
+        self.assertDictEqual(cache, {"hits": 12, "misses": 2, "hit_ratio": 12 / 14})
+        self.assertIn("12 hits, 2 misses (hit ratio 85.7%)", profiler.summary())
+        self.assertIs(profiler.to_dict()["request_cache"], cache)
+
+        self.assertIsNone(request_cache_stats(FakeClient()))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
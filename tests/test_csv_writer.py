@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.csv_writer import (CSVWriter, format_value, latex_escape, latex_unescape,
+                                    read_csv, write_csv)
+
+
+class TestCSVWriter(unittest.TestCase):
+    """Tests for the streaming CSV writer"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def read_file(self, file_name):
+        with open(file_name) as f:
+            return f.read()
+
+    def test_latex_escape(self):
+        """Test whether LaTeX special chars are escaped"""
+
+        self.assertEqual(latex_escape("github_prs"), r"github\_prs")
+        self.assertEqual(latex_escape("A & B 100% #1"), r"A \& B 100\% \#1")
+        self.assertEqual(latex_escape("{$x^2~\\}"),
+                         r"\{\$x\textasciicircum{}2\textasciitilde{}\textbackslash{}\}")
+
+    def test_latex_unescape(self):
+        """Test whether the escaping of LaTeX special chars is undone"""
+
+        for value in ["github_prs", "A & B 100% #1", "{$x^2~\\}", r"\textbackslash{}"]:
+            self.assertEqual(latex_unescape(latex_escape(value)), value)
+
+    def test_read_csv(self):
+        """Test whether the fields enclosed in braces or quotes are read"""
+
+        file_name = os.path.join(self.tmp_path, "test.csv")
+        write_csv(file_name, ["name", "commits"], [["Smith, Jones & co", 3], ["{a}", 2]], sep=", ")
+        rows = read_csv(self.read_file(file_name))
+        self.assertListEqual(rows, [["name", "commits"], [r"Smith, Jones \& co", "3"], [r"\{a\}", "2"]])
+
+        rows = read_csv('name,commits\n"Smith, ""Jones""",3\n')
+        self.assertListEqual(rows, [["name", "commits"], ['Smith, "Jones"', "3"]])
+
+    def test_format_value(self):
+        """Test whether metric values are formatted"""
+
+        self.assertEqual(format_value(None), "NA")
+        self.assertEqual(format_value(1.234), "1.23")
+        self.assertEqual(format_value(7), "7")
+
+    def test_writer(self):
+        """Test whether rows are written with the fields escaped"""
+
+        file_name = os.path.join(self.tmp_path, "data", "test.csv")
+        with CSVWriter(file_name, ["metrics_names", "values"]) as writer:
+            writer.writerow(["git_commits", 1.5])
+            writer.writerow(["Smith, Jones & co", None])
+
+        expected = "metricsnames,values\n" \
+                   "git\\_commits,1.50\n" \
+                   "{Smith, Jones \\& co},NA\n"
+        self.assertEqual(self.read_file(file_name), expected)
+
+    def test_write_csv_max_rows(self):
+        """Test whether only max_rows rows are consumed and written"""
+
+        rows = iter([["a", 1], ["b", 2], ["c", 3]])
+        file_name = os.path.join(self.tmp_path, "top.csv")
+        write_csv(file_name, ["authors", "commits"], rows, sep=", ", max_rows=2)
+
+        self.assertEqual(self.read_file(file_name), "authors, commits\na, 1\nb, 2\n")
+        self.assertListEqual(list(rows), [["c", 3]])
+
+    def test_no_escape(self):
+        """Test whether fields can be written as they are"""
+
+        file_name = os.path.join(self.tmp_path, "raw.csv")
+        write_csv(file_name, None, [["a_b", "50%"]], escape=False)
+
+        self.assertEqual(self.read_file(file_name), "a_b,50%\n")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
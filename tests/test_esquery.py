@@ -19,17 +19,29 @@
 #     Pranjal Aswani <aswani.pranjal@gmail.com>
 #
 
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 from datetime import datetime
 from collections import OrderedDict
 
+from elasticsearch import Elasticsearch
+
 # Hack to make sure that tests import the right packages
 # due to setuptools behaviour
 sys.path.insert(0, '..')
 
-from manuscripts.esquery import ElasticQuery
+from manuscripts.clients import (RecordingClient, ReplayClient, RetryingClient, add_client_wrapper,
+                                 reset_clients, save_records)
+from manuscripts.esquery import (ElasticQuery, get_dates_of_indices, get_first_date_of_index,
+                                 get_start_date)
+from manuscripts.memory_engine import MemoryClient
+
+GIT_DUMP = "data/indices/git_commit.json"
+PRS_DUMP = "data/indices/github_prs.json"
 
 
 def sort_order(query):
@@ -424,6 +436,102 @@ class TestEsquery(unittest.TestCase):
                                              offset=None, interval=self.interval), test_agg_dict2)
 
 
+class FakeIndices():
+    """Indices API returning the stats of some indices"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def stats(self, index=None, metric=None):
+        return {"indices": {name: {"uuid": name, "primaries": {"docs": {"count": self.docs, "deleted": 0},
+                                                               "indexing": {"index_total": self.docs}}}
+                            for name in index.split(",")}}
+
+
+class MsearchClient(Elasticsearch):
+    """Elasticsearch client answering the multi searches with the memory engine"""
+
+    def __init__(self, memory_client):
+        super().__init__()
+        self.memory_client = memory_client
+        self.indices = FakeIndices(10)
+        self.msearches = []
+
+    def msearch(self, body=None, **params):
+        self.msearches.append(body)
+        return {"responses": [self.memory_client.search(index=header["index"], body=search)
+                              for header, search in zip(body[::2], body[1::2])]}
+
+
+class TestIndexDates(unittest.TestCase):
+    """Tests for the dates of the indices"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.memory_client = MemoryClient()
+        cls.memory_client.load(GIT_DUMP, "git")
+        cls.memory_client.load(PRS_DUMP, "github_prs")
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.cache_file = os.path.join(self.tmp_path, "index_dates.json")
+
+    def tearDown(self):
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    def test_single_request(self):
+        """Test whether the dates of all the indices are got in one request and cached"""
+
+        client = MsearchClient(self.memory_client)
+        add_client_wrapper(lambda es: client)
+
+        dates = get_dates_of_indices("http://localhost:9200", ["github_prs", "git"], self.cache_file)
+        self.assertEqual(len(client.msearches), 1)
+        self.assertListEqual(sorted(dates), ["git", "github_prs"])
+        self.assertEqual(dates["git"]["min"][:10], "2015-08-18")
+        self.assertNotIn("max", dates["git"])
+        self.assertEqual(get_start_date("http://localhost:9200", ["git", "github_prs"], self.cache_file),
+                         min(dates["git"]["min"], dates["github_prs"]["min"])[:10])
+        self.assertEqual(len(client.msearches), 1)
+
+        # The dates are got again when the indices change
+        client.indices = FakeIndices(11)
+        self.assertEqual(get_dates_of_indices("http://localhost:9200", ["git", "github_prs"],
+                                              self.cache_file), dates)
+        self.assertEqual(len(client.msearches), 2)
+
+    def test_wrapped_msearch(self):
+        """Test whether the multi search is sent through the wrappers forwarding it"""
+
+        client = MsearchClient(self.memory_client)
+        records = []
+        add_client_wrapper(lambda es: client)
+        add_client_wrapper(lambda es: RecordingClient(es, records))
+        add_client_wrapper(lambda es: RetryingClient(es))
+
+        dates = get_dates_of_indices("http://localhost:9200", ["git", "github_prs"])
+        self.assertEqual(len(client.msearches), 1)
+        self.assertEqual(len(records), 2)
+
+        # The searches recorded from the multi search are replayed one by one
+        records_file = os.path.join(self.tmp_path, "records.json")
+        save_records(records, records_file)
+        reset_clients()
+        add_client_wrapper(lambda es: ReplayClient(records_file))
+        self.assertEqual(get_dates_of_indices("http://localhost:9200", ["git", "github_prs"]), dates)
+
+    def test_wrapped_client(self):
+        """Test whether the dates are searched index by index with wrapped clients"""
+
+        add_client_wrapper(lambda es: self.memory_client)
+        self.assertEqual(get_first_date_of_index("http://localhost:9200", "git"), "2015-08-18")
+        self.assertEqual(get_start_date("http://localhost:9200", ["git", "github_prs"], self.cache_file),
+                         min(get_first_date_of_index("http://localhost:9200", "git"),
+                             get_first_date_of_index("http://localhost:9200", "github_prs")))
+        self.assertFalse(os.path.exists(self.cache_file))
+
+
 if __name__ == "__main__":
     # logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s')
     unittest.main(buffer=True, warnings='ignore')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from collections import OrderedDict
+from datetime import datetime
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import add_client_wrapper, reset_clients
+from manuscripts.filter_sets import (FILTER_SETS_AGG, filter_set_searches,
+                                     read_filter_sets, remove_clauses)
+from manuscripts.memory_engine import MemoryClient
+from manuscripts.metrics import git
+from manuscripts.metrics.metrics import Metrics
+from utils import CountingClient
+
+GIT_DUMP = "data/indices/git_commit.json"
+URL = "http://localhost:9200"
+
+SETS = OrderedDict([("bitergia", {"author_domain": "bitergia.com"}),
+                    ("others", {"*author_domain": "bitergia.com", "is_git_commit": "1"})])
+
+
+class TestFilterSets(unittest.TestCase):
+    """Tests for the reports of many filter sets"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.memory_client = MemoryClient()
+        cls.memory_client.load(GIT_DUMP, "git")
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.start = datetime(2015, 1, 1)
+        self.end = datetime(2018, 7, 1)
+
+    def tearDown(self):
+        Metrics.filters_core = {}
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    def compute(self):
+        """Compute some metrics with the core filters"""
+
+        values = []
+        for metric in [git.Commits, git.Authors]:
+            values.append(metric(URL, "git", start=self.start, end=self.end).get_ts())
+            values.append(metric(URL, "git", start=self.start, end=self.end).get_agg())
+        return values
+
+    def test_read_filter_sets(self):
+        """Test whether the filter sets are read with the syntax of the -f param"""
+
+        sets_file = os.path.join(self.tmp_path, "sets.json")
+        with open(sets_file, "w") as f:
+            f.write('{"others": ["*author_domain:bitergia.com", "is_git_commit:1"], '
+                    '"bitergia": ["author_domain:bitergia.com"]}')
+        sets = read_filter_sets(sets_file)
+        self.assertListEqual(list(sets), ["others", "bitergia"])
+        self.assertDictEqual(sets["others"], SETS["others"])
+
+        with open(sets_file, "w") as f:
+            json.dump({"bitergia": []}, f)
+        with self.assertRaises(RuntimeError):
+            read_filter_sets(sets_file)
+
+    def test_remove_clauses(self):
+        """Test whether the clauses of a set are removed only if all of them are found"""
+
+        clauses = {"must": [{"match_phrase": {"a": "1"}}], "must_not": []}
+        query = {"bool": {"must": [{"match_phrase": {"a": "1"}}, {"match_phrase": {"b": "2"}}],
+                          "filter": [{"range": {"date": {"gte": "2015"}}}]}}
+        self.assertDictEqual(remove_clauses(query, clauses),
+                             {"bool": {"must": [{"match_phrase": {"b": "2"}}],
+                                       "filter": [{"range": {"date": {"gte": "2015"}}}]}})
+        self.assertIsNone(remove_clauses({"bool": {"must": [{"match_phrase": {"a": "2"}}]}}, clauses))
+        self.assertEqual(remove_clauses({"bool": {"must": {"match_phrase": {"a": "1"}}}}, clauses),
+                         {"match_all": {}})
+
+    def test_filter_sets(self):
+        """Test whether the metrics of all the sets are got with one search each"""
+
+        expected = {}
+        for name, filters in SETS.items():
+            Metrics.filters_core = filters
+            add_client_wrapper(lambda client: self.memory_client)
+            expected[name] = self.compute()
+            reset_clients()
+
+        counter = CountingClient(self.memory_client)
+        add_client_wrapper(lambda client: counter)
+        filter_sets = filter_set_searches(SETS)
+        for name, filters in SETS.items():
+            Metrics.filters_core = filters
+            filter_sets.use(name)
+            self.assertEqual(self.compute(), expected[name])
+
+        self.assertEqual(len(counter.bodies), 4)
+        self.assertIn(FILTER_SETS_AGG, counter.bodies[0]["aggs"])
+        self.assertNotEqual(expected["bitergia"], expected["others"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
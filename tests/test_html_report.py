@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.csv_writer import write_csv
+from manuscripts2.html_report import create_html, csv_to_html, image_to_html
+
+SAMPLE_REPORT_DATA = "data/sample_report_data"
+
+SVG_FIGURE = """<?xml version="1.0" encoding="utf-8" standalone="no"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>
+"""
+
+
+class TestHTMLReport(unittest.TestCase):
+    """Tests for the HTML report backend"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='manuscripts2_')
+        shutil.rmtree(self.data_dir)
+        shutil.copytree(SAMPLE_REPORT_DATA, self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_csv_to_html(self):
+        """Test whether a CSV file is converted to an HTML table"""
+
+        table = csv_to_html(os.path.join(self.data_dir, "overview", "data_source_evolution.csv"))
+        self.assertTrue(table.startswith("<table>\n<tr><th>metricsnames</th><th>netvalues</th>"))
+        # LaTeX escaping is removed
+        self.assertIn("<td>github_prs</td>", table)
+        self.assertNotIn("\\_", table)
+
+    def test_csv_to_html_special_chars(self):
+        """Test whether fields with LaTeX special chars and commas are kept in their column"""
+
+        file_name = os.path.join(self.data_dir, "overview", "top_organizations.csv")
+        write_csv(file_name, ["organizations", "commits"], [["Smith, Jones & co", 3], ["50% {x}", 1]], sep=", ")
+        table = csv_to_html(file_name)
+        self.assertIn("<tr><td>Smith, Jones &amp; co</td><td>3</td></tr>", table)
+        self.assertIn("<tr><td>50% {x}</td><td>1</td></tr>", table)
+
+    def test_image_to_html(self):
+        """Test whether SVG figures are inlined without the XML prolog"""
+
+        svg_file = os.path.join(self.data_dir, "figure.svg")
+        with open(svg_file, "w") as f:
+            f.write(SVG_FIGURE)
+
+        figure = image_to_html(svg_file)
+        self.assertTrue(figure.startswith('<div class="figure">\n<svg'))
+        self.assertNotIn("<?xml", figure)
+
+    def test_create_html(self):
+        """Test whether the HTML report includes all the sections and data"""
+
+        with open(os.path.join(self.data_dir, "activity", "git_commits_git_authors.svg"), "w") as f:
+            f.write(SVG_FIGURE)
+
+        report_file = create_html(self.data_dir, "Perceval\\_Project", "From 2016-01-01 to 2018-01-01")
+        self.assertEqual(report_file, os.path.join(self.data_dir, "report.html"))
+
+        with open(report_file) as f:
+            html = f.read()
+
+        self.assertIn("<title>Perceval_Project</title>", html)
+        for section in ["overview", "activity", "community", "process"]:
+            self.assertIn('<h2 id="{}">'.format(section), html)
+        self.assertIn("<h3>git commits git authors</h3>\n<div class=\"figure\">\n<svg", html)
+        self.assertIn("<h3>github prs bmipr</h3>\n<table>", html)
+        # Sections are in the report order
+        self.assertLess(html.index('id="overview"'), html.index('id="process"'))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime
+
+from pandas.testing import assert_frame_equal
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import add_client_wrapper, es_client, reset_clients
+from manuscripts.incremental import (IncrementalClient, TimeseriesStore,
+                                     incremental_searches, without_end)
+from manuscripts.memory_engine import MemoryClient
+from manuscripts2.elasticsearch import Index, Query
+from manuscripts2.metrics import git, github_prs
+from utils import CountingClient
+
+GIT_DUMP = "data/indices/git_commit.json"
+PRS_DUMP = "data/indices/github_prs.json"
+PRS_MAPPINGS = "data/mappings/github_prs_mappings.json"
+
+
+class TestIncremental(unittest.TestCase):
+    """Tests for the incremental time series"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.memory_client = MemoryClient()
+        cls.memory_client.load(GIT_DUMP, "git_enrich")
+        cls.memory_client.load(PRS_DUMP, "github_prs_enrich")
+        cls.memory_client.load_mappings("github_prs_enrich", PRS_MAPPINGS)
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.store_file = os.path.join(self.tmp_path, "timeseries.json")
+        Query.interval_ = "month"
+        self.start = datetime(2015, 1, 1)
+
+    def tearDown(self):
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    def timeseries(self, client, metric, index, end):
+        index = Index(index_name=index, es=client)
+        return metric(index, self.start, end).timeseries(dataframe=True)
+
+    def test_without_end(self):
+        """Test whether the end of ranges and bounds is removed"""
+
+        body = {
+            "query": {"bool": {"filter": [{"range": {"closed_at": {"gte": "2015", "lte": "2018"}}}]}},
+            "aggs": {"0": {"date_histogram": {"field": "closed_at",
+                                              "extended_bounds": {"min": 1, "max": 2}}}}
+        }
+        expected = {
+            "query": {"bool": {"filter": [{"range": {"closed_at": {"gte": "2015"}}}]}},
+            "aggs": {"0": {"date_histogram": {"field": "closed_at", "extended_bounds": {"min": 1}}}}
+        }
+        self.assertDictEqual(without_end(body), expected)
+        self.assertEqual(body["aggs"]["0"]["date_histogram"]["extended_bounds"]["max"], 2)
+
+    def test_incremental_run(self):
+        """Test whether an incremental run gets the same series as a full one"""
+
+        for metric, index in [(git.Commits, "git_enrich"), (git.Authors, "git_enrich"),
+                              (github_prs.DaysToClosePRMedian, "github_prs_enrich")]:
+            store = TimeseriesStore(self.store_file)
+            first_run = self.timeseries(IncrementalClient(self.memory_client, store),
+                                        metric, index, datetime(2017, 1, 1))
+            self.assertEqual(len(first_run), 25)
+
+            counter = CountingClient(self.memory_client)
+            second_run = self.timeseries(IncrementalClient(counter, store, lookback=2),
+                                         metric, index, datetime(2018, 7, 10))
+            full_run = self.timeseries(self.memory_client, metric, index, datetime(2018, 7, 10))
+            assert_frame_equal(second_run, full_run)
+
+            # Only the items from the last stored interval minus the lookback are asked for
+            cutoff = counter.bodies[0]["query"]["bool"]["filter"][-1]["range"]
+            self.assertEqual(list(cutoff.values())[0]["gte"], 1477958400000)
+
+    def test_not_timeseries(self):
+        """Test whether searches without date_histogram are sent as they are"""
+
+        counter = CountingClient(self.memory_client)
+        client = IncrementalClient(counter, TimeseriesStore(self.store_file))
+        index = Index(index_name="git_enrich", es=client)
+        authors = git.Authors(index, self.start, datetime(2018, 7, 10)).aggregations()
+        self.assertEqual(authors['keys'][0], "valerio cosentino")
+        self.assertDictEqual(client.store.series, {})
+
+    def test_store_file(self):
+        """Test whether the series are saved and loaded in the next run"""
+
+        add_client_wrapper(lambda client: self.memory_client)
+        save = incremental_searches(self.store_file)
+        self.timeseries(es_client(), git.Commits, "git_enrich", datetime(2017, 1, 1))
+        save()
+
+        store = TimeseriesStore(self.store_file)
+        self.assertEqual(len(store.series), 1)
+        buckets = list(store.series.values())[0]
+        self.assertEqual(buckets[-1]["key_as_string"], "2017-01-01T00:00:00.000Z")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.latex import build_pdf, parse_log_errors, needs_rerun
+
+# Fake pdflatex: writes a fixed aux file and a log, and fails if asked to
+FAKE_PDFLATEX = """
+import sys
+with open('report.aux', 'w') as f:
+    f.write('\\\\contentsline {section}{Overview}{3}')
+with open('report.log', 'w') as f:
+    f.write('This is pdfTeX\\n')
+    if 'fail' in sys.argv:
+        f.write('! Undefined control sequence.\\nl.12 \\\\foo\\n')
+        sys.exit(1)
+"""
+
+LOG_WITH_ERRORS = """This is pdfTeX, Version 3.14159265
+! LaTeX Error: File `csvsimple.sty' not found.
+
+Type X to quit or <RETURN> to proceed,
+l.7 \\usepackage
+                {fancyhdr}^^M
+./report.tex:42: Undefined control sequence.
+l.42 \\foo
+"""
+
+
+class TestLatex(unittest.TestCase):
+    """Tests for the incremental LaTeX builder"""
+
+    def setUp(self):
+        self.report_path = tempfile.mkdtemp()
+        self.command = [sys.executable, "-c", FAKE_PDFLATEX]
+
+    def tearDown(self):
+        shutil.rmtree(self.report_path)
+
+    def test_parse_log_errors(self):
+        """Test whether errors are extracted from a LaTeX log"""
+
+        errors = parse_log_errors(LOG_WITH_ERRORS)
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(errors[0], "LaTeX Error: File `csvsimple.sty' not found. (l.7 \\usepackage)")
+        self.assertEqual(errors[1], "./report.tex:42: Undefined control sequence. (l.42 \\foo)")
+
+        self.assertListEqual(parse_log_errors("This is pdfTeX\nOutput written"), [])
+
+    def test_needs_rerun(self):
+        """Test whether LaTeX requests for a new pass are detected"""
+
+        self.assertTrue(needs_rerun("LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right."))
+        self.assertFalse(needs_rerun(LOG_WITH_ERRORS))
+
+    def test_build_fixpoint(self):
+        """Test whether the second pass is run only when the aux files change"""
+
+        timings = build_pdf(self.report_path, command=self.command)
+        self.assertEqual(len(timings), 2)
+
+        # Rebuilding with the same aux files needs just one pass
+        timings = build_pdf(self.report_path, command=self.command)
+        self.assertEqual(len(timings), 1)
+
+    def test_build_error(self):
+        """Test whether a failed build returns None"""
+
+        with self.assertLogs('manuscripts.latex', level='ERROR') as logs:
+            timings = build_pdf(self.report_path, command=self.command + ["fail"])
+        self.assertIsNone(timings)
+        self.assertIn("Undefined control sequence. (l.12 \\foo)", logs.output[0])
+
+    def test_build_timeout(self):
+        """Test whether a pass exceeding the timeout fails the build"""
+
+        command = [sys.executable, "-c", "import time; time.sleep(5)"]
+        with self.assertLogs('manuscripts.latex', level='ERROR'):
+            timings = build_pdf(self.report_path, command=command, timeout=0.2)
+        self.assertIsNone(timings)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
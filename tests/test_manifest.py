@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime, timezone
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import add_client_wrapper, reset_clients
+from manuscripts.manifest import IndexChanges, index_state
+from manuscripts.memory_engine import MemoryClient
+from manuscripts2.report import Report
+
+GIT_DUMP = "data/indices/git_commit.json"
+PRS_DUMP = "data/indices/github_prs.json"
+
+INDICES = {"git": "git_enrich", "github_prs": "github_prs_enrich"}
+PARAMS = {"start": "2015-01-01", "end": "2018-07-10", "interval": "month"}
+
+
+class SectionsReport(Report):
+    """Report keeping the data sources of the sections generated"""
+
+    def create_data_figs(self, data_sources=None):
+        self.generated = data_sources
+
+    def create_pdf(self):
+        pass
+
+
+class TestManifest(unittest.TestCase):
+    """Tests for the change detection between report runs"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.manifest = os.path.join(self.tmp_path, "manifest.json")
+        self.client = self.memory_client(GIT_DUMP)
+
+    def tearDown(self):
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    @staticmethod
+    def memory_client(git_dump):
+        client = MemoryClient()
+        client.load(git_dump, "git_enrich")
+        client.load(PRS_DUMP, "github_prs_enrich")
+        return client
+
+    def changes(self, client, params=PARAMS):
+        return IndexChanges(self.manifest, client, INDICES, params)
+
+    def test_index_state(self):
+        """Test whether the state of an index has its items and last dates"""
+
+        state = index_state(self.client, "git_enrich")
+        self.assertEqual(state["index"], "git_enrich")
+        self.assertEqual(state["count"], len(self.client.indices["git_enrich"]))
+        self.assertEqual(state["metadata__updated_on"], "2018-07-25T17:28:25.000Z")
+        self.assertEqual(state["grimoire_creation_date"], "2018-07-25T17:28:25.000Z")
+
+    def test_changes(self):
+        """Test whether only the data sources whose index changed are found"""
+
+        changes = self.changes(self.client)
+        self.assertListEqual(changes.data_sources, ["git", "github_prs"])
+        changes.save()
+        self.assertListEqual(self.changes(self.client).data_sources, [])
+
+        # An item is deleted from the git index
+        git_dump = os.path.join(self.tmp_path, "git.json")
+        with open(GIT_DUMP) as f:
+            lines = f.readlines()
+        with open(git_dump, "w") as f:
+            f.writelines(lines[:-1])
+        self.assertListEqual(self.changes(self.memory_client(git_dump)).data_sources, ["git"])
+
+        # All the data sources are changed for other params
+        params = dict(PARAMS, end="2018-10-01")
+        self.assertListEqual(self.changes(self.client, params).data_sources, ["git", "github_prs"])
+
+    def test_report(self):
+        """Test whether a report is only generated if its indices changed"""
+
+        add_client_wrapper(lambda client: self.client)
+
+        def create(data_sources, indices):
+            report = SectionsReport(es_url="http://localhost:9200", data_dir=self.tmp_path,
+                                    start=datetime(2015, 1, 1, tzinfo=timezone.utc),
+                                    end=datetime(2018, 7, 10, tzinfo=timezone.utc),
+                                    data_sources=data_sources, indices=indices,
+                                    manifest=self.manifest)
+            report.generated = None
+            report.create()
+            return report.generated
+
+        self.assertListEqual(create(["git"], ["git_enrich"]), ["git"])
+        self.assertIsNone(create(["git"], ["git_enrich"]))
+        self.assertListEqual(create(["git", "github_prs"], ["git_enrich", "github_prs_enrich"]),
+                             ["git", "github_prs"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
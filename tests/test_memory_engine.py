@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import unittest
+
+from datetime import datetime
+
+import pandas as pd
+from dateutil import parser
+from numpy.testing import assert_array_equal
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import es_client, reset_clients, search_body
+from manuscripts.esquery import ElasticQuery
+from manuscripts.memory_engine import MemoryClient, use_memory_engine
+from manuscripts.metrics import git as git_legacy
+from manuscripts2.elasticsearch import Index, Query, get_trend
+from manuscripts2.metrics import git, github_prs
+
+from utils import load_json_file
+
+GIT_DUMP = "data/indices/git_commit.json"
+GIT_MAPPINGS = "data/mappings/git_commit_mappings.json"
+PRS_DUMP = "data/indices/github_prs.json"
+PRS_MAPPINGS = "data/mappings/github_prs_mappings.json"
+
+TOP_AUTHORS = "data/test_data/git_top_authors.json"
+COMMITS_BY_PERIOD = "data/test_data/git_commits_by_months.csv"
+TIME_TO_CLOSE_PRS_MEDIAN = "data/test_data/time_to_close_prs_days_median.csv"
+
+
+class TestMemoryEngine(unittest.TestCase):
+    """Tests for the in-memory Elasticsearch stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = MemoryClient()
+        cls.client.load(GIT_DUMP, "git_enrich")
+        cls.client.load_mappings("git_enrich", GIT_MAPPINGS)
+        cls.client.load(PRS_DUMP, "github_prs_enrich")
+        cls.client.load_mappings("github_prs_enrich", PRS_MAPPINGS)
+        cls.commits = pd.DataFrame.from_records(cls.client.indices["git_enrich"].sources)
+
+    def setUp(self):
+        Query.interval_ = "month"
+        self.start = datetime(2015, 1, 1)
+        self.end = datetime(2018, 7, 10)
+
+    def tearDown(self):
+        reset_clients()
+
+    def test_search_body(self):
+        """Test whether the body fields sent as params are joined to the body"""
+
+        body, params = search_body({"query": {"match_all": {}}},
+                                   {"aggs": {}, "from_": 5, "_source": ["hash"], "scroll": "1m"})
+        self.assertDictEqual(body, {"query": {"match_all": {}}, "aggs": {},
+                                    "from": 5, "_source": ["hash"]})
+        self.assertDictEqual(params, {"scroll": "1m"})
+
+    def test_hits(self):
+        """Test whether hits are filtered, sorted and include the fields requested"""
+
+        body = {
+            "query": {"bool": {"must": [{"match_phrase": {"author_name": "quan"}}]}},
+            "sort": [{"commit_date": {"order": "desc"}}],
+            "_source": ["hash", "commit_date"],
+            "size": 3
+        }
+        response = self.client.search(index="git_enrich", body=body)
+
+        expected = self.commits[self.commits['author_name'] == "quan"]
+        self.assertEqual(response['hits']['total'], len(expected))
+        self.assertEqual(len(response['hits']['hits']), 3)
+
+        dates = [hit['_source']['commit_date'] for hit in response['hits']['hits']]
+        self.assertListEqual(dates, sorted(expected['commit_date'], reverse=True)[:3])
+        self.assertListEqual(sorted(response['hits']['hits'][0]['_source']), ["commit_date", "hash"])
+
+    def test_index_patterns(self):
+        """Test whether indices are searched by name, pattern or list"""
+
+        total = len(self.commits) + len(self.client.indices["github_prs_enrich"])
+        for index in ["git*,github_prs_enrich", ["git_enrich", "github_*"], "_all"]:
+            response = self.client.search(index=index, body={"size": 0})
+            self.assertEqual(response['hits']['total'], total)
+
+        with self.assertRaises(RuntimeError):
+            self.client.search(index="gerrit_enrich", body={"size": 0})
+
+    def test_unsupported(self):
+        """Test whether the DSL not supported raises an error"""
+
+        with self.assertRaises(RuntimeError):
+            self.client.search(index="git_enrich", body={"query": {"query_string": {"query": "*"}}})
+        with self.assertRaises(RuntimeError):
+            self.client.search(index="git_enrich", body={"aggs": {"1": {"geohash_grid": {}}}})
+
+    def test_date_histogram(self):
+        """Test whether empty buckets are added up to the extended bounds"""
+
+        body = {
+            "query": {"bool": {"must_not": [{"match_phrase": {"author_name": "quan"}}]}},
+            "size": 0,
+            "aggs": {
+                "1": {
+                    "date_histogram": {
+                        "field": "grimoire_creation_date", "interval": "year",
+                        "time_zone": "UTC", "min_doc_count": 0,
+                        "extended_bounds": {"min": 1420070400000.0, "max": 1577836800000.0}
+                    },
+                    "aggs": {"2": {"cardinality": {"field": "author_uuid"}}}
+                }
+            }
+        }
+        response = self.client.search(index="git_enrich", body=body)
+        buckets = response['aggregations']['1']['buckets']
+
+        self.assertEqual(buckets[0]['key_as_string'], "2015-01-01T00:00:00.000Z")
+        self.assertEqual(buckets[0]['key'], 1420070400000)
+        self.assertEqual(buckets[-1]['key_as_string'], "2020-01-01T00:00:00.000Z")
+        self.assertEqual(buckets[-1]['doc_count'], 0)
+        self.assertEqual(buckets[-1]['2']['value'], 0)
+
+        commits = self.commits[self.commits['author_name'] != "quan"]
+        self.assertEqual(sum(bucket['doc_count'] for bucket in buckets), len(commits))
+
+    def test_metric_aggregations(self):
+        """Test whether metric aggregations match the ones computed with pandas"""
+
+        body = {
+            "size": 0,
+            "aggs": {
+                "1": {"sum": {"field": "lines_added"}},
+                "2": {"avg": {"field": "lines_added"}},
+                "3": {"max": {"field": "commit_date"}},
+                "4": {"percentiles": {"field": "files", "percents": [50]}},
+                "5": {"extended_stats": {"field": "files"}},
+                "6": {"terms": {"field": "author_name", "size": 2}}
+            }
+        }
+        aggs = self.client.search(index="git_enrich", body=body)['aggregations']
+
+        self.assertEqual(aggs['1']['value'], self.commits['lines_added'].sum())
+        self.assertAlmostEqual(aggs['2']['value'], self.commits['lines_added'].mean())
+        self.assertEqual(aggs['3']['value_as_string'][:19], self.commits['commit_date'].max())
+        self.assertEqual(aggs['4']['values']['50.0'], self.commits['files'].median())
+        self.assertEqual(aggs['5']['count'], self.commits['files'].count())
+        self.assertEqual(aggs['5']['max'], self.commits['files'].max())
+
+        counts = self.commits['author_name'].value_counts()
+        self.assertListEqual([bucket['key'] for bucket in aggs['6']['buckets']], list(counts.index[:2]))
+        self.assertEqual(aggs['6']['sum_other_doc_count'], counts[2:].sum())
+
+    def test_empty_aggregations(self):
+        """Test whether aggregations on no items return null values"""
+
+        body = {
+            "query": {"match_phrase": {"author_name": "nobody"}},
+            "size": 0,
+            "aggs": {
+                "1": {"percentiles": {"field": "files"}},
+                "2": {"avg": {"field": "files"}},
+                "3": {"sum": {"field": "files"}}
+            }
+        }
+        aggs = self.client.search(index="git_enrich", body=body)['aggregations']
+        self.assertIsNone(aggs['1']['values']['50.0'])
+        self.assertIsNone(aggs['2']['value'])
+        self.assertEqual(aggs['3']['value'], 0)
+
+    def test_manuscripts2_metrics(self):
+        """Test whether manuscripts2 metrics get the same values as with Elasticsearch"""
+
+        index = Index(index_name="git_enrich", es=self.client)
+
+        commits = git.Commits(index, self.start, self.end)
+        self.assertEqual(get_trend(commits.timeseries()), (12, -41))
+
+        commits = git.Commits(index, self.start, self.end)
+        commits_ts = commits.timeseries()
+        commits_test = pd.read_csv(COMMITS_BY_PERIOD)
+        assert_array_equal(commits_test['value'], commits_ts['value'])
+        assert_array_equal([parser.parse(item).date() for item in commits_test['date']],
+                           commits_ts['date'])
+
+        authors = git.Authors(index, self.start, self.end).aggregations()
+        authors_test = load_json_file(TOP_AUTHORS)
+        assert_array_equal(authors['keys'], authors_test['keys'])
+        assert_array_equal(authors['values'], authors_test['values'])
+
+        index = Index(index_name="github_prs_enrich", es=self.client)
+        days_to_close = github_prs.DaysToClosePRMedian(index, self.start, self.end)
+        median_ts = days_to_close.timeseries(dataframe=True)
+        median_test = pd.read_csv(TIME_TO_CLOSE_PRS_MEDIAN)
+        assert_array_equal(median_test['value'], median_ts['value'])
+
+    def test_manuscripts_metrics(self):
+        """Test whether manuscripts metrics are answered through use_memory_engine"""
+
+        use_memory_engine(["git_enrich=" + GIT_DUMP], ["git_enrich=" + GIT_MAPPINGS])
+        self.assertIsInstance(es_client("http://localhost:9200"), MemoryClient)
+
+        ElasticQuery.interval_ = "month"
+        authors = git_legacy.Authors("http://localhost:9200", "git_enrich",
+                                     start=self.start, end=self.end)
+        self.assertEqual(authors.get_agg(), self.commits['author_uuid'].nunique())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import unittest
+
+from datetime import datetime
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts2.elasticsearch import Index, Query, normalize_query
+from manuscripts2.metrics import git, github_prs
+
+
+class TestNormalize(unittest.TestCase):
+    """Tests for the normalization of manuscripts2 queries"""
+
+    def setUp(self):
+        Query.interval_ = "month"
+        self.index = Index(index_name="git_enrich", es=object())
+        self.start = datetime(2015, 1, 1)
+        self.end = datetime(2018, 7, 10)
+
+    def test_normalize_query(self):
+        """Test whether the ranges on the same field are intersected and the clauses sorted"""
+
+        query = {"bool": {
+            "must": [{"match": {"state": "closed"}}, {"match": {"pull_request": "true"}}],
+            "filter": [{"range": {"grimoire_creation_date": {"gte": "2015-01-01T00:00:00"}}},
+                       {"range": {"grimoire_creation_date": {"lte": "2018-07-10T00:00:00"}}},
+                       {"range": {"closed_at": {"gte": "2018-06-01T00:00:00+00:00"}}},
+                       {"range": {"grimoire_creation_date": {"gte": "2018-06-01T00:00:00"}}},
+                       {"range": {"closed_at": {"gte": "2018-05-01T00:00:00"}}},
+                       {"range": {"closed_at": {"gt": 0, "format": "epoch_millis"}}}]
+        }}
+        expected = {"bool": {
+            "filter": [{"range": {"closed_at": {"format": "epoch_millis", "gt": 0}}},
+                       {"range": {"closed_at": {"gte": "2018-06-01T00:00:00+00:00"}}},
+                       {"range": {"grimoire_creation_date": {"gte": "2018-06-01T00:00:00",
+                                                             "lte": "2018-07-10T00:00:00"}}}],
+            "must": [{"match": {"pull_request": "true"}}, {"match": {"state": "closed"}}]
+        }}
+        self.assertDictEqual(normalize_query(query), expected)
+        self.assertDictEqual(normalize_query(expected), expected)
+        self.assertDictEqual(normalize_query({"match_all": {}}), {"match_all": {}})
+
+    def test_normalize_query_not_comparable(self):
+        """Test whether the ranges with bounds which can not be compared are kept"""
+
+        date_math = [{"range": {"grimoire_creation_date": {"gte": "2015-01-01T00:00:00"}}},
+                     {"range": {"grimoire_creation_date": {"gte": "now-1y"}}}]
+        mixed = [{"range": {"time_to_close_days": {"gte": 1}}},
+                 {"range": {"time_to_close_days": {"gte": "2018-01-01"}}}]
+        numbers = [{"range": {"time_open_days": {"gte": 1}}},
+                   {"range": {"time_open_days": {"gte": 2.5, "lte": 10}}}]
+        query = {"bool": {"filter": date_math + mixed + numbers}}
+
+        expected = date_math + mixed + [{"range": {"time_open_days": {"gte": 2.5, "lte": 10}}}]
+        self.assertCountEqual(normalize_query(query)["bool"]["filter"], expected)
+
+    def test_fingerprint(self):
+        """Test whether the same logical queries get the same fingerprint"""
+
+        authors = git.Authors(self.index, self.start, self.end)
+        authors.query.since(datetime(2018, 6, 1)).get_terms("author_name")
+        fingerprint = authors.query.fingerprint()
+        self.assertEqual(authors.query.fingerprint(), fingerprint)
+
+        # The filters are added again and in other order
+        authors = git.Authors(self.index, self.start, self.end)
+        authors.query.since(datetime(2018, 6, 1)).until(self.end).since(self.start)
+        authors.query.get_terms("author_name")
+        self.assertEqual(authors.query.fingerprint(), fingerprint)
+
+        authors = git.Authors(self.index, self.start, self.end)
+        authors.query.since(datetime(2018, 5, 1)).get_terms("author_name")
+        self.assertNotEqual(authors.query.fingerprint(), fingerprint)
+
+        authors = git.Authors(self.index, self.start, self.end)
+        authors.query.since(datetime(2018, 6, 1)).get_cardinality("author_name")
+        self.assertNotEqual(authors.query.fingerprint(), fingerprint)
+
+    def test_repeated_aggregations(self):
+        """Test whether computing a metric again sends the same search"""
+
+        prs_index = Index(index_name="github_prs_enrich", es=object())
+        metric = github_prs.DaysToClosePRMedian(prs_index, self.start, self.end)
+        metric.query.since(datetime(2018, 6, 1))
+        metric.query.add_aggregations()
+        first = metric.query.search.to_dict()
+        metric.query.since(datetime(2018, 6, 1))
+        metric.query.add_aggregations()
+        self.assertDictEqual(metric.query.search.to_dict(), first)
+        self.assertEqual(len(first["query"]["bool"]["filter"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import es_client, reset_clients
+from manuscripts.esquery import ElasticQuery
+from manuscripts.metrics import git as git_legacy
+from manuscripts.plan import estimate_buckets, plan_report, plan_searches, plan_summary
+from manuscripts.profiler import profiler
+from manuscripts2.elasticsearch import Index, Query
+from manuscripts2.metrics import git
+
+
+class FakeReport():
+    """Report computing some metrics in its sections"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.start = datetime(2018, 1, 1)
+        self.end = datetime(2018, 7, 1)
+        self.data_dirs = []
+
+    def create_data_figs(self):
+        self.data_dirs.append(self.data_dir)
+        index = Index(index_name="git_enrich", es=es_client())
+        with profiler.in_section("overview"):
+            git.Commits(index, self.start, self.end).timeseries()
+            git.Authors(index, self.start, self.end).aggregations()
+        with profiler.in_section("activity"):
+            git.Commits(index, self.start, self.end).timeseries()
+        with profiler.in_section("community"):
+            git_legacy.Commits("http://localhost:9200", "git", start=self.start, end=self.end).get_ts()
+
+
+class TestPlan(unittest.TestCase):
+    """Tests for the dry run of reports"""
+
+    def setUp(self):
+        Query.interval_ = "month"
+        ElasticQuery.interval_ = "month"
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+
+    def tearDown(self):
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    def test_plan_report(self):
+        """Test whether the searches of a report are planned without sending them"""
+
+        planner = plan_searches()
+        report = FakeReport(self.tmp_path)
+        plan_file = os.path.join(self.tmp_path, "plan.json")
+        plan = plan_report(report, planner, plan_file)
+
+        # The data is generated in a temporary directory
+        self.assertNotEqual(report.data_dirs[0], self.tmp_path)
+        self.assertFalse(os.path.exists(report.data_dirs[0]))
+        self.assertEqual(report.data_dir, self.tmp_path)
+
+        self.assertEqual(plan["requests"], 4)
+        self.assertEqual(plan["unique_queries"], 3)
+        commits = plan["queries"][0]
+        self.assertEqual(commits["index"], "git_enrich")
+        self.assertEqual(commits["count"], 2)
+        self.assertListEqual(commits["sections"], ["overview", "activity"])
+        self.assertEqual(commits["aggregations"],
+                         "date_histogram(grimoire_creation_date, month) > cardinality(hash)")
+        self.assertEqual(commits["buckets"], 7)
+        # Terms sizes are upper bounds of their buckets
+        self.assertEqual(plan["queries"][1]["aggregations"], "terms(author_name, 10000)")
+        self.assertEqual(plan["queries"][1]["buckets"], 10000)
+        self.assertEqual(plan["queries"][2]["index"], "git")
+        self.assertEqual(plan["queries"][2]["buckets"], 7)
+        self.assertEqual(plan["buckets"], 2 * 7 + 10000 + 7)
+
+        with open(plan_file) as f:
+            self.assertEqual(json.load(f)["unique_queries"], 3)
+        self.assertIn("4 requests, 3 unique queries, 10021 buckets", plan_summary(plan))
+
+    def test_estimate_buckets(self):
+        """Test whether the buckets of nested aggregations are estimated"""
+
+        date_ranges = {"grimoire_creation_date": {"gte": "2018-01-01T00:00:00",
+                                                  "lte": "2018-12-31T23:59:59"}}
+        aggs = {
+            "0": {"terms": {"field": "author_name", "size": 5},
+                  "aggs": {"1": {"date_histogram": {"field": "grimoire_creation_date",
+                                                    "calendar_interval": "quarter"}}}},
+            "2": {"date_histogram": {"field": "grimoire_creation_date", "fixed_interval": "7d",
+                                     "extended_bounds": {"min": "2018-01-01", "max": "2018-01-29"}}},
+            "3": {"avg": {"field": "lines_added"}}
+        }
+        self.assertEqual(estimate_buckets(aggs, date_ranges), 5 + 5 * 4 + 5)
+
+        aggs = {"0": {"date_histogram": {"field": "closed_at", "interval": "month"}}}
+        self.assertIsNone(estimate_buckets(aggs, date_ranges))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import unittest
+
+from datetime import datetime
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import search_body
+from manuscripts2.elasticsearch import SAMPLE_AGG, Index, Query
+from manuscripts2.metrics import git
+
+
+def bucket(date, key, doc_count, value):
+    return {"key_as_string": date, "key": key, "doc_count": doc_count, "0": {"value": value}}
+
+
+class SampleClient():
+    """Client answering with the aggregations of a sample of 100 items out of 1000"""
+
+    def __init__(self, value):
+        self.value = value
+        self.body = None
+
+    def search(self, index=None, body=None, **params):
+        self.body, _ = search_body(body, params)
+        buckets = [bucket("2018-01-01T00:00:00.000Z", 1514764800000, 60, self.value(60)),
+                   bucket("2018-02-01T00:00:00.000Z", 1517443200000, 40, self.value(40))]
+        return {
+            "hits": {"total": {"value": 1000, "relation": "eq"}, "hits": []},
+            "aggregations": {SAMPLE_AGG: {"doc_count": 100, "0": {"buckets": buckets}}}
+        }
+
+
+class TestPreview(unittest.TestCase):
+    """Tests for the preview mode of manuscripts2 queries"""
+
+    def setUp(self):
+        Query.interval_ = "month"
+        self.start = datetime(2018, 1, 1)
+        self.end = datetime(2018, 3, 1)
+
+    def test_sample_search(self):
+        """Test whether the aggregations are computed in a random sample"""
+
+        client = SampleClient(lambda count: count)
+        commits = git.Commits(Index(index_name="git_enrich", es=client), self.start, self.end)
+        commits.query.preview(100)
+        commits.timeseries()
+
+        self.assertTrue(client.body["track_total_hits"])
+        sampler = client.body["aggs"][SAMPLE_AGG]
+        self.assertDictEqual(sampler["sampler"], {"shard_size": 100})
+        self.assertIn("date_histogram", sampler["aggs"][0])
+        must = client.body["query"]["bool"]["must"]
+        self.assertIn("random_score", must[0]["function_score"]["functions"][0])
+
+    def test_scaled_values(self):
+        """Test whether counts are scaled to all the items and marked as approximate"""
+
+        # All the items of the sample have different hashes
+        index = Index(index_name="git_enrich", es=SampleClient(lambda count: count))
+        commits = git.Commits(index, self.start, self.end)
+        commits.query.preview(100)
+        ts = commits.timeseries(dataframe=True)
+        self.assertListEqual(list(ts["value"]), [600, 400])
+        self.assertTrue(ts.attrs["approximate"])
+
+        # Authors are repeated in the sample, so they are not scaled
+        index = Index(index_name="git_enrich", es=SampleClient(lambda count: 3))
+        authors = git.Authors(index, self.start, self.end)
+        authors.query.preview(100)
+        ts = authors.timeseries()
+        self.assertListEqual(ts["value"], [3, 3])
+        self.assertTrue(authors.query.approximate)
+
+    def test_exact(self):
+        """Test whether queries are not sampled out of preview mode"""
+
+        client = SampleClient(lambda count: count)
+        commits = git.Commits(Index(index_name="git_enrich", es=client), self.start, self.end)
+        commits.query.preview(None)
+        self.assertIs(commits.query.get_search(), commits.query.search)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
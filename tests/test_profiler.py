@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.profiler import Profiler, count_buckets, parse_es_profile
+
+RESPONSE = {
+    "took": 12,
+    "hits": {"total": 100, "hits": []},
+    "aggregations": {
+        "0": {
+            "buckets": [
+                {"key": "a", "doc_count": 3, "1": {"buckets": [{"key": 1}, {"key": 2}]}},
+                {"key": "b", "doc_count": 1, "1": {"buckets": [{"key": 3}]}}
+            ]
+        },
+        "2": {"buckets": {"open": {"doc_count": 1}, "closed": {"doc_count": 2}}},
+        "3": {"value": 5}
+    }
+}
+
+ES_PROFILE = {
+    "shards": [{
+        "id": "[node][git][0]",
+        "searches": [{
+            "query": [{"type": "BooleanQuery", "time_in_nanos": 1000}],
+            "collector": [{"name": "MultiCollector", "reason": "search_multi", "time_in_nanos": 500}]
+        }],
+        "aggregations": [{
+            "type": "DateHistogramAggregator",
+            "description": "0",
+            "time_in_nanos": 3000000,
+            "breakdown": {"collect": 2000000},
+            "children": [{"type": "CardinalityAggregator", "description": "1",
+                          "time_in_nanos": 2500000, "breakdown": {"collect": 2400000}}]
+        }]
+    }]
+}
+
+
+class FakeResponse():
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class FakeSearch():
+    """Search object returning the ES profile when it is enabled"""
+
+    def __init__(self, profile=False):
+        self.profile = profile
+
+    def extra(self, **kwargs):
+        return FakeSearch(kwargs.get('profile', False))
+
+    def execute(self):
+        if not self.profile:
+            raise RuntimeError("profile not enabled")
+        return FakeResponse({"took": 3, "profile": ES_PROFILE})
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests for the run profiler"""
+
+    def test_count_buckets(self):
+        """Test whether nested and keyed buckets are counted"""
+
+        self.assertEqual(count_buckets(RESPONSE['aggregations']), 7)
+        self.assertEqual(count_buckets({}), 0)
+
+    def test_disabled(self):
+        """Test whether nothing is recorded by a disabled profiler"""
+
+        profiler = Profiler()
+        profiler.record_query("commits", "git", 0.1, RESPONSE)
+        with profiler.stage("csv", "commits.csv"):
+            pass
+
+        self.assertListEqual(profiler.queries, [])
+        self.assertListEqual(profiler.stages, [])
+
+    def test_record(self):
+        """Test whether queries and stages are recorded with their section"""
+
+        profiler = Profiler()
+        profiler.enabled = True
+
+        with profiler.in_section("activity"):
+            profiler.record_query("commits", "git", 0.5, RESPONSE)
+            with profiler.stage("figure", "commits.eps"):
+                pass
+        profiler.record_query("authors", "git", 0.1, {"took": 1})
+
+        query = profiler.queries[0]
+        self.assertEqual(query['metric'], "commits")
+        self.assertEqual(query['section'], "activity")
+        self.assertEqual(query['took'], 12)
+        self.assertEqual(query['buckets'], 7)
+        self.assertEqual(query['response_bytes'], len(json.dumps(RESPONSE)))
+        self.assertIsNone(profiler.queries[1]['section'])
+        self.assertEqual(profiler.stages[0]['stage'], "figure")
+        self.assertEqual(profiler.stages[0]['section'], "activity")
+
+        sections = profiler.to_dict()['sections']
+        self.assertEqual(sections['activity']['queries'], 1)
+        self.assertEqual(sections['None']['query_time'], 0.1)
+
+        summary = profiler.summary(top=1).split("\n")
+        self.assertEqual(summary[0], "Queries: 2 in 0.60s. Slowest 1:")
+        self.assertIn("git/commits [activity]", summary[1])
+        self.assertTrue(summary[2].startswith("Stages: 1 in"))
+
+    def test_concurrent_sections(self):
+        """Test whether the sections run at the same time by threads and tasks are kept apart"""
+
+        profiler = Profiler()
+        profiler.enabled = True
+        barrier = threading.Barrier(2)
+
+        def run(section):
+            with profiler.in_section(section):
+                barrier.wait()
+                profiler.record_query("commits", section, 0.1, RESPONSE)
+
+        threads = [threading.Thread(target=run, args=(section,)) for section in ["activity", "community"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        async def arun(section):
+            with profiler.in_section(section):
+                await asyncio.sleep(0.01)
+                profiler.record_query("commits", section, 0.1, RESPONSE)
+
+        async def gather():
+            await asyncio.gather(arun("overview"), arun("process"))
+
+        asyncio.run(gather())
+
+        self.assertEqual(len(profiler.queries), 4)
+        for query in profiler.queries:
+            self.assertEqual(query['section'], query['data_source'])
+        self.assertIsNone(profiler.section)
+
+    def test_parse_es_profile(self):
+        """Test whether the shard timings are extracted from an ES profile"""
+
+        shards = parse_es_profile(ES_PROFILE)
+
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(shards[0]['query_time_in_nanos'], 1000)
+        self.assertEqual(shards[0]['collectors'][0]['name'], "MultiCollector")
+        descriptions = [agg['description'] for agg in shards[0]['aggregations']]
+        self.assertListEqual(descriptions, ["0", "0>1"])
+
+    def test_es_profile(self):
+        """Test whether only the selected metrics are profiled by ES"""
+
+        profiler = Profiler()
+        profiler.profile_search(FakeSearch(), "commits", "git")
+        self.assertListEqual(profiler.es_profiles, [])
+
+        profiler.es_profile = ["authors"]
+        profiler.profile_search(FakeSearch(), "commits", "git")
+        with profiler.in_section("community"):
+            profiler.profile_search(FakeSearch(), "authors", "git")
+            profiler.profile_search(FakeSearch(), "authors", "git")
+
+        self.assertEqual(len(profiler.es_profiles), 2)
+        self.assertEqual(profiler.es_profiles[0]['section'], "community")
+
+        top = profiler.top_aggregations(top=1)
+        self.assertEqual(len(top), 1)
+        self.assertEqual(top[0]['type'], "DateHistogramAggregator")
+        self.assertEqual(top[0]['time_in_nanos'], 6000000)
+        self.assertIn("6.000ms DateHistogramAggregator", profiler.es_profile_summary())
+
+        with tempfile.TemporaryDirectory() as tmp_path:
+            files = profiler.dump_es_profiles(os.path.join(tmp_path, "es_profile"))
+            self.assertListEqual([os.path.basename(f) for f in files],
+                                 ["000_git_authors.json", "001_git_authors.json"])
+
+    def test_dump(self):
+        """Test whether the profile is written as JSON"""
+
+        profiler = Profiler()
+        profiler.enabled = True
+        profiler.record_stage("pdf", "report.tex", 2.0)
+
+        with tempfile.TemporaryDirectory() as tmp_path:
+            profile_file = os.path.join(tmp_path, "profile.json")
+            profiler.dump(profile_file)
+            with open(profile_file) as f:
+                profile = json.load(f)
+
+        self.assertEqual(profile['stages'][0]['name'], "report.tex")
+        self.assertListEqual(profile['queries'], [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.memory_engine import MemoryClient, read_dump
+from manuscripts2.elasticsearch import Index
+from manuscripts2.metrics import git, github_issues, github_prs
+from manuscripts2.rollup import (DOCS_FIELD, ITEMS_FIELD, ROLLUP_FIELDS, RollupClient,
+                                 read_rollup, rollup_name, rollup_search, transform_config)
+from utils import CountingClient
+
+DUMPS = {
+    "git": "data/indices/git_commit.json",
+    "github_issues": "data/indices/github_issues.json",
+    "github_prs": "data/indices/github_prs.json"
+}
+
+
+def write_rollup(dump, data_source, filename):
+    """Write the items of the rollup of an index built by its transform"""
+
+    fields = ROLLUP_FIELDS[data_source]
+    df = pd.DataFrame.from_records([source for _, _, source in read_dump(dump)])
+    for field in fields["terms"]:
+        if field not in df:
+            # Items without the field are grouped in the missing bucket
+            df[field] = None
+    for field in fields["dates"]:
+        dates = pd.to_datetime(df[field], utc=True).dt.tz_convert(None)
+        df[field] = dates.dt.to_period("M").dt.to_timestamp()
+
+    groups = df.groupby(fields["dates"] + fields["terms"], dropna=False)[fields["id"]]
+    rollup = groups.agg(["nunique", "count"]).reset_index()
+    with open(filename, "w") as f:
+        for nrow, row in rollup.iterrows():
+            source = {field: value.isoformat() if isinstance(value, pd.Timestamp) else value
+                      for field, value in row.items() if not pd.isnull(value)}
+            source[ITEMS_FIELD] = source.pop("nunique")
+            source[DOCS_FIELD] = source.pop("count")
+            f.write(json.dumps({"_index": rollup_name(data_source), "_id": str(nrow),
+                                "_source": source}, default=int) + "\n")
+
+
+class TestRollup(unittest.TestCase):
+    """Tests for the reports using the monthly rollups of the indices"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        cls.memory_client = MemoryClient()
+        cls.rollups = {}
+        for data_source, dump in DUMPS.items():
+            filename = os.path.join(cls.tmp_path, data_source + ".json")
+            write_rollup(dump, data_source, filename)
+            cls.memory_client.load(dump, data_source)
+            cls.memory_client.load(filename)
+            cls.rollups[data_source] = read_rollup(transform_config(data_source, data_source))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_path)
+
+    def setUp(self):
+        self.start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        # The end of the reports, the day before the end date
+        self.end = datetime(2018, 7, 1, tzinfo=timezone.utc) + timedelta(microseconds=-1)
+        self.counter = CountingClient(self.memory_client)
+        self.client = RollupClient(self.counter, self.rollups)
+
+    def test_transform_config(self):
+        """Test whether the fields of a rollup are got from its transform"""
+
+        config = transform_config("github_issues", "GitHub.Issues")
+        self.assertEqual(config["dest"]["index"], "manuscripts_rollup_github_issues")
+        self.assertDictEqual(read_rollup(config), {
+            "index": "manuscripts_rollup_github_issues",
+            "id": "id",
+            "shared_id": False,
+            "dates": ["grimoire_creation_date", "closed_at"],
+            "terms": ["project", "author_org_name", "state", "pull_request"]
+        })
+
+        # The description changes with the config of the transform
+        self.assertEqual(config["description"], transform_config("github_issues", "GitHub.Issues")["description"])
+        self.assertNotEqual(config["description"],
+                            transform_config("github_issues", "GitHub.Issues", frequency="1h")["description"])
+        with self.assertRaises(RuntimeError):
+            transform_config("mls", "mls")
+
+    def test_rollup_search(self):
+        """Test whether only the searches of whole groups are sent to the rollups"""
+
+        rollup = self.rollups["git"]
+        histogram = {"date_histogram": {"field": "grimoire_creation_date", "interval": "quarter"},
+                     "aggs": {"0": {"cardinality": {"field": "hash"}}}}
+        query = {"bool": {"filter": [{"range": {"grimoire_creation_date": {
+            "gte": "2015-01-01T00:00:00+00:00", "lte": "2018-06-30T23:59:59.999999+00:00"}}}],
+            "must": [{"match": {"project": "grimoirelab"}}, {"terms": {"author_org_name": ["Bitergia"]}}]}}
+
+        body = rollup_search({"query": query, "aggs": {"0": histogram}, "size": 0}, rollup)
+        self.assertDictEqual(body["aggs"]["0"]["aggs"]["0"], {"sum": {"field": ITEMS_FIELD}})
+
+        # Commits shared by the groups of several organizations
+        organizations = query["bool"]["must"].pop()
+        self.assertIsNone(rollup_search({"query": query, "aggs": {"0": histogram}, "size": 0}, rollup))
+        docs = {"value_count": {"field": "hash"}}
+        body = rollup_search({"query": query, "aggs": {"0": docs}, "size": 0}, rollup)
+        self.assertDictEqual(body["aggs"]["0"], {"sum": {"field": DOCS_FIELD}})
+        query["bool"]["must"].append(organizations)
+
+        # Ranges not ending at the start of a month
+        query["bool"]["filter"][0]["range"]["grimoire_creation_date"]["lte"] = "2018-07-01T00:00:00+00:00"
+        self.assertIsNone(rollup_search({"query": query, "aggs": {"0": histogram}, "size": 0}, rollup))
+        query["bool"]["filter"][0]["range"]["grimoire_creation_date"]["lte"] = "now"
+        self.assertIsNone(rollup_search({"query": query, "aggs": {"0": histogram}, "size": 0}, rollup))
+
+        # Non additive metrics, fields not grouped and items
+        authors = {"cardinality": {"field": "author_uuid"}}
+        self.assertIsNone(rollup_search({"aggs": {"0": authors}, "size": 0}, rollup))
+        self.assertIsNone(rollup_search({"query": {"match": {"author_name": "Quan"}}, "size": 0}, rollup))
+        self.assertIsNone(rollup_search({"query": {"match_all": {}}}, rollup))
+
+    def test_metrics(self):
+        """Test whether the additive metrics are the same with the rollups"""
+
+        metrics = [(github_issues.OpenedIssues, "github_issues"),
+                   (github_issues.ClosedIssues, "github_issues"),
+                   (github_prs.SubmittedPRs, "github_prs"),
+                   (github_prs.ClosedPRs, "github_prs")]
+        for metric, data_source in metrics:
+            expected = metric(Index(data_source, es=self.memory_client), self.start, self.end)
+            rolled_up = metric(Index(data_source, es=self.client), self.start, self.end)
+            pd.testing.assert_frame_equal(rolled_up.timeseries(dataframe=True),
+                                          expected.timeseries(dataframe=True))
+
+            expected = metric(Index(data_source, es=self.memory_client), self.start, self.end)
+            rolled_up = metric(Index(data_source, es=self.client), self.start, self.end)
+            self.assertEqual(rolled_up.aggregations(), expected.aggregations())
+
+        self.assertListEqual(self.counter.indices, [rollup_name(data_source)
+                                                    for _, data_source in metrics for _ in range(2)])
+        self.assertEqual(self.client.rollup_searches, len(self.counter.indices))
+
+    def test_fallback(self):
+        """Test whether the non additive metrics are computed from the items"""
+
+        authors = git.Authors(Index("git", es=self.client), self.start, self.end)
+        expected = git.Authors(Index("git", es=self.memory_client), self.start, self.end)
+        pd.testing.assert_frame_equal(authors.timeseries(dataframe=True),
+                                      expected.timeseries(dataframe=True))
+
+        days = github_issues.DaysToCloseMedian(Index("github_issues", es=self.client), self.start, self.end)
+        days.aggregations()
+
+        # The commits of all the projects
+        commits = git.Commits(Index("git", es=self.client), self.start, self.end)
+        expected = git.Commits(Index("git", es=self.memory_client), self.start, self.end)
+        self.assertEqual(commits.aggregations(), expected.aggregations())
+        self.assertListEqual(self.counter.indices, ["git", "github_issues", "git"])
+        self.assertEqual(self.client.searches, 3)
+        self.assertEqual(self.client.rollup_searches, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts2.service import ReportService, check_spec, create_server
+
+
+def fake_run(es_url, data_dir, spec, latex_timeout=None):
+    """Write the files of a report, or fail for the reports named fail"""
+
+    if spec["name"] == "fail":
+        raise RuntimeError("Report failed")
+    os.makedirs(os.path.join(data_dir, "activity"))
+    with open(os.path.join(data_dir, "activity", "git_commits.csv"), "w") as f:
+        f.write("Date,commits\n")
+    with open(os.path.join(data_dir, "report." + spec["format"]), "w") as f:
+        f.write(es_url)
+
+
+class TestService(unittest.TestCase):
+    """Tests for the report service API"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.service = ReportService("http://localhost:9200", self.tmp_path, self.executor,
+                                     queue_size=1, run=fake_run)
+        self.server = create_server(self.service, port=0)
+        self.url = "http://%s:%i" % self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.executor.shutdown()
+        shutil.rmtree(self.tmp_path)
+
+    def request(self, path, data=None):
+        if data is not None:
+            data = json.dumps(data).encode("utf-8")
+        request = Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urlopen(request) as response:
+            content = response.read()
+            if response.headers["Content-Type"] == "application/json":
+                return json.loads(content.decode("utf-8"))
+            return content
+
+    def submit(self, spec):
+        status = self.request("/reports", spec)
+        self.executor.submit(lambda: None).result()
+        return status["id"]
+
+    def test_check_spec(self):
+        """Test whether the params are checked and completed"""
+
+        spec = check_spec({"data_sources": ["git"], "format": "html"})
+        self.assertEqual(spec["interval"], "month")
+        self.assertEqual(spec["end_date"], "now")
+
+        wrong_specs = [[], {}, {"data_sources": ["gerrit"]},
+                       {"data_sources": ["git"], "interval": "week"},
+                       {"data_sources": ["git"], "indices": ["git", "github"]},
+                       {"data_sources": ["git"], "end_date": "soon"},
+                       {"data_sources": ["git"], "output": "report.pdf"}]
+        for spec in wrong_specs:
+            with self.assertRaises(ValueError):
+                check_spec(spec)
+
+    def test_report(self):
+        """Test whether a report is generated and its files got"""
+
+        report_id = self.submit({"data_sources": ["git"], "indices": ["git_enrich"]})
+
+        status = self.request("/reports/" + report_id)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["params"]["indices"], ["git_enrich"])
+        self.assertDictEqual(status["artifacts"], {"report": "report.pdf",
+                                                   "data": ["activity/git_commits.csv"]})
+        self.assertEqual(self.request("/reports"), [status])
+
+        content = self.request("/reports/%s/files/report.pdf" % report_id)
+        self.assertEqual(content, b"http://localhost:9200")
+        for path in ["/reports/%s/files/../../x" % report_id, "/reports/%s/files/none.csv" % report_id,
+                     "/reports/unknown", "/other"]:
+            with self.assertRaises(HTTPError) as error:
+                self.request(path)
+            self.assertEqual(error.exception.code, 404)
+
+    def test_max_reports(self):
+        """Test whether only the status of the last finished reports is kept"""
+
+        self.service.max_reports = 1
+        report_ids = [self.submit({"data_sources": ["git"]}) for _ in range(3)]
+
+        with self.assertRaises(HTTPError) as error:
+            self.request("/reports/" + report_ids[0])
+        self.assertEqual(error.exception.code, 404)
+        self.assertEqual(self.request("/reports/" + report_ids[-1])["status"], "done")
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp_path, report_ids[0])))
+
+    def test_failed_report(self):
+        """Test whether the errors of the reports are shown"""
+
+        report_id = self.submit({"data_sources": ["git"], "name": "fail"})
+        status = self.request("/reports/" + report_id)
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("Report failed", status["error"])
+
+        with self.assertRaises(HTTPError) as error:
+            self.request("/reports", {"data_sources": ["unknown"]})
+        self.assertEqual(error.exception.code, 400)
+
+    def test_queue_full(self):
+        """Test whether reports are rejected when the queue is full"""
+
+        running = threading.Event()
+        self.executor.submit(running.wait)
+
+        status = self.request("/reports", {"data_sources": ["git"]})
+        self.assertEqual(status["status"], "queued")
+        with self.assertRaises(HTTPError) as error:
+            self.request("/reports", {"data_sources": ["git"]})
+        self.assertEqual(error.exception.code, 503)
+
+        running.set()
+        self.executor.submit(lambda: None).result()
+        self.assertEqual(self.request("/reports/" + status["id"])["status"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
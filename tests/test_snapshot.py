@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2019 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from datetime import datetime
+
+import pandas as pd
+from numpy.testing import assert_array_equal
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from manuscripts.clients import reset_clients
+from manuscripts.memory_engine import MemoryClient
+from manuscripts2.elasticsearch import Index, Query, get_trend
+from manuscripts2.metrics import git, github_prs
+from manuscripts2.snapshot import (SNAPSHOT_FIELDS, create_snapshot,
+                                   get_field_types, write_snapshot)
+
+from utils import load_json_file
+
+try:
+    import pyarrow.parquet
+    PYARROW = True
+except ImportError:
+    PYARROW = False
+
+TOP_AUTHORS = "data/test_data/git_top_authors.json"
+TIME_TO_CLOSE_PRS_MEDIAN = "data/test_data/time_to_close_prs_days_median.csv"
+
+
+def read_hits(name):
+    with open(os.path.join("data/indices", name + ".json")) as f:
+        return [json.loads(line) for line in f]
+
+
+def read_properties(name):
+    with open(os.path.join("data/mappings", name + "_mappings.json")) as f:
+        return json.load(f)["mappings"]["items"]["properties"]
+
+
+@unittest.skipUnless(PYARROW, "pyarrow not installed")
+class TestSnapshot(unittest.TestCase):
+    """Tests for the columnar snapshots of the indices"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        Query.interval_ = "month"
+        self.start = datetime(2015, 1, 1)
+        self.end = datetime(2018, 7, 10)
+
+    def tearDown(self):
+        reset_clients()
+        shutil.rmtree(self.tmp_path)
+
+    def write(self, name, index, data_source, batch_size=100):
+        field_types = get_field_types(read_properties(name), SNAPSHOT_FIELDS[data_source])
+        filename = os.path.join(self.tmp_path, index + ".parquet")
+        return write_snapshot(iter(read_hits(name)), filename, field_types, batch_size=batch_size)
+
+    def test_field_types(self):
+        """Test whether the types of the fields are the ones of the mappings"""
+
+        field_types = get_field_types(read_properties("github_prs"), ["closed_at", "id", "unknown"])
+        self.assertDictEqual(field_types, {"closed_at": "date", "id": "long", "unknown": "keyword"})
+
+    def test_write_snapshot(self):
+        """Test whether all the items are written with the types of the mappings"""
+
+        nitems = self.write("github_prs", "github_prs_enrich", "github_prs")
+        self.assertEqual(nitems, len(read_hits("github_prs")))
+        self.assertListEqual(os.listdir(self.tmp_path), ["github_prs_enrich.parquet"])
+
+        schema = pyarrow.parquet.read_schema(os.path.join(self.tmp_path, "github_prs_enrich.parquet"))
+        self.assertEqual(str(schema.field("closed_at").type), "timestamp[ms, tz=UTC]")
+        self.assertEqual(str(schema.field("time_to_close_days").type), "float")
+        self.assertEqual(str(schema.field("pull_request").type), "bool")
+        self.assertEqual(str(schema.field("author_uuid").type), "string")
+
+    def test_empty_snapshot(self):
+        """Test whether a snapshot is written for an empty index"""
+
+        field_types = get_field_types(read_properties("git_commit"), SNAPSHOT_FIELDS["git"])
+        filename = os.path.join(self.tmp_path, "git.parquet")
+        self.assertEqual(write_snapshot(iter([]), filename, field_types), 0)
+
+        client = MemoryClient([filename])
+        response = client.search(index="git", body={"size": 0})
+        self.assertEqual(response['hits']['total'], 0)
+
+    def test_metrics(self):
+        """Test whether metrics computed from snapshots match the ones from Elasticsearch"""
+
+        self.write("git_commit", "git_enrich", "git")
+        self.write("github_prs", "github_prs_enrich", "github_prs")
+        client = MemoryClient([self.tmp_path])
+
+        index = Index(index_name="git_enrich", es=client)
+        commits = git.Commits(index, self.start, self.end)
+        self.assertEqual(get_trend(commits.timeseries()), (12, -41))
+
+        authors = git.Authors(index, self.start, self.end).aggregations()
+        authors_test = load_json_file(TOP_AUTHORS)
+        assert_array_equal(authors['keys'], authors_test['keys'])
+        assert_array_equal(authors['values'], authors_test['values'])
+
+        index = Index(index_name="github_prs_enrich", es=client)
+        days_to_close = github_prs.DaysToClosePRMedian(index, self.start, self.end)
+        median_ts = days_to_close.timeseries(dataframe=True)
+        median_test = pd.read_csv(TIME_TO_CLOSE_PRS_MEDIAN)
+        assert_array_equal(median_test['value'], median_ts['value'])
+
+        # Hits are built from the columns of the snapshot
+        body = {"_source": ["hash", "grimoire_creation_date"], "size": 1,
+                "sort": [{"grimoire_creation_date": "asc"}]}
+        hit = client.search(index="git_enrich", body=body)['hits']['hits'][0]
+        dates = pd.to_datetime([item['_source']['grimoire_creation_date'] for item in read_hits("git_commit")],
+                               utc=True, format='ISO8601')
+        self.assertEqual(hit['_source']['grimoire_creation_date'], dates.min().isoformat())
+        self.assertListEqual(sorted(hit['_source']), ["grimoire_creation_date", "hash"])
+
+    def test_unknown_data_source(self):
+        """Test whether an error is raised for data sources without snapshot fields"""
+
+        with self.assertRaises(RuntimeError):
+            create_snapshot("http://localhost:9200", ["gerrit"], self.tmp_path)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -133,6 +133,33 @@ class TestReport(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             Report.build_period_name(period_date, interval="day")
 
+    def test_copy_project_data(self):
+        """Test whether the data of a project is copied as the general project one"""
+
+        temp_path = tempfile.mkdtemp(prefix='manuscripts_')
+        self.report.data_dir = temp_path
+        self.report.project_names = ['b', 'a_b']
+
+        os.makedirs(os.path.join(temp_path, 'data'))
+        os.makedirs(os.path.join(temp_path, 'figs'))
+        for name in ['data/git_authors_general.csv', 'data/git_authors_b.csv',
+                     'data/git_authors_a_b.csv', 'data/efficiency.csv',
+                     'figs/git_authors_b.eps', 'figs/git_authors_a_b.eps']:
+            with open(os.path.join(temp_path, name), 'w') as f:
+                f.write(name)
+
+        project_path = os.path.join(temp_path, 'projects', 'b')
+        self.report._Report__copy_project_data('b', project_path)
+
+        self.assertListEqual(sorted(os.listdir(os.path.join(project_path, 'data'))),
+                             ['efficiency.csv', 'git_authors_general.csv'])
+        self.assertListEqual(os.listdir(os.path.join(project_path, 'figs')),
+                             ['git_authors_general.eps'])
+        with open(os.path.join(project_path, 'data', 'git_authors_general.csv')) as f:
+            self.assertEqual(f.read(), 'data/git_authors_b.csv')
+
+        shutil.rmtree(temp_path)
+
     def tearDown(self):
         pass
 
@@ -19,6 +19,7 @@
 #     Pranjal Aswani <aswani.pranjal@gmail.com>
 #
 
+import asyncio
 import os
 import json
 
@@ -35,3 +36,33 @@ def load_json_file(filename, mode="r"):
     with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), mode) as f:
         json_content = json.load(f)
     return json_content
+
+
+class CountingClient():
+    """Client keeping the indices and the bodies of the searches sent to another client"""
+
+    def __init__(self, client):
+        self.client = client
+        self.indices = []
+        self.bodies = []
+
+    def search(self, index=None, body=None, **params):
+        self.indices.append(",".join(index) if isinstance(index, (list, tuple)) else index)
+        self.bodies.append(body)
+        return self.client.search(index=index, body=body, **params)
+
+
+class AsyncCountingClient():
+    """Async client counting the searches running at the same time"""
+
+    def __init__(self, client):
+        self.client = client
+        self.running = 0
+        self.max_running = 0
+
+    async def search(self, index=None, body=None, **params):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return self.client.search(index=index, body=body, **params)